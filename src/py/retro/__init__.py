@@ -6,14 +6,15 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 12-Apr-2006
-# Last mod  : 02-Mar-2020
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 import sys
 import os
 from retro.core import asJSON, asPrimitive, cut, escapeHTML, NOTHING, \
-    ensureBytes, ensureUnicode, ensureString, IS_PYTHON3, quote, unquote, Request, Response
-from retro.web import on, expose, predicate, when, restrict, cache, \
+    ensureBytes, ensureUnicode, ensureString, IS_PYTHON3, quote, unquote, Request, Response, \
+    Channel
+from retro.web import on, expose, predicate, when, restrict, cache, conditional, \
     Component, Application, \
     Dispatcher, Configuration, ValidationError, WebRuntimeError
 
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro - HTTP Toolkit
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# License   : Revised BSD License
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+import sys
+import time
+import atexit
+import random
+import threading
+import collections
+import json
+
+try:
+    import reporter
+
+    logging = reporter.bind("retro")
+except ImportError as e:
+    import logging
+
+__doc__ = """
+The access log pipeline takes the logging of requests out of the request
+hot path. Servers call `log()` with the request's method, URI, status,
+bytes, duration and peer, which appends a fixed-size record to an in-memory
+queue. A background writer thread wakes up periodically, drains the queue
+and writes the records in batches to the configured sinks.
+
+>   import retro.accesslog
+>   retro.accesslog.configure(format="json", path="access.log", sample=0.1)
+
+The default pipeline uses the colored console output, which is meant for
+development servers.
+"""
+
+# -----------------------------------------------------------------------------
+#
+# RECORDS
+#
+# -----------------------------------------------------------------------------
+
+AccessRecord = collections.namedtuple(
+    "AccessRecord", ("time", "method", "uri", "status", "bytes", "duration", "peer")
+)
+
+# -----------------------------------------------------------------------------
+#
+# FORMATTERS
+#
+# -----------------------------------------------------------------------------
+
+RESET = "\033[0m"
+GRADIENT = (
+    59,
+    66,
+    108,
+    151,
+    194,
+    231,
+    230,
+    229,
+    228,
+    227,
+    226,
+    220,
+    214,
+    208,
+    202,
+    160,
+    196,
+)
+CLF_MONTHS = (
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+)
+
+
+def normal(color):
+    return "\033[38;5;%sm" % (color)
+
+
+def bold(color):
+    return "\033[1;38;5;%sm" % (color)
+
+
+def formatCLF(record):
+    """Formats the record in the Common Log Format."""
+    t = time.gmtime(record.time)
+    return '{0} - - [{1:02d}/{2}/{3:04d}:{4:02d}:{5:02d}:{6:02d} +0000] "{7} {8} HTTP/1.1" {9} {10}'.format(
+        record.peer or "-",
+        t.tm_mday,
+        CLF_MONTHS[t.tm_mon - 1],
+        t.tm_year,
+        t.tm_hour,
+        t.tm_min,
+        t.tm_sec,
+        record.method or "-",
+        record.uri or "-",
+        record.status or "-",
+        record.bytes or "-",
+    )
+
+
+def formatJSON(record):
+    """Formats the record as a one-line JSON object."""
+    return json.dumps(record._asdict(), separators=(",", ":"))
+
+
+class ConsoleFormatter:
+    """Formats records as the colored, fixed-width lines used by the
+    development servers. The color of the duration is relative to the
+    fastest and slowest requests seen so far."""
+
+    def __init__(self):
+        self.minTime = None
+        self.maxTime = None
+
+    def __call__(self, record):
+        method = record.method or "?"
+        uri = record.uri or "?"
+        status = record.status or 600
+        elapsed = record.duration
+        self.minTime = min(elapsed, self.minTime or elapsed)
+        self.maxTime = max(elapsed, self.maxTime or elapsed)
+        tk = (1.0 * elapsed - self.minTime) / (self.maxTime or 1)
+        sk = min(1.0, (1.0 * status / 500.0))
+        ti = round(tk * (len(GRADIENT) - 1))
+        si = round(sk * (len(GRADIENT) - 1))
+        uri_color = RESET
+        if method == "HEAD":
+            uri_color = normal(GRADIENT[0])
+        elif status > 400:
+            uri_color = normal(GRADIENT[-1])
+        status_color = 255
+        if status >= 500:
+            status_color = 196  # Red
+        elif status >= 400:
+            status_color = 202  # Orange
+        return "{reset}{method_start}{method:7s}{method_end} {uri_start}{uri:70s}{reset} {status_start}[{status:3d}]{status_end} {elapsed_start}in {elapsed:2.3f}s{elapsed_end}{reset}".format(
+            method=method,
+            method_start=(bold if method in ("GET", "POST", "DELETE") else normal)(
+                status_color
+            ),
+            method_end=RESET,
+            status=status,
+            status_start=normal(GRADIENT[si]),
+            status_end=RESET,
+            uri=uri[:69] + "…" if uri and len(uri) > 70 else uri,
+            uri_start=uri_color,
+            elapsed=elapsed,
+            elapsed_start=normal(GRADIENT[ti]),
+            elapsed_end=RESET,
+            reset=RESET,
+        )
+
+
+FORMATS = {
+    "clf": formatCLF,
+    "json": formatJSON,
+    "console": ConsoleFormatter,
+}
+
+# -----------------------------------------------------------------------------
+#
+# SINKS
+#
+# -----------------------------------------------------------------------------
+
+
+class Sink:
+    """Sinks receive batches of records from the writer thread and write
+    them out using their formatter. This is an abstract class: sinks must
+    implement `write`."""
+
+    def __init__(self, formatter=formatCLF):
+        self.formatter = formatter
+
+    def write(self, records):
+        """Writes the given list of records (abstract)."""
+        raise NotImplementedError
+
+    def open(self):
+        """Called when the writer thread starts, so that sinks closed by
+        `AccessLog.stop` can be reopened."""
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StreamSink(Sink):
+    """Writes each batch to a stream (`sys.stderr` by default) in a single
+    call."""
+
+    def __init__(self, stream=None, formatter=formatCLF):
+        Sink.__init__(self, formatter)
+        self.stream = stream or sys.stderr
+
+    def write(self, records):
+        f = self.formatter
+        self.stream.write("".join(f(_) + "\n" for _ in records))
+
+    def flush(self):
+        self.stream.flush()
+
+
+class FileSink(StreamSink):
+    """Appends each batch to the file at the given path, which is reopened
+    if the access log is started again once stopped."""
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path, formatter=formatCLF):
+        stream = open(path, "a", buffering=self.BUFFER_SIZE)
+        StreamSink.__init__(self, stream, formatter)
+        self.path = path
+
+    def open(self):
+        if self.stream.closed:
+            self.stream = open(self.path, "a", buffering=self.BUFFER_SIZE)
+
+    def close(self):
+        self.stream.close()
+
+
+class LoggingSink(Sink):
+    """Sends each record to `logging.info`, which is what the development
+    servers used to do directly."""
+
+    def __init__(self, formatter=None, logger=None):
+        Sink.__init__(self, formatter or ConsoleFormatter())
+        self.logger = logger or logging
+
+    def write(self, records):
+        f = self.formatter
+        for _ in records:
+            self.logger.info(f(_))
+
+
+# -----------------------------------------------------------------------------
+#
+# ACCESS LOG
+#
+# -----------------------------------------------------------------------------
+
+
+class AccessLog:
+    """Queues access records and writes them in batches from a background
+    thread. Appending to the queue does not take any lock, so `log()` is
+    safe to call from the event loop and from request threads.
+
+    - `sample` is the ratio (0-1) of successful requests to log, errors
+      (status >= 400) are always logged.
+    - `limit` is the maximum number of queued records, records are dropped
+      (and counted in `dropped`) when the writer can't keep up.
+    - `interval` is the delay (in seconds) between two batches.
+
+    The pending records are written when the interpreter exits.
+    """
+
+    BATCH_SIZE = 512
+
+    def __init__(self, sinks=None, sample=1.0, limit=65536, interval=0.25):
+        self.sinks = list(sinks) if sinks else [LoggingSink()]
+        self.sample = sample
+        self.limit = limit
+        self.interval = interval
+        self.dropped = 0
+        self.queue = collections.deque()
+        self._thread = None
+        self._isRunning = False
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def log(self, method, uri, status, bytes=0, duration=0.0, peer=None):
+        """Enqueues an access record. This is the only method that
+        should be called from the request path."""
+        if self.sample < 1.0 and (status or 0) < 400 and random.random() >= self.sample:
+            return False
+        if len(self.queue) >= self.limit:
+            self.dropped += 1
+            return False
+        self.queue.append(
+            AccessRecord(time.time(), method, uri, status, bytes, duration, peer)
+        )
+        if not self._isRunning:
+            self.start()
+        return True
+
+    def start(self):
+        # NOTE: Concurrent requests might all see that the writer is not
+        # running, only the first one starts it.
+        with self._lock:
+            if not self._isRunning:
+                # The sinks were closed if the log was stopped
+                for sink in self.sinks:
+                    sink.open()
+                self._isRunning = True
+                self._wakeup.clear()
+                self._thread = threading.Thread(
+                    target=self.run, name="retro-accesslog", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Stops the writer thread, writing any pending record."""
+        with self._lock:
+            thread = self._thread if self._isRunning else None
+            self._isRunning = False
+            self._thread = None
+        if thread:
+            atexit.unregister(self.stop)
+            self._wakeup.set()
+            thread.join()
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+        return self
+
+    def run(self):
+        while self._isRunning:
+            self._wakeup.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Writes all the queued records to the sinks, in batches of at
+        most `BATCH_SIZE` records."""
+        queue = self.queue
+        while queue:
+            batch = []
+            while queue and len(batch) < self.BATCH_SIZE:
+                batch.append(queue.popleft())
+            for sink in self.sinks:
+                try:
+                    sink.write(batch)
+                except Exception as e:
+                    sys.stderr.write(
+                        "[!] retro.accesslog: sink {0} failed: {1}\n".format(sink, e)
+                    )
+        for sink in self.sinks:
+            sink.flush()
+        return self
+
+
+# -----------------------------------------------------------------------------
+#
+# API
+#
+# -----------------------------------------------------------------------------
+
+ACCESS_LOG = None
+
+
+def configure(format="console", path=None, stream=None, sample=1.0, sinks=None):
+    """Configures the access log used by the Retro servers, returning the
+    new `AccessLog`. The `format` is one of `console`, `clf` or `json`, and
+    records are written to the file at `path`, or to the given `stream`, or
+    to `logging` when neither is given. Custom `sinks` can be given
+    instead."""
+    global ACCESS_LOG
+    if sinks is None:
+        formatter = FORMATS[format]
+        formatter = formatter() if formatter is ConsoleFormatter else formatter
+        if path:
+            sinks = [FileSink(path, formatter)]
+        elif stream:
+            sinks = [StreamSink(stream, formatter)]
+        else:
+            sinks = [LoggingSink(formatter)]
+    if ACCESS_LOG:
+        ACCESS_LOG.stop()
+    ACCESS_LOG = AccessLog(sinks, sample=sample)
+    return ACCESS_LOG
+
+
+def get():
+    """Returns the current access log, creating the default one if
+    necessary."""
+    global ACCESS_LOG
+    if not ACCESS_LOG:
+        ACCESS_LOG = AccessLog()
+    return ACCESS_LOG
+
+
+def log(method, uri, status, bytes=0, duration=0.0, peer=None):
+    """Logs an access to the current access log."""
+    return (ACCESS_LOG or get()).log(method, uri, status, bytes, duration, peer)
+
+
+# EOF
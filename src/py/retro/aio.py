@@ -6,15 +6,23 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 15-Feb-2018
-# Last mod  : 12-Feb-2022
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 import asyncio
+import base64
 import collections
+import hashlib
+import struct
 import sys
 import types
 import time
+import zlib
 import retro.core
+import retro.accesslog
+from retro import metrics
+from retro.core import NOTHING
+from retro.accesslog import RESET, normal, bold
 from retro.contrib.localfiles import LocalFiles
 
 try:
@@ -34,46 +42,6 @@ relatively simple.
 """
 
 
-# -----------------------------------------------------------------------------
-#
-# HELPERS
-#
-# -----------------------------------------------------------------------------
-
-RESET = "\033[0m"
-GRADIENT = (
-    59,
-    66,
-    108,
-    151,
-    194,
-    231,
-    230,
-    229,
-    228,
-    227,
-    226,
-    220,
-    214,
-    208,
-    202,
-    160,
-    196,
-)
-
-
-def lerp(a, b, k):
-    return a + (b - a) * k
-
-
-def normal(color):
-    return "\033[38;5;%sm" % (color)
-
-
-def bold(color):
-    return "\033[1;38;5;%sm" % (color)
-
-
 # -----------------------------------------------------------------------------
 #
 # ASYNC REQUEST
@@ -85,6 +53,8 @@ class AsyncRequest(retro.core.Request):
     """A specialized retro Request object that uses coroutines to
     load the data."""
 
+    STREAM_CHUNK_SIZE = 64 * 1024
+
     def createRequestBodyLoader(self, request, complete=False):
         return AsyncRequestBodyLoader(request, complete)
 
@@ -94,6 +64,11 @@ class AsyncRequest(retro.core.Request):
         # the request as the context is not recycled.
         self._headers = self._aioInput.headers
 
+    def header(self, name):
+        # NOTE: The context's headers are kept as sent by the client,
+        # so we can't rely on the normalized lookup.
+        return self._aioInput.header(name)
+
     # =========================================================================
     # LOADING
     # =========================================================================
@@ -115,13 +90,67 @@ class AsyncRequest(retro.core.Request):
         if not self._bodyLoader.isComplete():
             is_loaded = await self._bodyLoader.load(size)
 
+    # =========================================================================
+    # STREAMING
+    # =========================================================================
+
+    async def stream(self, chunkSize=STREAM_CHUNK_SIZE):
+        """Yields the request body in chunks of at most `chunkSize` bytes,
+        as they are received. The chunks are not buffered, which means
+        that the body is consumed and won't be available through `data()`
+        or decoded into params:
+
+        >   async for chunk in request.stream():
+        >       digest.update(chunk)
+        """
+        loader = self._streamLoader()
+        while not loader.isComplete():
+            yield await loader.loadChunk(min(loader.remainingBytes, chunkSize))
+
+    async def readinto(self, buffer):
+        """Reads the next bytes of the request body into the given
+        (preallocated) buffer, returning the number of bytes read, which
+        is `0` once the body is consumed. Like `stream()`, this bypasses
+        the request's data."""
+        loader = self._streamLoader()
+        view = memoryview(buffer).cast("B")
+        size = len(view)
+        offset = 0
+        while offset < size and not loader.isComplete():
+            chunk = await loader.loadChunk(min(loader.remainingBytes, size - offset))
+            n = len(chunk)
+            view[offset : offset + n] = chunk
+            offset += n
+        return offset
+
+    async def streamJSON(self, chunkSize=STREAM_CHUNK_SIZE):
+        """The asynchronous version of `Request.streamJSON`:
+
+        >   async for record in request.streamJSON():
+        >       store.add(record)
+        """
+        if self.isLoaded() or self.contentLength < self.JSON_STREAM_THRESHOLD:
+            if not self.isLoaded():
+                await self.load(decode=False)
+            for item in self._streamJSONLoaded():
+                yield item
+            return
+        parser = retro.core.JSONStream()
+        async for chunk in self.stream(chunkSize):
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.feed(b"", True):
+            yield item
+
     # =========================================================================
     # DATA LOADING & PROCESSING
     # =========================================================================
 
-    async def data(self, data=retro.core.NOTHING, asFile=False, partial=False):
+    async def data(
+        self, data=retro.core.NOTHING, asFile=False, partial=False, asView=False
+    ):
         await self._data_load(data, partial)
-        return self._data_process(data, asFile, partial)
+        return self._data_process(data, asFile, partial, asView)
 
     async def _data_load(self, data, partial):
         if data is retro.core.NOTHING and not partial:
@@ -141,35 +170,45 @@ class AsyncRequestBodyLoader(retro.core.RequestBodyLoader):
     requests's body."""
 
     async def load(self, size=None, writeData=True):
+        """Loads the given number of bytes of the body (all by default),
+        writing them to the request's body, which is returned. When
+        `writeData` is false, the bytes are returned instead."""
         # If the load is complete, we don't have anything to do
         to_read = self._load_prepare(size)
-        read_data = None
-        iteration = 0
+        # NOTE: The chunks are only kept when they're not written to the
+        # request's body, which would otherwise double the memory used.
+        chunks = None if writeData else []
         read_count = 0
-        while read_count < to_read:
-            d = await self._load_load(to_read - read_count)
-            if d is None:
-                break
-                self._isComplete = True
+        while to_read and read_count < to_read:
+            d = await self.loadChunk(to_read - read_count)
+            read_count += len(d)
+            # NOTE: We stream the data here
+            if writeData:
+                self.request._data.write(d)
             else:
-                read_data = d if iteration == 0 else read_data + d
-                read_count += len(d)
-                iteration += 1
-                # NOTE: We stream the data here
-                if writeData:
-                    self.request._data.write(d)
-                # We break early if we did not read anything
-                if read_count == 0:
-                    break
+                chunks.append(d)
         # NOTE: We don't call self._load_post like in the sync version, because
         # we've been streaming theresult
-        return read_data
+        if writeData:
+            return self.request._data
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    async def loadChunk(self, size):
+        """Reads at most `size` bytes of the body, as soon as they're
+        available, raising an `IOError` if the body was cut."""
+        d = await self._load_load(size)
+        if not d:
+            raise IOError(
+                "Request was cut, read {0:d} out of {1:d} bytes".format(
+                    self.contentRead, self.contentLength
+                )
+            )
+        return d
 
     async def _load_load(self, to_read):
         assert to_read != 0
         read_data = await self.request._environ["wsgi.input"].read(to_read)
-        read_count = len(read_data)
-        self.contentRead += read_count
+        self._load_count(len(read_data))
         return read_data
 
 
@@ -185,11 +224,16 @@ class HTTPContext(object):
     """Parses an HTTP request and headers from a stream through the `feed()`
     method."""
 
-    def __init__(self, address, port, stats):
+    def __init__(self, address, port, stats, timeout=None):
         self.address = address
         self.port = port
         self.started = time.time()
         self.stats = stats
+        # NOTE: The timeout is the maximum time (in seconds) we wait for
+        # a single read of the body to complete, which protects from
+        # clients trickling their body one byte at a time.
+        self.timeout = timeout
+        self.peer = None
         self.reset()
 
     def reset(self):
@@ -201,11 +245,29 @@ class HTTPContext(object):
         self.rest = None
         self.status = None
         self._stream = None
+        self.reserved = 0
+        self.isAdmitted = False
         self.started = time.time()
 
     def input(self, stream):
         self._stream = stream
 
+    def header(self, name):
+        """Returns the value of the given header (case insensitive)"""
+        name = name.lower()
+        for k, v in self.headers.items():
+            if k.lower() == name:
+                return v
+        return None
+
+    @property
+    def contentLength(self):
+        """Returns the declared content length (0 when not given)"""
+        try:
+            return max(0, int(self.header("content-length") or 0))
+        except ValueError:
+            return 0
+
     def feed(self, data):
         """Feeds data into the context."""
         if self.step >= 2:
@@ -293,29 +355,34 @@ class HTTPContext(object):
         # it's going to be used often.
         if rest is None:
             if self._stream:
-                if size is None:
-                    res = await self._stream.read()
-                    return res
-                else:
-                    # FIXME: Somewhow when returning directly there
-                    # is an issue when receiving large uploaded files, it
-                    # will block forever.
-                    res = await self._stream.read(size)
-                    return res
+                # FIXME: Somewhow when returning directly there
+                # is an issue when receiving large uploaded files, it
+                # will block forever.
+                res = await self._read(size)
+                return res
             else:
                 return b""
         else:
             self.rest = None
             if size is None:
                 if self._stream:
-                    return rest + (await self._stream.read())
+                    return rest + (await self._read())
                 else:
                     return rest
             elif len(rest) > size:
                 self.rest = rest[size:]
                 return rest[:size]
             else:
-                return rest + (await self._stream.read(size - len(rest)))
+                return rest + (await self._read(size - len(rest)))
+
+    async def _read(self, size=None):
+        """Reads from the underlying stream, raising an `asyncio.TimeoutError`
+        if the read takes more than `timeout` seconds."""
+        read = self._stream.read() if size is None else self._stream.read(size)
+        if self.timeout:
+            return await asyncio.wait_for(read, self.timeout)
+        else:
+            return await read
 
     def export(self):
         """Exports a JSONable representation of the context."""
@@ -363,12 +430,405 @@ class HTTPContext(object):
             "SERVER_PORT": self.port,
             # SEE: https://www.python.org/dev/peps/pep-0333/#url-reconstruction
         }
-        # We set the additional headers
+        # We set the additional headers, both as-is (which is what previous
+        # versions did) and prefixed with HTTP_, as mandated by WSGI.
         for k, v in self.headers.items():
-            res[k.upper().replace("-", "_")] = v
+            name = k.upper().replace("-", "_")
+            res[name] = v
+            if name != "CONTENT_TYPE" and name != "CONTENT_LENGTH":
+                res["HTTP_" + name] = v
         return res
 
 
+# -----------------------------------------------------------------------------
+#
+# WEBSOCKET
+#
+# -----------------------------------------------------------------------------
+# SEE: https://tools.ietf.org/html/rfc6455
+# SEE: https://tools.ietf.org/html/rfc7692
+
+
+class WebSocketClosed(Exception):
+    """Raised when sending on a closed WebSocket."""
+
+
+class WebSocket(object):
+    """An RFC 6455 WebSocket bound to an upgraded connection. WebSocket
+    handlers are registered with `@on(WS="/path")` and invoked as
+    `handler(request, ws, **variables)` once the handshake is done:
+
+    >   @on(WS="/echo")
+    >   async def echo(self, request, ws):
+    >       async for message in ws:
+    >           await ws.send(message)
+
+    Messages are `str` for text frames and `bytes` for binary frames,
+    fragmented messages are reassembled and pings are answered
+    automatically. The `permessage-deflate` extension is negotiated when
+    `COMPRESSION` is set, without context takeover so that idle connections
+    don't hold any zlib state."""
+
+    __slots__ = (
+        "reader",
+        "writer",
+        "context",
+        "rest",
+        "isClosed",
+        "closeCode",
+        "maxMessageSize",
+        "isCompressed",
+        "written",
+    )
+
+    METHOD = "WS"
+    VERSION = "13"
+    GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    COMPRESSION = True
+    COMPRESSION_THRESHOLD = 256
+    OP_CONTINUATION = 0x0
+    OP_TEXT = 0x1
+    OP_BINARY = 0x2
+    OP_CLOSE = 0x8
+    OP_PING = 0x9
+    OP_PONG = 0xA
+    OPCODES = (OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG)
+    CLOSE_NORMAL = 1000
+    CLOSE_GOING_AWAY = 1001
+    CLOSE_PROTOCOL_ERROR = 1002
+    CLOSE_INVALID_DATA = 1007
+    CLOSE_TOO_BIG = 1009
+
+    @classmethod
+    def IsUpgrade(cls, context):
+        """Tells if the given HTTP context is a WebSocket upgrade
+        request."""
+        upgrade = context.header("upgrade")
+        connection = context.header("connection")
+        return (
+            context.method == "GET"
+            and upgrade is not None
+            and upgrade.lower() == "websocket"
+            and connection is not None
+            and "upgrade" in connection.lower()
+        )
+
+    def __init__(self, reader, writer, context, maxMessageSize=None):
+        self.reader = reader
+        self.writer = writer
+        self.context = context
+        # NOTE: The client might have sent data along with the headers
+        self.rest = context.rest
+        context.rest = None
+        self.isClosed = False
+        self.closeCode = None
+        self.maxMessageSize = maxMessageSize
+        self.isCompressed = False
+        self.written = 0
+
+    # =========================================================================
+    # HANDSHAKE
+    # =========================================================================
+
+    def handshake(self):
+        """Writes the `101 Switching Protocols` response, returning `False`
+        if the request is not a valid WebSocket handshake."""
+        key = self.context.header("Sec-WebSocket-Key")
+        version = self.context.header("Sec-WebSocket-Version")
+        if not key or (version or "").strip() != self.VERSION:
+            return False
+        accept = base64.b64encode(
+            hashlib.sha1(key.strip().encode() + self.GUID).digest()
+        )
+        headers = [
+            b"HTTP/1.1 101 Switching Protocols",
+            b"Upgrade: websocket",
+            b"Connection: Upgrade",
+            b"Sec-WebSocket-Accept: " + accept,
+        ]
+        extensions = self.context.header("Sec-WebSocket-Extensions") or ""
+        if self.COMPRESSION and "permessage-deflate" in extensions:
+            self.isCompressed = True
+            headers.append(
+                b"Sec-WebSocket-Extensions: permessage-deflate; server_no_context_takeover; client_no_context_takeover"
+            )
+        self.writer.write(b"\r\n".join(headers) + b"\r\n\r\n")
+        return True
+
+    async def run(self, request, handler, variables):
+        """Does the handshake and runs the handler, closing the WebSocket
+        once the handler is done. Returns the number of bytes written."""
+        if not self.handshake():
+            version = self.context.header("Sec-WebSocket-Version")
+            if version and version.strip() != self.VERSION:
+                # NOTE: RFC 6455 §4.4 asks for a 426 listing the versions
+                # we support, so that the client can retry with one of them.
+                return self._reject(
+                    b"426 Upgrade Required",
+                    b"Unsupported WebSocket version",
+                    b"Sec-WebSocket-Version: " + self.VERSION.encode() + b"\r\n",
+                )
+            return self._reject(b"400 Bad Request", b"Bad WebSocket handshake")
+        self.context.status = 101
+        try:
+            await handler(request, self, **variables)
+        except (ConnectionError, asyncio.IncompleteReadError, WebSocketClosed) as e:
+            self.isClosed = True
+        finally:
+            if not self.isClosed:
+                await self.close(self.CLOSE_GOING_AWAY)
+        return self.written
+
+    def _reject(self, status, body, headers=b""):
+        """Writes an error response to a handshake that we can't accept,
+        returning the number of body bytes written."""
+        self.writer.write(
+            b"HTTP/1.1 "
+            + status
+            + b"\r\nContent-Length: "
+            + str(len(body)).encode()
+            + b"\r\n"
+            + headers
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        self.context.status = int(status.split(b" ", 1)[0])
+        return len(body)
+
+    # =========================================================================
+    # RECEIVING
+    # =========================================================================
+
+    async def _read(self, size):
+        rest = self.rest
+        if rest:
+            if len(rest) >= size:
+                self.rest = rest[size:] if len(rest) > size else None
+                return rest[:size]
+            else:
+                self.rest = None
+                return rest + (await self.reader.readexactly(size - len(rest)))
+        return await self.reader.readexactly(size)
+
+    async def _readFrame(self):
+        """Reads a frame, returning `(fin, rsv1, opcode, payload)`."""
+        head = await self._read(2)
+        b0 = head[0]
+        b1 = head[1]
+        fin = b0 & 0x80
+        rsv1 = b0 & 0x40
+        opcode = b0 & 0x0F
+        length = b1 & 0x7F
+        if not b1 & 0x80:
+            # Client frames must be masked
+            raise WebSocketError(self.CLOSE_PROTOCOL_ERROR, "Unmasked frame")
+        if opcode not in self.OPCODES:
+            raise WebSocketError(self.CLOSE_PROTOCOL_ERROR, "Unknown opcode")
+        # RSV2 and RSV3 are never negotiated, and RSV1 is only meaningful
+        # on the first frame of a data message once permessage-deflate is.
+        if b0 & 0x30 or (
+            rsv1
+            and not (
+                self.isCompressed and opcode in (self.OP_TEXT, self.OP_BINARY)
+            )
+        ):
+            raise WebSocketError(self.CLOSE_PROTOCOL_ERROR, "Reserved bits set")
+        if opcode >= self.OP_CLOSE:
+            # Control frames can't be fragmented and must fit in the 7-bit
+            # length, which also bounds what we buffer for pings.
+            if not fin:
+                raise WebSocketError(
+                    self.CLOSE_PROTOCOL_ERROR, "Fragmented control frame"
+                )
+            if length > 125:
+                raise WebSocketError(self.CLOSE_PROTOCOL_ERROR, "Control frame too big")
+        if length == 126:
+            length = struct.unpack("!H", await self._read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self._read(8))[0]
+        if self.maxMessageSize and length > self.maxMessageSize:
+            raise WebSocketError(self.CLOSE_TOO_BIG, "Frame too big")
+        mask = await self._read(4)
+        payload = await self._read(length) if length else b""
+        return fin, rsv1, opcode, self.unmask(payload, mask)
+
+    @staticmethod
+    def unmask(data, mask):
+        """XORs the data with the 4-byte mask, working on the whole
+        payload as a single integer, which is much faster than a loop."""
+        n = len(data)
+        if not n:
+            return data
+        m = (mask * (n // 4 + 1))[:n]
+        return (
+            int.from_bytes(data, "little") ^ int.from_bytes(m, "little")
+        ).to_bytes(n, "little")
+
+    async def receive(self):
+        """Returns the next message (`str` or `bytes`), or `None` once the
+        WebSocket is closed."""
+        if self.isClosed:
+            return None
+        fragments = None
+        opcode = None
+        compressed = False
+        size = 0
+        try:
+            while True:
+                fin, rsv1, op, payload = await self._readFrame()
+                if op >= self.OP_CLOSE:
+                    # Control frames can be interleaved with fragments
+                    if op == self.OP_PING:
+                        self._writeFrame(self.OP_PONG, payload)
+                    elif op == self.OP_CLOSE:
+                        code = (
+                            struct.unpack("!H", payload[:2])[0]
+                            if len(payload) >= 2
+                            else self.CLOSE_NORMAL
+                        )
+                        self.closeCode = code
+                        await self.close(code)
+                        return None
+                    continue
+                if op == self.OP_CONTINUATION:
+                    if fragments is None:
+                        raise WebSocketError(
+                            self.CLOSE_PROTOCOL_ERROR, "Unexpected continuation"
+                        )
+                else:
+                    if fragments is not None:
+                        raise WebSocketError(
+                            self.CLOSE_PROTOCOL_ERROR, "Expected continuation"
+                        )
+                    opcode = op
+                    compressed = rsv1 and self.isCompressed
+                    fragments = []
+                size += len(payload)
+                if self.maxMessageSize and size > self.maxMessageSize:
+                    raise WebSocketError(self.CLOSE_TOO_BIG, "Message too big")
+                fragments.append(payload)
+                if fin:
+                    break
+            data = fragments[0] if len(fragments) == 1 else b"".join(fragments)
+            if compressed:
+                # NOTE: We've negotiated client_no_context_takeover, so each
+                # message has its own compression context.
+                d = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = d.decompress(data + b"\x00\x00\xff\xff", self.maxMessageSize or 0)
+                if d.unconsumed_tail:
+                    raise WebSocketError(self.CLOSE_TOO_BIG, "Message too big")
+            if opcode == self.OP_TEXT:
+                try:
+                    return data.decode("utf-8")
+                except UnicodeDecodeError:
+                    raise WebSocketError(self.CLOSE_INVALID_DATA, "Invalid UTF-8")
+            else:
+                return data
+        except WebSocketError as e:
+            await self.close(e.code, e.reason)
+            return None
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.isClosed = True
+            return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    # =========================================================================
+    # SENDING
+    # =========================================================================
+
+    @staticmethod
+    def FrameHeader(opcode, length, fin=True, rsv1=False):
+        """Returns the header of a (server, so unmasked) frame."""
+        b0 = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+        if length < 126:
+            return struct.pack("!BB", b0, length)
+        elif length < 65536:
+            return struct.pack("!BBH", b0, 126, length)
+        else:
+            return struct.pack("!BBQ", b0, 127, length)
+
+    def _writeFrame(self, opcode, payload, rsv1=False):
+        frame = self.FrameHeader(opcode, len(payload), True, rsv1) + payload
+        self.writer.write(frame)
+        self.written += len(frame)
+
+    async def send(self, message):
+        """Sends the given message, as a text frame if it is a `str` and as
+        a binary frame otherwise, waiting for the write buffer to drain."""
+        if self.isClosed:
+            raise WebSocketClosed("WebSocket is closed")
+        if isinstance(message, str):
+            opcode = self.OP_TEXT
+            message = message.encode("utf-8")
+        else:
+            opcode = self.OP_BINARY
+        self._writeFrame(opcode, *self.encode(message))
+        await self.writer.drain()
+
+    def sendFrame(self, frame):
+        """Writes an already encoded frame (see `Frame`) without waiting,
+        which is what broadcasters should use to avoid encoding the same
+        message once per client."""
+        if self.isClosed:
+            raise WebSocketClosed("WebSocket is closed")
+        self.writer.write(frame)
+        self.written += len(frame)
+
+    def encode(self, data):
+        """Returns `(payload, rsv1)` for the given data, compressing it if
+        the compression was negotiated."""
+        if self.isCompressed and len(data) >= self.COMPRESSION_THRESHOLD:
+            c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            data = c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+            return data[:-4], True
+        else:
+            return data, False
+
+    @classmethod
+    def Frame(cls, message):
+        """Encodes the given message as an uncompressed frame that can be
+        sent to many WebSockets with `sendFrame`."""
+        if isinstance(message, str):
+            opcode = cls.OP_TEXT
+            message = message.encode("utf-8")
+        else:
+            opcode = cls.OP_BINARY
+        return cls.FrameHeader(opcode, len(message)) + message
+
+    async def ping(self, data=b""):
+        self._writeFrame(self.OP_PING, data)
+        await self.writer.drain()
+
+    async def close(self, code=CLOSE_NORMAL, reason=""):
+        """Sends a close frame and closes the WebSocket."""
+        if not self.isClosed:
+            self.isClosed = True
+            try:
+                self._writeFrame(
+                    self.OP_CLOSE, struct.pack("!H", code) + reason.encode("utf-8")
+                )
+                await self.writer.drain()
+            except (ConnectionError, RuntimeError) as e:
+                pass
+
+
+class WebSocketError(Exception):
+    """A protocol error that closes the WebSocket with the given code."""
+
+    def __init__(self, code, reason=""):
+        Exception.__init__(self, reason)
+        self.code = code
+        self.reason = reason
+
+
 # -----------------------------------------------------------------------------
 #
 # WSGI CONNECTION
@@ -386,6 +846,7 @@ class WSGIConnection(object):
     def __init__(self):
         # NOTE: We should probably have only one context
         self.context = None
+        self.server = None
 
     async def process(self, reader, writer, application, server):
         # FIXME: It seems that sometimes the response status is not properly communicated
@@ -393,20 +854,56 @@ class WSGIConnection(object):
         addr = writer.get_extra_info("peername")
         # We creates an HTTPContext that represents the incoming
         # request.
-        context = HTTPContext(server.address, server.port, server.stats)
+        context = HTTPContext(
+            server.address, server.port, server.stats, server.bodyTimeout
+        )
+        context.peer = addr
         self.context = context
-        # This parsers the input stream in chunks
-        n = self.BUFFER_SIZE
-        ends = False
-        started = time.time()
+        self.server = server
         # We only parse the REQUEST line and the HEADERS. We'll stop
         # once we reach the body. This means that we won't be reading
         # huge requests large away, but let the client decide how to
-        # process them.
+        # process them. Clients that take too long to send their headers
+        # (slowloris) are sent a 408 and disconnected.
+        try:
+            if server.headerTimeout:
+                await asyncio.wait_for(
+                    self._readHeaders(reader, context), server.headerTimeout
+                )
+            else:
+                await self._readHeaders(reader, context)
+        except asyncio.TimeoutError:
+            server.timeouts += 1
+            await self._respondError(writer, 408, "Request Timeout")
+            return False
+        # Now that we have the headers, we know the size of the body and
+        # can tell if the server has enough capacity to process the request.
+        if not server.admit(context):
+            await self._respondError(
+                writer,
+                503,
+                "Service Unavailable",
+                [("Retry-After", str(server.retryAfter))],
+            )
+            return False
+        try:
+            return await self._processRequest(reader, writer, application, context)
+        finally:
+            server.release(context)
+
+    async def _readHeaders(self, reader, context):
+        # This parsers the input stream in chunks. We keep on reading until
+        # the headers are complete or the client closes the connection, the
+        # header timeout taking care of clients that never complete.
+        n = self.BUFFER_SIZE
+        ends = False
         while not ends and context.step < 2:
             data = await reader.read(n)
-            ends = len(data) < n
+            ends = not data
             context.feed(data)
+        return context
+
+    async def _processRequest(self, reader, writer, application, context):
         # Now that we've parsed the REQUEST and HEADERS, we set the input
         # and let the application do the processing
         context.input(reader)
@@ -417,42 +914,59 @@ class WSGIConnection(object):
         def wrt(s, h):
             return self._startResponse(writer, context, s, h)
 
-        res = application(env, wrt)
+        if WebSocket.IsUpgrade(context):
+            res = await self._processWebSocket(reader, writer, application, context, env)
+            if res is None:
+                return True
+        else:
+            res = application(env, wrt)
+        written = await self._writeResult(writer, context, res, wrt)
+        self._logResponse(context, written)
+        await self._close(writer)
+        return True
+
+    async def _writeResult(self, writer, context, res, wrt):
+        """Writes the result of the application (a generator, a `Response`
+        or a coroutine producing a response), returning the number of bytes
+        written."""
         # Here we don't write bodies of HEAD requests, as some browsers
         # simply won't read the body.
         write_body = not (context.method == "HEAD")
         written = 0
         # NOTE: It's not clear why this returns different types
-        if isinstance(res, types.GeneratorType):
-            for _ in res:
-                data = self._ensureBytes(_)
-                written += len(data)
-                if write_body:
-                    writer.write(data)
-        else:
+        if not isinstance(res, types.GeneratorType):
             if asyncio.iscoroutine(res):
                 res = await res
             # NOTE: I'm not sure why we need to to asWSGI here
-            r = res.asWSGI(wrt)
-            for _ in r:
-                if isinstance(_, types.AsyncGeneratorType):
-                    async for v in _:
-                        data = self._ensureBytes(v)
-                        written += len(data)
-                        if writer._transport.is_closing():
-                            break
-                        if write_body:
-                            writer.write(data)
-                else:
-                    data = self._ensureBytes(_)
+            res = res.asWSGI(wrt)
+        for _ in res:
+            if isinstance(_, types.AsyncGeneratorType):
+                async for v in _:
+                    data = self._ensureBytes(v)
                     written += len(data)
                     if writer._transport.is_closing():
                         break
                     if write_body:
                         writer.write(data)
+                        # NOTE: Streams are usually long-lived, so we
+                        # apply backpressure to the generator rather
+                        # than buffering for slow clients.
+                        try:
+                            await writer.drain()
+                        except ConnectionError as e:
+                            break
+            else:
+                data = self._ensureBytes(_)
+                written += len(data)
                 if writer._transport.is_closing():
                     break
+                if write_body:
+                    writer.write(data)
+            if writer._transport.is_closing():
+                break
+        return written
 
+    async def _close(self, writer):
         # We need to let some time for the schedule to do other stuff, this
         # should prevent the `socket.send() raised exception` errors.
         # SEE: https://github.com/aaugustin/websockets/issues/84
@@ -473,6 +987,59 @@ class WSGIConnection(object):
                 pass
         writer.close()
 
+    async def _processWebSocket(self, reader, writer, application, context, env):
+        """Dispatches a WebSocket upgrade request to the handlers registered
+        with `@on(WS=...)`. Returns `None` when the connection was upgraded
+        and is now done, or a response to be sent as regular HTTP
+        otherwise (ie. no handler or a failed predicate)."""
+        # NOTE: That's the same tight coupling as in `Server.__init__`
+        dispatcher = application._dispatcher
+        handlers = dispatcher.match(env, method=WebSocket.METHOD)
+
+        def processor(request, handler, variables):
+            # The fallback handlers (not found, not authorized) are not
+            # WebSocket handlers and produce a regular response.
+            if not hasattr(handler, "_retro_on"):
+                return handler(request, **variables)
+            else:
+                ws = WebSocket(reader, writer, context, self.server.maxMessageSize)
+                return ws.run(request, handler, variables)
+
+        res = dispatcher.dispatch(env, handlers, processor)
+        if asyncio.iscoroutine(res):
+            # The request slot is released once the connection is upgraded,
+            # as WebSockets are only bound by the number of connections.
+            self.server.release(context)
+            written = await res
+            self._logResponse(context, written)
+            writer.close()
+            return None
+        else:
+            return res
+
+    async def _respondError(self, writer, status, reason, headers=()):
+        """Writes a minimal error response and closes the connection. This
+        is used when the request is rejected before reaching the
+        application."""
+        body = "{0} {1}".format(status, reason).encode()
+        writer.write(
+            "HTTP/1.1 {0} {1}\r\n".format(status, reason).encode()
+            + b"".join(
+                self._ensureBytes(h) + b": " + self._ensureBytes(v) + b"\r\n"
+                for h, v in headers
+            )
+            + b"Content-Type: text/plain\r\n"
+            + b"Content-Length: "
+            + str(len(body)).encode()
+            + b"\r\nConnection: close\r\n\r\n"
+            + body
+        )
+        try:
+            await writer.drain()
+        except OSError as e:
+            pass
+        writer.close()
+
     def _startResponse(
         self, writer, context, response_status, response_headers, exc_info=None
     ):
@@ -489,47 +1056,27 @@ class WSGIConnection(object):
             writer.write(self._ensureBytes(v))
             writer.write(b"\r\n")
         writer.write(b"\r\n")
-        self._logResponse(context)
 
-    def _logResponse(self, context):
-        method = context.method or "?"
-        uri = context.uri or "?"
-        status = context.status or 600
+    def _logResponse(self, context, written):
+        # NOTE: The formatting and writing of the log line is done by the
+        # access log's writer thread, we only update the stats here.
         elapsed = time.time() - context.started
-        stats = context.stats or {}
-        stats["min.time"] = min(elapsed, stats["min.time"] or elapsed)
-        stats["max.time"] = max(elapsed, stats["max.time"] or elapsed)
-        tk = (1.0 * elapsed - stats["min.time"]) / (stats["max.time"] or 1)
-        sk = min(1.0, (1.0 * status / 500.0))
-        ti = round(tk * (len(GRADIENT) - 1))
-        si = round(sk * (len(GRADIENT) - 1))
-        uri_color = RESET
-        if method == "HEAD":
-            uri_color = normal(GRADIENT[0])
-        elif status > 400:
-            uri_color = normal(GRADIENT[-1])
-        status_color = 255
-        if status >= 500:
-            status_color = 196  # Red
-        elif status >= 400:
-            status_color = 202  # Orange
-        logging.info(
-            "{reset}{method_start}{method:7s}{method_end} {uri_start}{uri:70s}{reset} {status_start}[{status:3d}]{status_end} {elapsed_start}in {elapsed:2.3f}s{elapsed_end}{reset}".format(
-                method=method,
-                method_start=(bold if method in ("GET", "POST", "DELETE") else normal)(
-                    status_color
-                ),
-                method_end=RESET,
-                status=status,
-                status_start=normal(GRADIENT[si]),
-                status_end=RESET,
-                uri=uri[:69] + "…" if uri and len(uri) > 70 else uri,
-                uri_start=uri_color,
-                elapsed=elapsed,
-                elapsed_start=normal(GRADIENT[ti]),
-                elapsed_end=RESET,
-                reset=RESET,
-            )
+        stats = context.stats
+        if stats:
+            stats["min.time"] = min(elapsed, stats["min.time"] or elapsed)
+            stats["max.time"] = max(elapsed, stats["max.time"] or elapsed)
+        peer = context.peer
+        if metrics.ENABLED:
+            metrics.REQUEST_TIME.observe(elapsed)
+            metrics.RESPONSES.labels(context.status or 0).inc()
+            metrics.BYTES_OUT.inc(written)
+        retro.accesslog.log(
+            context.method,
+            context.uri,
+            context.status,
+            written,
+            elapsed,
+            peer[0] if isinstance(peer, tuple) else peer,
         )
 
     def _ensureBytes(self, value):
@@ -544,9 +1091,33 @@ class WSGIConnection(object):
 
 
 class Server(object):
-    """Simple asynchronous server"""
-
-    def __init__(self, application, address="127.0.0.1", port=8000):
+    """Simple asynchronous server, with admission control: connections,
+    in-flight requests and declared body bytes are capped so that the server
+    sheds load with a `503 Retry-After` instead of queuing unbounded work.
+
+    Any limit set to `0` or `None` is disabled."""
+
+    MAX_CONNECTIONS = 1024
+    MAX_REQUESTS = 256
+    MAX_BODY_BYTES = 256 * 1024 * 1024
+    HEADER_TIMEOUT = 10
+    BODY_TIMEOUT = 30
+    RETRY_AFTER = 1
+    MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+    def __init__(
+        self,
+        application,
+        address="127.0.0.1",
+        port=8000,
+        maxConnections=NOTHING,
+        maxRequests=NOTHING,
+        maxBodyBytes=NOTHING,
+        headerTimeout=NOTHING,
+        bodyTimeout=NOTHING,
+        retryAfter=NOTHING,
+        maxMessageSize=NOTHING,
+    ):
         self.application = application
         self.application._dispatcher._requestClass = AsyncRequest
         self.address = address
@@ -555,9 +1126,79 @@ class Server(object):
             "min.time": 99999999,
             "max.time": 0,
         }
+        self.maxConnections = self._option(maxConnections, self.MAX_CONNECTIONS)
+        self.maxRequests = self._option(maxRequests, self.MAX_REQUESTS)
+        self.maxBodyBytes = self._option(maxBodyBytes, self.MAX_BODY_BYTES)
+        self.headerTimeout = self._option(headerTimeout, self.HEADER_TIMEOUT)
+        self.bodyTimeout = self._option(bodyTimeout, self.BODY_TIMEOUT)
+        self.retryAfter = self._option(retryAfter, self.RETRY_AFTER)
+        self.maxMessageSize = self._option(maxMessageSize, self.MAX_MESSAGE_SIZE)
+        # These track the current occupancy of the server
+        self.connections = 0
+        self.requests = 0
+        self.bodyBytes = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _option(self, value, default):
+        return default if value is NOTHING else value
+
+    def occupancy(self):
+        """Returns a JSONable map of the current occupancy of the server
+        along with its limits, which is useful for monitoring."""
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "bodyBytes": self.bodyBytes,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "limits": {
+                "connections": self.maxConnections,
+                "requests": self.maxRequests,
+                "bodyBytes": self.maxBodyBytes,
+            },
+        }
+
+    def admit(self, context):
+        """Tells if the request described by the given context can be
+        processed, reserving a request slot and its declared body bytes
+        if so. Admitted contexts must be `release`d."""
+        size = context.contentLength
+        if (self.maxRequests and self.requests >= self.maxRequests) or (
+            self.maxBodyBytes and self.bodyBytes + size > self.maxBodyBytes
+        ):
+            self.rejected += 1
+            return False
+        self.requests += 1
+        self.bodyBytes += size
+        context.reserved = size
+        context.isAdmitted = True
+        return True
+
+    def release(self, context):
+        """Releases the slot and body bytes reserved by `admit`."""
+        if context.isAdmitted:
+            self.requests -= 1
+            self.bodyBytes -= context.reserved
+            context.reserved = 0
+            context.isAdmitted = False
 
     async def request(self, reader, writer):
         conn = WSGIConnection()
+        # We reject connections right away when we're over capacity, as
+        # there's no point in parsing a request we won't process.
+        if self.maxConnections and self.connections >= self.maxConnections:
+            self.rejected += 1
+            await conn._respondError(
+                writer,
+                503,
+                "Service Unavailable",
+                [("Retry-After", str(self.retryAfter))],
+            )
+            return
+        self.connections += 1
+        if metrics.ENABLED:
+            metrics.CONNECTIONS.inc()
         try:
             await conn.process(reader, writer, self.application, self)
         except ConnectionResetError:
@@ -569,6 +1210,24 @@ class Server(object):
                     color=reporter.COLOR_YELLOW,
                 )
             )
+        except asyncio.TimeoutError:
+            # The client was too slow sending its body
+            self.timeouts += 1
+            logging.info(
+                "{0:7s} {1} body read timed out after {2:0.3f}s".format(
+                    conn.context.method or "?",
+                    conn.context.uri,
+                    time.time() - conn.context.started,
+                )
+            )
+            if conn.context.status is None:
+                await conn._respondError(writer, 408, "Request Timeout")
+            else:
+                writer.close()
+        finally:
+            self.connections -= 1
+            if metrics.ENABLED:
+                metrics.CONNECTIONS.dec()
 
 
 # -----------------------------------------------------------------------------
@@ -578,9 +1237,13 @@ class Server(object):
 # -----------------------------------------------------------------------------
 
 
-def run(application, address, port):
+def run(application, address, port, **options):
+    """Runs the given application on the given address and port. Any extra
+    `options` (`maxConnections`, `maxRequests`, `maxBodyBytes`,
+    `headerTimeout`, `bodyTimeout`, `retryAfter`, `maxMessageSize`) are
+    passed to the `Server`."""
     loop = asyncio.get_event_loop()
-    server = Server(application, address, port)
+    server = Server(application, address, port, **options)
     coro = asyncio.start_server(server.request, address, port)
     server = loop.run_until_complete(coro)
     socket = server.sockets[0].getsockname()
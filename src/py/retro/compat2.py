@@ -9,6 +9,10 @@ def asyncio_iscoroutine(value):
     return False
 
 
+def asyncio_iscoroutinefunction(value):
+    return False
+
+
 def asyncio_isgenerator(value):
     return False
 
@@ -9,6 +9,7 @@ async def asyncio_await(value):
 
 
 asyncio_iscoroutine = asyncio.iscoroutine
+asyncio_iscoroutinefunction = asyncio.iscoroutinefunction
 
 
 def asyncio_isgenerator(value):
@@ -6,20 +6,44 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 07-Nov-2007
-# Last mod  : 20-Apr-2021
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 import re
 import os
+import sys
 import stat
+import mmap
+import shutil
+import zlib
+import struct
+import tempfile
+import contextlib
 import hashlib
 import threading
 import pickle
 import time
 import functools
 import types
+import asyncio
+import collections
+import heapq
+import itertools
+import concurrent.futures
+from retro.core import Response, compress_gzip, etagMatches
 from retro.web import cache_id, cache_signature
-from urllib.parse import urlencode
+from retro.metrics import REGISTRY
+from urllib.parse import urlencode, unquote_plus
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 RE_FILE_ESCAPE = re.compile(r"[\:\<\>/\(\)\[\]\{\}\$\~]|\.\.")
 
@@ -32,11 +56,69 @@ class CacheMiss(Exception):
     pass
 
 
-def cached(store, prefix=None):
-    """A generic decorator that can be used to cache any function."""
+class CacheTimeout(CacheError):
+    pass
+
+
+def cached(
+    store,
+    prefix=None,
+    timeout=None,
+    maxAge=None,
+    staleFor=None,
+    tags=None,
+    generations=False,
+):
+    """A generic decorator that can be used to cache any function. Concurrent
+    calls that miss the same key wait for a single computation of the value
+    (see `SingleFlight`), which also works for coroutine functions. Note
+    that `None` is considered a miss, as that's what expired keys give.
+
+    With `maxAge` or `staleFor`, values are stored as `CachedValue`s that
+    are fresh for `maxAge` seconds (0 by default) and then stale for
+    `staleFor` more seconds. Stale values are returned right away, while
+    the function is called again in the background (see `Revalidator`),
+    so that only the calls after both delays wait for the function. The
+    store should keep its entries for at least `maxAge + staleFor`.
+
+    Keys are tagged with the function name and the given `tags` (a list,
+    or a function of the arguments), so that `store.invalidate(tag=...)`
+    removes them (see `Cache.tag`). With `generations`, keys are not
+    tagged but include the generations of their tags instead, which
+    invalidating a tag advances: this avoids indexing large numbers of
+    keys, the previous values being left for the store to evict.
+
+    >   @cached(LRUCache(1000), maxAge=60, staleFor=600)
+    >   def report(day):
+    >       ...
+
+    >   @cached(store, tags=lambda user, page: ["user:" + user.id])
+    >   def timeline(user, page):
+    >       ...
+    >   store.invalidate(tag="user:" + user.id)
+    """
+
+    if (tags or generations) and not getattr(store, "TAGS", False):
+        raise CacheError("Cache does not support tags: {0}".format(store))
 
     def decorator(f):
-        def wrapper(*args, **kwargs):
+        is_async = asyncio.iscoroutinefunction(f)
+        flight = (AsyncSingleFlight if is_async else SingleFlight)(timeout)
+        is_stale = maxAge is not None or staleFor is not None
+        revalidator = Revalidator() if is_stale else None
+        is_tagged = not generations and getattr(store, "TAGS", False)
+
+        def key_tags(args, kwargs):
+            extra = tags(*args, **kwargs) if callable(tags) else tags or ()
+            return (f.__name__,) + tuple(extra)
+
+        def tag(key, args, kwargs):
+            # NOTE: Keys are only tagged once they are set, so that a call
+            # that fails doesn't leave its key in the tag index.
+            if is_tagged:
+                store.tag(key, *key_tags(args, kwargs))
+
+        def signature(args, kwargs):
             key = f.__name__
             base_key = ",".join(map(cache_id, args))
             rest_key = ",".join(
@@ -48,20 +130,354 @@ def cached(store, prefix=None):
             key += "(" + (",".join((base_key, rest_key))) + ")"
             if prefix:
                 key = prefix + ":" + key
-            if store.enabled:
-                if store.has(key):
-                    return store.get(key)
+            if generations:
+                key += "#" + ".".join(
+                    str(store.generation(_)) for _ in key_tags(args, kwargs)
+                )
+            return key
+
+        def compute(*args, **kwargs):
+            return CachedValue(f(*args, **kwargs), maxAge, staleFor)
+
+        async def async_compute(*args, **kwargs):
+            return CachedValue(await f(*args, **kwargs), maxAge, staleFor)
+
+        def refresh(key, *args, **kwargs):
+            value = store.set(key, compute(*args, **kwargs))
+            tag(key, args, kwargs)
+            return value
+
+        async def async_refresh(key, *args, **kwargs):
+            value = store.set(key, await async_compute(*args, **kwargs))
+            tag(key, args, kwargs)
+            return value
+
+        def wrapper(*args, **kwargs):
+            if not store.enabled:
+                return f(*args, **kwargs)
+            key = signature(args, kwargs)
+            if not is_stale:
+                value = flight.lookup(key, store)
+                if value is None:
+                    value = flight.run(key, store, f, *args, **kwargs)
+                    tag(key, args, kwargs)
+                return value
+            entry = flight.lookup(key, store)
+            if entry is None:
+                entry = flight.run(key, store, compute, *args, **kwargs)
+                tag(key, args, kwargs)
+            elif entry.fresh <= time.time():
+                revalidator.refresh(key, refresh, key, *args, **kwargs)
+            return entry.value
+
+        async def async_wrapper(*args, **kwargs):
+            if not store.enabled:
+                return await f(*args, **kwargs)
+            key = signature(args, kwargs)
+            if not is_stale:
+                value = flight.lookup(key, store)
+                if value is None:
+                    value = await flight.run(key, store, f, *args, **kwargs)
+                    tag(key, args, kwargs)
+                return value
+            entry = flight.lookup(key, store)
+            if entry is None:
+                entry = await flight.run(key, store, async_compute, *args, **kwargs)
+                tag(key, args, kwargs)
+            elif entry.fresh <= time.time():
+                revalidator.refresh(key, async_refresh, key, *args, **kwargs)
+            return entry.value
+
+        res = async_wrapper if is_async else wrapper
+        functools.update_wrapper(res, f)
+        res.flight = flight
+        res.revalidator = revalidator
+        return res
+
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+#
+# SINGLE FLIGHT
+#
+# -----------------------------------------------------------------------------
+
+
+class SingleFlight:
+    """Coalesces the concurrent computations of the same cache key: the
+    first thread that misses the key computes and stores the value, while
+    the others wait for it (at most `timeout` seconds) and get the same
+    value or exception. This prevents a popular key that expires from
+    being recomputed by every concurrent request."""
+
+    TIMEOUT = 30
+
+    class Flight:
+        __slots__ = ("done", "value", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, timeout=None):
+        self.timeout = self.TIMEOUT if timeout is None else timeout
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def lookup(self, key, store):
+        """Returns the value stored for the given key, or `None` if it is
+        missing or is a `CachedValue` that has expired."""
+        value = store.get(key) if store.has(key) else None
+        if isinstance(value, CachedValue) and value.expires <= time.time():
+            return None
+        return value
+
+    def run(self, key, store, function, *args, **kwargs):
+        """Returns the value for the given key, calling
+        `function(*args, **kwargs)` and setting it in the given store
+        unless another thread is already doing so."""
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.flights[key] = self.Flight()
+        if not is_leader:
+            if not flight.done.wait(self.timeout):
+                raise CacheTimeout(
+                    "Timed out after {0}s waiting for key: {1}".format(
+                        self.timeout, key
+                    )
+                )
+            elif flight.error is not None:
+                raise flight.error
+            else:
+                return flight.value
+        try:
+            # The value might have been set by a flight that just landed
+            value = self.lookup(key, store)
+            if value is None:
+                value = store.set(key, function(*args, **kwargs))
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise e
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def __len__(self):
+        return len(self.flights)
+
+
+class AsyncSingleFlight(SingleFlight):
+    """The asyncio version of `SingleFlight`, where the coroutines that
+    miss a key being computed await the same future. It must be used
+    from a single event loop."""
+
+    def __init__(self, timeout=None):
+        SingleFlight.__init__(self, timeout)
+
+    async def run(self, key, store, function, *args, **kwargs):
+        """Returns the value for the given key, awaiting
+        `function(*args, **kwargs)` and setting it in the given store
+        unless another coroutine is already doing so."""
+        future = self.flights.get(key)
+        if future is not None:
+            try:
+                # NOTE: The shield prevents a timeout from cancelling the
+                # computation that other coroutines might be waiting for.
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                raise CacheTimeout(
+                    "Timed out after {0}s waiting for key: {1}".format(
+                        self.timeout, key
+                    )
+                )
+        future = self.flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = self.lookup(key, store)
+            if value is None:
+                value = store.set(key, await function(*args, **kwargs))
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # We retrieve the exception so that asyncio doesn't log it
+            # when there is no other coroutine waiting.
+            future.exception()
+            raise e
+        finally:
+            del self.flights[key]
+
+
+# -----------------------------------------------------------------------------
+#
+# REVALIDATION
+#
+# -----------------------------------------------------------------------------
+
+
+class CachedValue:
+    """A value stored with a freshness lifetime: it is fresh for `maxAge`
+    seconds, and can then be served stale for `staleFor` more seconds
+    while it is being refreshed."""
+
+    __slots__ = ("value", "fresh", "expires")
+
+    def __init__(self, value, maxAge=None, staleFor=None):
+        self.value = value
+        self.fresh = time.time() + (maxAge or 0)
+        self.expires = self.fresh + (staleFor or 0)
+
+
+class Revalidator:
+    """Refreshes stale cache entries in the background, running at most
+    one refresh per key at a time. Functions are called in a pool of
+    `WORKERS` threads shared by all the revalidators, and coroutine
+    functions are run as tasks of the running event loop (ie. under
+    `retro.aio`). Failed refreshes are logged, the stale value being
+    served until it expires."""
+
+    WORKERS = 4
+    EXECUTOR = None
+    EXECUTOR_LOCK = threading.Lock()
+
+    @classmethod
+    def Executor(cls):
+        """Returns the thread pool shared by revalidators."""
+        if not cls.EXECUTOR:
+            with cls.EXECUTOR_LOCK:
+                if not Revalidator.EXECUTOR:
+                    Revalidator.EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                        cls.WORKERS, thread_name_prefix="retro-cache-refresh"
+                    )
+        return Revalidator.EXECUTOR
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Refreshing is key => future (or task)
+        self.refreshing = {}
+
+    def refresh(self, key, function, *args, **kwargs):
+        """Calls `function(*args, **kwargs)` in the background, unless the
+        given key is already being refreshed. Returns `True` when the
+        refresh was started."""
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing[key] = None
+        try:
+            if asyncio.iscoroutinefunction(function):
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    loop = None
+                if loop:
+                    future = loop.create_task(function(*args, **kwargs))
                 else:
-                    result = f(*args, **kwargs)
-                    store.set(key, result)
-                    return result
+                    future = self.Executor().submit(
+                        asyncio.run, function(*args, **kwargs)
+                    )
             else:
-                return f(*args, **kwargs)
+                future = self.Executor().submit(function, *args, **kwargs)
+        except BaseException:
+            self._done(key, None)
+            raise
+        self.refreshing[key] = future
+        future.add_done_callback(lambda _: self._done(key, _))
+        return True
+
+    def _done(self, key, future):
+        with self.lock:
+            self.refreshing.pop(key, None)
+        if future is not None and not future.cancelled() and future.exception():
+            sys.stderr.write(
+                "[!] retro.contrib.cache: could not refresh {0}: {1}\n".format(
+                    key, future.exception()
+                )
+            )
 
-        functools.update_wrapper(wrapper, f)
-        return wrapper
+    def __len__(self):
+        return len(self.refreshing)
 
-    return decorator
+
+# -----------------------------------------------------------------------------
+#
+# TAG INDEX
+#
+# -----------------------------------------------------------------------------
+
+
+class TagIndex:
+    """Maps tags (ie. function names, entity or user ids) to the keys they
+    were given (see `Cache.tag`), so that the keys of a tag are found
+    without scanning the cache. It also keeps a generation counter per
+    tag, incremented each time the tag is invalidated, so that keys that
+    include the generations of their tags are invalidated without being
+    indexed at all (see `cached(..., generations=True)`)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Tags is tag => set(keys), and keyTags is key => set(tags)
+        self.tags = {}
+        self.keyTags = {}
+        self.generations = {}
+
+    def add(self, key, tags):
+        with self.lock:
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            self.keyTags.setdefault(key, set()).update(tags)
+
+    def discard(self, key):
+        """Forgets the given key, once it's removed from the cache."""
+        if key not in self.keyTags:
+            return
+        with self.lock:
+            for tag in self.keyTags.pop(key, ()):
+                keys = self.tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+    def keys(self, tag):
+        return list(self.tags.get(tag, ()))
+
+    def pop(self, tag):
+        """Forgets the given tag and advances its generation, returning
+        the keys that had it."""
+        with self.lock:
+            keys = self.tags.pop(tag, ())
+            for key in keys:
+                tags = self.keyTags.get(key)
+                if tags is not None:
+                    tags.discard(tag)
+                    if not tags:
+                        del self.keyTags[key]
+        self.advance(tag)
+        return list(keys)
+
+    def generation(self, tag):
+        return self.generations.get(tag, 0)
+
+    def advance(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+
+    def clear(self):
+        """Forgets all the keys. The generations are kept, so that keys
+        with a previous generation are never valid again."""
+        with self.lock:
+            self.tags = {}
+            self.keyTags = {}
 
 
 # -----------------------------------------------------------------------------
@@ -74,9 +490,12 @@ def cached(store, prefix=None):
 class Cache:
 
     NEVER = 0
+    # Whether the tags are seen by all the users of the cache
+    TAGS = True
 
     def __init__(self):
         self.enabled = True
+        self.tagIndex = TagIndex()
 
     def get(self, key):
         raise NotImplementedError
@@ -99,21 +518,56 @@ class Cache:
     def cleanup(self):
         raise NotImplementedError
 
-    def invalidate(self, key):
-        if isinstance(key, str):
+    def tag(self, key, *tags):
+        """Gives the given tags to the given key, so that it is removed
+        when one of them is invalidated."""
+        self.tagIndex.add(key, tags)
+        return self
+
+    def tagged(self, tag):
+        """Returns the keys that were given the given tag."""
+        return self.tagIndex.keys(tag)
+
+    def generation(self, tag):
+        """Returns the number of times the given tag was invalidated."""
+        return self.tagIndex.generation(tag)
+
+    def invalidate(self, key=None, tag=None):
+        """Removes the given key, or the keys that were given the given tag.
+        A function invalidates the keys cached for it by `@cached`,
+        `retro.web.cache`, `wrap` and `memoized`, which are tagged with its
+        name. Keys that were set otherwise are not found by their prefix
+        anymore, and must be tagged with the function name to be
+        invalidated with it.
+        Invalidating a tag only costs as much as the number of keys it has,
+        and advances its generation.
+
+        >   cache.invalidate(tag="user:{0}".format(user.id))
+        >   cache.invalidate(getUser)
+        """
+        if tag is not None:
+            for k in self.tagIndex.pop(tag):
+                self.remove(k)
+        elif isinstance(key, str):
             if self.has(key):
                 self.remove(key)
         elif isinstance(key, types.FunctionType) or isinstance(key, types.MethodType):
-            prefix = key.__name__ + ":"
-            to_remove = [k for k in self.keys() if k.startswith(prefix)]
-            for k in to_remove:
-                self.remove(k)
+            self.invalidate(tag=key.__name__)
         else:
             raise Exception("Unsupported key type {0}: {1}".format(type(key), key))
         return self
 
     def wrap(self, keyExtractor):
+        """Returns a decorator that caches the results of the decorated
+        function at the key returned by `keyExtractor(*args, **kwargs)`.
+        The results of coroutine functions are awaited and cached, the
+        concurrent calls that miss a key awaiting the same call (see
+        `AsyncSingleFlight`). Keys are tagged with the function name."""
+
         def wrap_wrapper(function):
+            flight = AsyncSingleFlight()
+            name = function.__name__
+
             def operation(*args, **kwargs):
                 key = keyExtractor(*args, **kwargs)
                 if self.has(key):
@@ -121,14 +575,33 @@ class Cache:
                 else:
                     res = function(*args, **kwargs)
                     self.set(key, res)
+                    self._tagFunction(key, name)
+                    return res
+
+            async def async_operation(*args, **kwargs):
+                key = keyExtractor(*args, **kwargs)
+                if self.has(key):
+                    return self.get(key)
+                else:
+                    res = await flight.run(key, self, function, *args, **kwargs)
+                    self._tagFunction(key, name)
                     return res
 
-            return operation
+            # NOTE: The wrapper has the function's name, so that it can be
+            # given to `invalidate` as well.
+            if asyncio.iscoroutinefunction(function):
+                return functools.update_wrapper(async_operation, function)
+            else:
+                return functools.update_wrapper(operation, function)
 
         return wrap_wrapper
 
     def memoized(self, functor):
+        """Caches the result of the given function (or coroutine function)
+        at its name, whatever the arguments. The key is tagged with the
+        name as well."""
         key = functor.__name__
+        flight = AsyncSingleFlight()
 
         def wrapper(*args, **kwargs):
             if self.has(key):
@@ -136,10 +609,27 @@ class Cache:
             else:
                 res = functor(*args, **kwargs)
                 self.set(key, res)
+                self._tagFunction(key, key)
                 return res
 
-        functools.update_wrapper(wrapper, functor)
-        return wrapper
+        async def async_wrapper(*args, **kwargs):
+            if self.has(key):
+                return self.get(key)
+            else:
+                res = await flight.run(key, self, functor, *args, **kwargs)
+                self._tagFunction(key, key)
+                return res
+
+        res = async_wrapper if asyncio.iscoroutinefunction(functor) else wrapper
+        functools.update_wrapper(res, functor)
+        return res
+
+    def _tagFunction(self, key, name):
+        """Tags the given key with the name of the function that computed
+        it, so that `invalidate(function)` removes it, when the cache
+        supports tags."""
+        if self.TAGS:
+            self.tag(key, name)
 
     def __setitem__(self, key, value):
         return self.set(key, value)
@@ -223,6 +713,7 @@ class MemoryCache(Cache):
 
     def clear(self):
         self.data = {}
+        self.tagIndex.clear()
 
     def keys(self):
         return list(self.data.keys())
@@ -230,9 +721,11 @@ class MemoryCache(Cache):
     def remove(self, key):
         if key in self.data:
             del self.data[key]
+        self.tagIndex.discard(key)
 
     def cleanup(self):
-        if len(self.data) >= self.limit:
+        # NOTE: A negative limit means the cache is unbounded
+        if 0 <= self.limit <= len(self.data):
             keys = []
             for k in self.data:
                 keys.append(k)
@@ -240,6 +733,235 @@ class MemoryCache(Cache):
                     break
             for k in keys:
                 del self.data[k]
+                self.tagIndex.discard(k)
+
+
+# -----------------------------------------------------------------------------
+#
+# FREQUENCY SKETCH
+#
+# -----------------------------------------------------------------------------
+
+
+class FrequencySketch:
+    """A count-min sketch of 4-bit counters that estimates how often keys
+    were accessed, which is used by the `LRUCache` to implement TinyLFU
+    admission. Counters are halved after a number of increments
+    proportional to the width, so that the estimates favour recent
+    accesses."""
+
+    MAX_COUNT = 15
+    HALVE = bytes(_ >> 1 for _ in range(256))
+
+    def __init__(self, capacity):
+        # NOTE: 4 counters per entry keep collisions low enough for the
+        # estimates of seldom used keys to stay close to their actual count.
+        width = 16
+        while width < 4 * capacity:
+            width *= 2
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in range(4)]
+        self.sampleSize = 10 * width
+        self.additions = 0
+
+    def _indexes(self, key):
+        """Returns the index of the key's counter in each of the 4 rows,
+        which are derived from two rounds of mixing of its hash."""
+        mask = self.mask
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        g = ((h ^ (h >> 29)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        return h & mask, (h >> 32) & mask, g & mask, (g >> 32) & mask
+
+    def frequency(self, key):
+        """Returns the estimated number of accesses to the given key."""
+        a, b, c, d = self._indexes(key)
+        r = self.rows
+        return min(r[0][a], r[1][b], r[2][c], r[3][d])
+
+    def increment(self, key):
+        """Records an access to the given key."""
+        a, b, c, d = self._indexes(key)
+        r0, r1, r2, r3 = self.rows
+        m = self.MAX_COUNT
+        if r0[a] < m or r1[b] < m or r2[c] < m or r3[d] < m:
+            r0[a] += r0[a] < m
+            r1[b] += r1[b] < m
+            r2[c] += r2[c] < m
+            r3[d] += r3[d] < m
+            self.additions += 1
+            if self.additions >= self.sampleSize:
+                self.reset()
+
+    def reset(self):
+        """Halves all the counters."""
+        for row in self.rows:
+            row[:] = row.translate(self.HALVE)
+        self.additions //= 2
+
+
+# -----------------------------------------------------------------------------
+#
+# EXPIRATION
+#
+# -----------------------------------------------------------------------------
+
+
+class ExpirationIndex:
+    """Indexes keys by their expiration time in a min-heap, so that expired
+    keys can be found without scanning the cache.
+
+    Rescheduled and cancelled keys leave a stale entry in the heap, which
+    is skipped when popped. The heap is rebuilt from the live deadlines
+    once stale entries outnumber them, so that its size stays proportional
+    to the number of scheduled keys and removals are amortized O(1).
+
+    The index is not thread-safe: its owner is expected to lock it."""
+
+    COMPACT_MIN = 1024
+
+    def __init__(self):
+        # Heap entries are (EXPIRES_AT, SEQUENCE, KEY), the sequence ensures
+        # keys are never compared.
+        self.heap = []
+        self.deadlines = {}
+        self.sequence = itertools.count()
+
+    def schedule(self, key, expiresAt):
+        """Schedules the given key to expire at the given time, replacing
+        any previous deadline."""
+        if self.deadlines.get(key) != expiresAt:
+            self.deadlines[key] = expiresAt
+            heapq.heappush(self.heap, (expiresAt, next(self.sequence), key))
+            self._compact()
+
+    def cancel(self, key):
+        if self.deadlines.pop(key, None) is not None:
+            self._compact()
+
+    def due(self, now=None, limit=None):
+        """Removes and returns the keys that expire at or before `now`,
+        returning at most `limit` keys."""
+        now = time.time() if now is None else now
+        heap = self.heap
+        deadlines = self.deadlines
+        res = []
+        while heap and heap[0][0] <= now and (limit is None or len(res) < limit):
+            expires_at, _, key = heapq.heappop(heap)
+            if deadlines.get(key) == expires_at:
+                del deadlines[key]
+                res.append(key)
+        return res
+
+    def next(self):
+        """Returns the earliest expiration time, if any."""
+        while self.heap and self.deadlines.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def clear(self):
+        self.heap = []
+        self.deadlines = {}
+
+    def _compact(self):
+        if len(self.heap) > self.COMPACT_MIN and len(self.heap) > 2 * len(
+            self.deadlines
+        ):
+            self.heap = [
+                (t, next(self.sequence), k) for k, t in self.deadlines.items()
+            ]
+            heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+class ExpiringCache(Cache):
+    """The base class for the in-memory caches that expire their entries
+    through an `ExpirationIndex`.
+
+    Expired entries are removed incrementally, a few at each `set`, so
+    that memory is reclaimed as long as the cache is written to, and all
+    of them on `cleanup()`. Expiration can also be driven by a background
+    thread with `start()`, or by an asyncio task:
+
+    >   asyncio.create_task(cache.expiring(interval=1.0))
+
+    The `onEvict(key, value, cause)` callback is invoked for each entry
+    that expired (`cause` is "expired") or that was evicted to make room
+    (`cause` is "evicted"), which is useful to collect metrics. It is
+    invoked with the cache lock held."""
+
+    EXPIRED = "expired"
+    EVICTED = "evicted"
+    # The number of expired entries removed at each `set`
+    EXPIRE_BATCH = 2
+    INTERVAL = 1.0
+
+    def __init__(self, onEvict=None):
+        Cache.__init__(self)
+        self.expiration = ExpirationIndex()
+        self.onEvict = onEvict
+        self.lock = threading.Lock()
+        self._isRunning = False
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def expire(self, limit=None):
+        """Removes the entries that expired (at most `limit` of them),
+        returning their number."""
+        with self.lock:
+            return self._expire(time.time(), limit)
+
+    def _expire(self, now, limit):
+        keys = self.expiration.due(now, limit)
+        for key in keys:
+            self._expireKey(key)
+        return len(keys)
+
+    def _expireKey(self, key):
+        """Removes the given expired key, invoking `onEvict`. The lock is
+        held by the caller."""
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Removes all the expired entries."""
+        self.expire()
+        return self
+
+    def start(self, interval=None):
+        """Starts a background thread that removes the expired entries
+        every `interval` seconds."""
+        if not self._isRunning:
+            self._isRunning = True
+            self._wakeup.clear()
+            self._thread = threading.Thread(
+                target=self.run,
+                args=(interval or self.INTERVAL,),
+                name="retro-cache-expiration",
+                daemon=True,
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._isRunning:
+            self._isRunning = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def run(self, interval):
+        while self._isRunning:
+            self._wakeup.wait(interval)
+            self.expire()
+
+    async def expiring(self, interval=None):
+        """A coroutine that removes the expired entries every `interval`
+        seconds, until it is cancelled."""
+        while True:
+            await asyncio.sleep(interval or self.INTERVAL)
+            self.expire()
 
 
 # -----------------------------------------------------------------------------
@@ -249,24 +971,56 @@ class MemoryCache(Cache):
 # -----------------------------------------------------------------------------
 
 
-class LRUCache(Cache):
-    """A simple in-memory cache using a weighted LRU style dictionary,
-    with an optional timeout for kept values (in seconds)."""
+class LRUCache(ExpiringCache):
+    """A thread-safe in-memory cache that evicts the least recently used
+    entries once their total weight exceeds the limit. Entries are kept in
+    an `OrderedDict` in recency order, so that all operations are O(1),
+    besides scheduling the expiration of entries which is O(log n).
 
-    WEIGHT = 0
-    HITS = 1
-    TIMESTAMP = 2
-    VALUE = 3
+    Each entry weighs 1 by default, so that the limit is a number of
+    entries. A `weigher` function can be given instead, like `LRUCache.Size`
+    which weighs bytes and strings by their length, to limit the memory
+    used by the values.
+
+    Entries expire after `expires` seconds (never by default), which can
+    be overridden per entry with `set(key, value, expires=...)`. Expired
+    entries are removed as described in `ExpiringCache`.
+
+    With `admission`, a new key only makes it into a full cache if it was
+    accessed more often than the entry it would evict (TinyLFU), which
+    protects popular entries from scans of keys that are seldom used.
+
+    >   cache = LRUCache(limit=64 * 1024 * 1024, weigher=LRUCache.Size)
+    """
+
+    VALUE = 0
+    WEIGHT = 1
+    EXPIRES_AT = 2
     EXPIRES = -1
 
-    def __init__(self, limit=100, expires=None):
-        Cache.__init__(self)
-        # Data is key => [WEIGHT, HITS, TIMESTAMP VALUE]
-        self.data = {}
+    @staticmethod
+    def Size(value):
+        """A weigher that uses the length of bytes and strings, and counts
+        other values as 1."""
+        if isinstance(value, (bytes, bytearray, memoryview, str)):
+            return len(value)
+        else:
+            return 1
+
+    def __init__(
+        self, limit=100, expires=None, weigher=None, admission=False, onEvict=None
+    ):
+        ExpiringCache.__init__(self, onEvict)
+        # Data is key => [VALUE, WEIGHT, EXPIRES_AT]
+        self.data = collections.OrderedDict()
         self.weight = 0
         self.limit = limit
-        self.lock = threading.RLock()
+        self.weigher = weigher
+        self.sketch = FrequencySketch(min(limit, 1 << 20)) if admission else None
         self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
         if expires is not None:
             self.expires(expires)
 
@@ -281,74 +1035,112 @@ class LRUCache(Cache):
         self.enabled = False
 
     def get(self, key):
+        # NOTE: Lookups don't take the lock, as `OrderedDict` operations are
+        # atomic, which keeps hits from contending with each other. The
+        # sketch and the statistics are approximate as a result.
+        if self.sketch:
+            self.sketch.increment(key)
         d = self.data.get(key)
-        if d:
-            if self.EXPIRES <= 0 or (time.time() - d[self.TIMESTAMP]) < self.EXPIRES:
-                # We increase the hit count
-                d[self.HITS] += 1
-                return d[self.VALUE]
-            else:
-                self.remove(key)
-                return None
-        else:
+        if d is None:
+            self.misses += 1
+            return None
+        elif d[self.EXPIRES_AT] and d[self.EXPIRES_AT] <= time.time():
+            with self.lock:
+                if self.data.get(key) is d:
+                    self.expiration.cancel(key)
+                    self._expireKey(key)
+            self.misses += 1
             return None
+        else:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                # The entry was evicted in the meantime
+                pass
+            self.hits += 1
+            return d[self.VALUE]
 
     def has(self, key):
-        res = self.data.get(key)
-        return res and True
+        d = self.data.get(key)
+        return bool(d) and not (
+            d[self.EXPIRES_AT] and d[self.EXPIRES_AT] <= time.time()
+        )
 
-    def set(self, key, data, weight=1):
-        self.lock.acquire()
-        if key in self.data:
-            # We update the data if it's already there
-            previous = self.data[key]
-            self.weight -= previous[self.WEIGHT]
-            previous[self.WEIGHT] = weight
-            previous[self.TIMESTAMP] = time.time()
-            previous[self.VALUE] = data
-            self.data[key] = previous
-        else:
-            self.data[key] = [weight, 0, time.time(), data]
+    def set(self, key, data, weight=None, expires=None):
+        if weight is None:
+            weight = self.weigher(data) if self.weigher else 1
+        now = time.time()
+        expires = self.EXPIRES if expires is None else expires
+        expires_at = now + expires if expires > 0 else 0
+        with self.lock:
+            previous = self.data.get(key)
+            if previous is not None:
+                self.weight -= previous[self.WEIGHT]
+                del self.data[key]
+            elif weight > self.limit:
+                # The value would evict everything else
+                return data
+            elif (
+                self.sketch
+                and self.data
+                and self.weight + weight > self.limit
+                and self.sketch.frequency(key)
+                <= self.sketch.frequency(next(iter(self.data)))
+            ):
+                # The new key is not popular enough to replace the
+                # least recently used one.
+                return data
+            self.data[key] = [data, weight, expires_at]
             self.weight += weight
-        self.lock.release()
-        if self.weight > self.limit:
-            self.cleanup()
+            if expires_at:
+                self.expiration.schedule(key, expires_at)
+            elif previous is not None:
+                self.expiration.cancel(key)
+            while self.weight > self.limit:
+                evicted_key, evicted = self.data.popitem(last=False)
+                self.weight -= evicted[self.WEIGHT]
+                self.evictions += 1
+                if evicted[self.EXPIRES_AT]:
+                    self.expiration.cancel(evicted_key)
+                self.tagIndex.discard(evicted_key)
+                if self.onEvict:
+                    self.onEvict(evicted_key, evicted[self.VALUE], self.EVICTED)
+            self._expire(now, self.EXPIRE_BATCH)
         return data
 
     def clear(self):
-        self.data = {}
+        with self.lock:
+            self.data = collections.OrderedDict()
+            self.weight = 0
+            self.expiration.clear()
+            self.tagIndex.clear()
 
     def keys(self):
         return list(self.data.keys())
 
     def remove(self, key):
-        self.lock.acquire()
-        if key in self.data:
-            # NOTEL This is the  same as in cleanuip
-            self.weight -= self.data[key][self.WEIGHT]
-            del self.data[key]
-        self.lock.release()
-
-    def cleanup(self):
-        self.lock.acquire()
-        now = time.time()
-        # We remove older items
-        if self.EXPIRES > 0:
-            for key in list(self.data.keys()):
-                if now - self.data[key][self.TIMESTAMP] > self.EXPIRES:
-                    del self.data[key]
-        items = list(self.data.items())
-        # FIXME: This is slooooow
-        # We compare the hits
-        items.sort(lambda a, b: cmp(a[1][self.HITS], b[1][self.HITS]))
-        i = 0
-        while self.weight > self.limit and i < len(items):
-            key, value = items[i]
-            # NOTE: This is the same as remove
-            self.weight -= value[self.WEIGHT]
-            del self.data[key]
-            i += 1
-        self.lock.release()
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        d = self.data.pop(key, None)
+        if d is not None:
+            self.weight -= d[self.WEIGHT]
+            if d[self.EXPIRES_AT]:
+                self.expiration.cancel(key)
+        self.tagIndex.discard(key)
+        return d
+
+    def _expireKey(self, key):
+        d = self.data.pop(key, None)
+        self.tagIndex.discard(key)
+        if d is not None:
+            self.weight -= d[self.WEIGHT]
+            if self.onEvict:
+                self.onEvict(key, d[self.VALUE], self.EXPIRED)
+
+    def __len__(self):
+        return len(self.data)
 
 
 # -----------------------------------------------------------------------------
@@ -357,35 +1149,45 @@ class LRUCache(Cache):
 #
 # -----------------------------------------------------------------------------
 
-# FIXME: Timeout is not useful unless it has cleanup -- we should refactor this
-
-
-class TimeoutCache(Cache):
+class TimeoutCache(ExpiringCache):
+    """Wraps a cache so that its entries expire `timeout` seconds after they
+    were set. Expired entries are removed as described in `ExpiringCache`,
+    entries set by another process (ie. in a `FileCache`) are only removed
+    when accessed, or by `cleanup(scan=True)`."""
 
     TIMEOUT = 60 * 60
 
-    def __init__(self, cache=None, timeout=None, limit=-1):
-        Cache.__init__(self)
+    def __init__(self, cache=None, timeout=None, limit=-1, onEvict=None):
+        ExpiringCache.__init__(self, onEvict)
         self.cache = cache or MemoryCache(limit=limit)
         self.timeout = self.TIMEOUT if timeout is None else timeout
+        # The tags are those of the wrapped cache, which might persist them
+        self.tagIndex = self.cache.tagIndex
+        self.TAGS = self.cache.TAGS
 
     def get(self, key):
-        if self.cache.has(key):
-            value, insert_time = self.cache.get(key)
+        # NOTE: We only query the cache once, as the key might be removed
+        # by another thread in between.
+        entry = self.cache.get(key)
+        if entry:
+            value, insert_time = entry
             # We don't call hasTimedOut directly as we want to save another
             # query to the cache
             if (time.time() - insert_time) < self.timeout:
                 return value
             else:
-                # Key is out of date
-                self.remove(key)
+                # Key is out of date, unless it was set again in between
+                with self.lock:
+                    if self.hasTimedOut(key):
+                        self.expiration.cancel(key)
+                        self._expireKey(key)
                 return None
         else:
             return None
 
     def hasTimedOut(self, key):
-        value, insert_time = self.cache.get(key)
-        return (time.time() - insert_time) > self.timeout
+        entry = self.cache.get(key)
+        return not entry or (time.time() - entry[1]) > self.timeout
 
     def has(self, key):
         if self.cache.has(key):
@@ -394,24 +1196,615 @@ class TimeoutCache(Cache):
             return False
 
     def set(self, key, value):
-        self.cache.set(key, (value, time.time()))
+        now = time.time()
+        with self.lock:
+            self.cache.set(key, (value, now))
+            self.expiration.schedule(key, now + self.timeout)
+            self._expire(now, self.EXPIRE_BATCH)
         return value
 
     def clear(self):
-        self.cache.clear()
+        with self.lock:
+            self.cache.clear()
+            self.expiration.clear()
 
     def keys(self):
         return list(self.cache.keys())
 
     def remove(self, key):
-        self.cache.remove(key)
+        with self.lock:
+            self.cache.remove(key)
+            self.expiration.cancel(key)
+
+    def _expireKey(self, key):
+        entry = self.cache.get(key)
+        if entry:
+            self.cache.remove(key)
+            if self.onEvict:
+                self.onEvict(key, entry[0], self.EXPIRED)
+
+    def cleanup(self, scan=False):
+        """Removes the expired entries, looking at every entry of the
+        wrapped cache when `scan` is set and it can list its keys."""
+        self.expire()
+        if scan:
+            try:
+                keys = list(self.cache.keys())
+            except NotImplementedError:
+                # Entries are then only removed when accessed
+                keys = ()
+            for key in keys:
+                if self.hasTimedOut(key):
+                    self.remove(key)
+        return self
+
+
+# -----------------------------------------------------------------------------
+#
+# SHARDED CACHE
+#
+# -----------------------------------------------------------------------------
+
+
+class ShardedCache(Cache):
+    """A thread-safe cache that hashes keys into a number of independent
+    shards, each guarded by its own lock, so that threads writing different
+    keys seldom wait for each other. Each shard is created by the `factory`,
+    an `LRUCache` holding its share of the `limit` by default.
+
+    The shards must be thread-safe themselves (like `LRUCache`, whose
+    writes take its lock while its reads rely on the atomicity of its
+    dictionary lookups), as this cache doesn't add a lock of its own.
+
+    `getOrSet(key, factory)` returns the cached value, or calls the factory
+    and caches its result, making sure only one thread calls the factory
+    for a given key at any time:
+
+    >   cache = ShardedCache(limit=10000, shards=32)
+    >   user = cache.getOrSet(uid, lambda: db.getUser(uid))
+    """
+
+    SHARDS = 16
+
+    def __init__(self, limit=1024, shards=None, factory=None):
+        Cache.__init__(self)
+        count = shards or self.SHARDS
+        self.limit = limit
+        self.factory = factory or (lambda: LRUCache(max(1, limit // count)))
+        self.shards = [self.factory() for _ in range(count)]
+        self.flight = SingleFlight()
+        # The shards share the index, so that they discard the keys they evict
+        for shard in self.shards:
+            shard.tagIndex = self.tagIndex
+
+    def shard(self, key):
+        """Returns the shard that holds the given key."""
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key):
+        return self.shards[hash(key) % len(self.shards)].get(key)
+
+    def has(self, key):
+        return self.shards[hash(key) % len(self.shards)].has(key)
+
+    def set(self, key, value):
+        return self.shards[hash(key) % len(self.shards)].set(key, value)
+
+    def getOrSet(self, key, factory, *args, **kwargs):
+        """Returns the value for the given key, setting it to the result of
+        `factory(*args, **kwargs)` when missing. Concurrent callers that
+        miss the same key wait for the first one's result."""
+        value = self.get(key)
+        if value is None:
+            value = self.flight.run(key, self, factory, *args, **kwargs)
+        return value
+
+    def remove(self, key):
+        self.shards[hash(key) % len(self.shards)].remove(key)
+
+    def clear(self):
+        for shard in self.shards:
+            shard.clear()
+
+    def keys(self):
+        return [k for shard in self.shards for k in shard.keys()]
+
+    def cleanup(self):
+        for shard in self.shards:
+            shard.cleanup()
+        return self
+
+    def __len__(self):
+        return sum(len(shard.keys()) for shard in self.shards)
+
+
+# -----------------------------------------------------------------------------
+#
+# SHARED MEMORY CACHE
+#
+# -----------------------------------------------------------------------------
+
+
+class SharedMemoryCache(Cache):
+    """A cache shared by all the processes that open the same `name`, so
+    that workers of a multi-process deployment share their hits and don't
+    duplicate their entries. The cache lives in a memory-mapped file of a
+    fixed `size` (in `/dev/shm` when available), laid out as:
+
+    - a header and the slab classes,
+    - an open-addressing hash table of `capacity` buckets with linear
+      probing, where removals shift the following buckets back instead of
+      leaving tombstones,
+    - pages of `PAGE_SIZE` bytes, each assigned to a slab class on demand,
+      that hold the keys and values in slots of 64 bytes to a page.
+
+    Writers are serialized by a lock on the file (and a thread lock), while
+    readers don't lock: each bucket has a sequence number that writers make
+    odd while they update it, and readers retry when it changed during
+    their read (seqlock). A read that races with a removal may miss.
+
+    Entries are evicted in approximate LRU order by a clock that visits the
+    buckets, sparing the entries that were read since its last pass. As
+    pages are never reassigned, a slab class can only reuse its own slots.
+
+    Tags and generations are not supported, as they would only be known to
+    the process that set them: `tag`, `generation` and the invalidation of
+    tags and functions raise a `CacheError`.
+
+    Keys and values are stored as is when they are bytes, encoded when they
+    are strings and pickled otherwise. The cache must be created before the
+    workers fork, or opened by each of them with the same `name`:
+
+    >   cache = SharedMemoryCache("pages", size=256 * 1024 * 1024)
+    """
+
+    MAGIC = b"RETROSHM"
+    VERSION = 1
+    SIZE = 64 * 1024 * 1024
+    PAGE_SIZE = 1024 * 1024
+    MIN_SLOT = 64
+    CLASSES = 15
+    LOAD_FACTOR = 0.75
+    EXPIRES = -1
+    RETRIES = 100
+    # Header: MAGIC, VERSION, BUCKETS, PAGES, PAGES_USED, HAND, COUNT
+    HEADER = struct.Struct("<8sIIIIII")
+    PAGES_USED = 20
+    HAND = 24
+    COUNT = 28
+    # Slab class: FREE (head of the free list), BUMP, END (of the last page)
+    CLASS = struct.Struct("<III")
+    # Bucket: SEQUENCE, STATE, REFERENCED, KINDS, HASH, SLOT, KEY_LENGTH,
+    # VALUE_LENGTH, EXPIRES_AT
+    BUCKET = struct.Struct("<IBBBxIIIId")
+    UINT = struct.Struct("<I")
+    TAGS = False
+    EMPTY = 0
+    USED = 1
+    RAW = 0
+    TEXT = 1
+    PICKLED = 2
+
+    @staticmethod
+    def Encode(value):
+        """Returns the bytes and kind of the given key or value."""
+        if isinstance(value, bytes):
+            return value, SharedMemoryCache.RAW
+        elif isinstance(value, str):
+            return value.encode("utf8"), SharedMemoryCache.TEXT
+        else:
+            return (
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                SharedMemoryCache.PICKLED,
+            )
+
+    @staticmethod
+    def Hash(data):
+        """Returns a hash of the given bytes that is the same in every
+        process (unlike `hash`), mixed so that similar keys spread evenly
+        over the buckets."""
+        h = (zlib.crc32(data) * 0x9E3779B1) & 0xFFFFFFFF
+        return h ^ (h >> 16)
+
+    @staticmethod
+    def Decode(data, kind):
+        if kind == SharedMemoryCache.RAW:
+            return bytes(data)
+        elif kind == SharedMemoryCache.TEXT:
+            return str(data, "utf8")
+        else:
+            return pickle.loads(data)
+
+    def __init__(
+        self, name="retro", size=None, capacity=None, expires=None, path=None
+    ):
+        Cache.__init__(self)
+        size = size or self.SIZE
+        if not path:
+            root = "/dev/shm"
+            if not os.path.isdir(root):
+                root = tempfile.gettempdir()
+            path = os.path.join(root, "retro-cache-{0}".format(name))
+        if not capacity:
+            # We assume entries of 512 bytes on average
+            capacity = size // 512
+        buckets = 16
+        while buckets < capacity:
+            buckets *= 2
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._writing():
+            existing = os.fstat(self.fd).st_size
+            header = (
+                self.HEADER.unpack_from(os.pread(self.fd, self.HEADER.size, 0))
+                if existing >= self.HEADER.size
+                else None
+            )
+            # An existing cache keeps its layout, whatever the given size
+            if (
+                header
+                and header[:2] == (self.MAGIC, self.VERSION)
+                and self._layout(header[2], header[3]) == existing
+            ):
+                self.map = mmap.mmap(self.fd, self.size)
+            else:
+                pages = (size - self._layout(buckets, 0)) // self.PAGE_SIZE
+                if pages < 1:
+                    raise CacheError(
+                        "Shared memory cache is too small for {0} buckets: {1}".format(
+                            buckets, size
+                        )
+                    )
+                os.ftruncate(self.fd, self._layout(buckets, pages))
+                self.map = mmap.mmap(self.fd, self.size)
+                self._reset()
+        if expires is not None:
+            self.expires(expires)
+
+    def _layout(self, buckets, pages):
+        """Sets the offsets of the regions for the given number of buckets
+        and pages, returning the total size."""
+        self.capacity = buckets
+        self.mask = buckets - 1
+        # NOTE: The clock visits the buckets with an odd stride, so that it
+        # visits each of them once per turn, but evicts evenly over the
+        # table. Evicting consecutive buckets would leave the buckets the
+        # clock is about to visit nearly full, and their clusters long.
+        self.stride = int(buckets * 0.6180339887) | 1
+        self.pages = pages
+        self.classes = 64
+        self.buckets = (self.classes + self.CLASSES * self.CLASS.size + 63) // 64 * 64
+        self.pagesOffset = self.buckets + buckets * self.BUCKET.size
+        self.size = self.pagesOffset + pages * self.PAGE_SIZE
+        return self.size
+
+    def expires(self, value):
+        self.EXPIRES = value
+        return self
+
+    def tag(self, key, *tags):
+        raise CacheError("SharedMemoryCache does not support tags")
+
+    def generation(self, tag):
+        raise CacheError("SharedMemoryCache does not support generations")
+
+    def invalidate(self, key=None, tag=None):
+        if tag is not None or not isinstance(key, str):
+            raise CacheError("SharedMemoryCache does not support tags")
+        return Cache.invalidate(self, key)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        with self._lock:
+            if fcntl:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN, 1)
+
+    def _reset(self):
+        m = self.map
+        m[: self.pagesOffset] = bytes(self.pagesOffset)
+        self.HEADER.pack_into(
+            m, 0, self.MAGIC, self.VERSION, self.capacity, self.pages, 0, 0, 0
+        )
+
+    # =========================================================================
+    # READING
+    # =========================================================================
+
+    def _lookup(self, key):
+        """Returns the bucket tuple and the value bytes for the given key, if
+        it is in the cache. This is the lock-free read."""
+        kb, kk = self.Encode(key)
+        h = self.Hash(kb)
+        klen = len(kb)
+        m = self.map
+        unpack = self.BUCKET.unpack_from
+        size = self.BUCKET.size
+        i = h & self.mask
+        for _ in range(self.capacity):
+            offset = self.buckets + i * size
+            for _ in range(self.RETRIES):
+                b = unpack(m, offset)
+                if b[0] & 1:
+                    # A writer is updating the bucket
+                    continue
+                elif b[1] == self.EMPTY:
+                    return None, None
+                elif b[4] != h or b[6] != klen or b[3] >> 4 != kk:
+                    break
+                slot = b[5]
+                k = m[slot : slot + klen]
+                v = m[slot + klen : slot + klen + b[7]]
+                if unpack(m, offset)[0] != b[0]:
+                    continue
+                elif k != kb:
+                    break
+                elif not b[2]:
+                    # Sets the reference bit for the clock
+                    m[offset + 5] = 1
+                return b, v
+            else:
+                return None, None
+            i = (i + 1) & self.mask
+        return None, None
+
+    def get(self, key):
+        b, v = self._lookup(key)
+        if b is None or (b[8] and b[8] <= time.time()):
+            self.misses += 1
+            return None
+        else:
+            self.hits += 1
+            return self.Decode(v, b[3] & 0x0F)
+
+    def has(self, key):
+        b, _ = self._lookup(key)
+        return b is not None and not (b[8] and b[8] <= time.time())
+
+    def keys(self):
+        res = []
+        m = self.map
+        for i in range(self.capacity):
+            b = self.BUCKET.unpack_from(m, self.buckets + i * self.BUCKET.size)
+            if b[1] == self.USED and not b[0] & 1:
+                k = m[b[5] : b[5] + b[6]]
+                try:
+                    res.append(self.Decode(k, b[3] >> 4))
+                except Exception:
+                    # The slot was reused while we read it
+                    pass
+        return res
+
+    def __len__(self):
+        return self.UINT.unpack_from(self.map, self.COUNT)[0]
+
+    # =========================================================================
+    # WRITING
+    # =========================================================================
+
+    def set(self, key, value, expires=None):
+        kb, kk = self.Encode(key)
+        vb, vk = self.Encode(value)
+        klen, vlen = len(kb), len(vb)
+        c = self._class(klen + vlen)
+        h = self.Hash(kb)
+        if c >= self.CLASSES:
+            # The entry is larger than a page, and the previous value must
+            # not be served in its place.
+            with self._writing():
+                i, b = self._find(kb, kk, h)
+                if b is not None:
+                    self._removeAt(i, b)
+            return value
+        expires = self.EXPIRES if expires is None else expires
+        expires_at = time.time() + expires if expires > 0 else 0
+        m = self.map
+        with self._writing():
+            i, b = self._find(kb, kk, h)
+            if b is None and len(self) + 1 > self.capacity * self.LOAD_FACTOR:
+                self._evict()
+            slot = self._allocate(c)
+            if slot is None:
+                # The eviction might have moved (or removed) the key's bucket
+                i, b = self._find(kb, kk, h)
+                if b is not None:
+                    self._removeAt(i, b)
+                return value
+            m[slot : slot + klen] = kb
+            m[slot + klen : slot + klen + vlen] = vb
+            # The eviction might have moved the key's bucket
+            i, b = self._find(kb, kk, h)
+            self._write(
+                i, self.USED, 0, kk << 4 | vk, h, slot, klen, vlen, expires_at
+            )
+            if b is None:
+                self._count(1)
+            else:
+                self._free(b[5], b[6] + b[7])
+        return value
+
+    def remove(self, key):
+        kb, kk = self.Encode(key)
+        with self._writing():
+            i, b = self._find(kb, kk, self.Hash(kb))
+            if b is not None:
+                self._removeAt(i, b)
+
+    def clear(self):
+        with self._writing():
+            self._reset()
 
     def cleanup(self):
-        for key in list(self.cache.keys()):
-            if self.hasTimedOut(key):
-                self.cache.remove(key)
+        """Removes the expired entries."""
+        now = time.time()
+        with self._writing():
+            i = 0
+            while i < self.capacity:
+                b = self._bucket(i)
+                if b[1] == self.USED and b[8] and b[8] <= now:
+                    # The next bucket might be shifted in this one
+                    self._removeAt(i, b)
+                else:
+                    i += 1
         return self
 
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def unlink(self):
+        """Removes the file backing the cache, which will be freed once
+        all the processes closed it."""
+        os.unlink(self.path)
+
+    # =========================================================================
+    # BUCKETS
+    # =========================================================================
+    # NOTE: The following methods expect the write lock to be held
+
+    def _bucket(self, i):
+        offset = self.buckets + i * self.BUCKET.size
+        return self.BUCKET.unpack_from(self.map, offset)
+
+    def _acquire(self, i):
+        """Makes the sequence of the given bucket odd, so that readers retry
+        until it is written (see `_write`)."""
+        offset = self.buckets + i * self.BUCKET.size
+        sequence = self.UINT.unpack_from(self.map, offset)[0]
+        if not sequence & 1:
+            self.UINT.pack_into(self.map, offset, sequence + 1)
+
+    def _write(self, i, *fields):
+        """Updates the given bucket, keeping its sequence odd during the
+        update (it might have been made odd by `_acquire` already) and
+        then making it even, so that it is incremented by 2."""
+        offset = self.buckets + i * self.BUCKET.size
+        sequence = self.UINT.unpack_from(self.map, offset)[0] | 1
+        self.BUCKET.pack_into(self.map, offset, sequence, *fields)
+        self.UINT.pack_into(self.map, offset, (sequence + 1) & 0xFFFFFFFF)
+
+    def _find(self, kb, kk, h):
+        """Returns the index and tuple of the key's bucket, or the index of
+        the empty bucket where it would go and `None`."""
+        m = self.map
+        i = h & self.mask
+        while True:
+            b = self._bucket(i)
+            if b[1] == self.EMPTY:
+                return i, None
+            elif (
+                b[4] == h
+                and b[6] == len(kb)
+                and b[3] >> 4 == kk
+                and m[b[5] : b[5] + b[6]] == kb
+            ):
+                return i, b
+            i = (i + 1) & self.mask
+
+    def _removeAt(self, i, b):
+        """Removes the entry at the given bucket, shifting back the buckets
+        that follow it so that probing never crosses an empty bucket."""
+        # NOTE: Freeing the slot overwrites its first bytes, so the bucket
+        # must be odd before, and is only made even once it's rewritten,
+        # as the bucket at `i` always is below.
+        self._acquire(i)
+        self._free(b[5], b[6] + b[7])
+        self._count(-1)
+        mask = self.mask
+        hole = j = i
+        while True:
+            j = (j + 1) & mask
+            b = self._bucket(j)
+            if b[1] == self.EMPTY:
+                break
+            home = b[4] & mask
+            # The entry stays if its home is cyclically within (hole, j]
+            if (hole < j and hole < home <= j) or (
+                hole > j and (home > hole or home <= j)
+            ):
+                continue
+            self._write(hole, *b[1:])
+            hole = j
+        self._write(hole, self.EMPTY, 0, 0, 0, 0, 0, 0, 0.0)
+
+    def _count(self, delta):
+        self.UINT.pack_into(self.map, self.COUNT, len(self) + delta)
+
+    def _evict(self, c=None):
+        """Sweeps the clock hand over the buckets to remove an entry that
+        is expired, or that was not read since the last pass (and that uses
+        a slot of the given class). Returns `True` if an entry was removed."""
+        now = time.time()
+        m = self.map
+        hand = self.UINT.unpack_from(m, self.HAND)[0]
+        try:
+            for _ in range(2 * self.capacity):
+                b = self._bucket(hand)
+                if b[1] == self.USED:
+                    if b[8] and b[8] <= now:
+                        self._removeAt(hand, b)
+                        return True
+                    elif b[2]:
+                        m[self.buckets + hand * self.BUCKET.size + 5] = 0
+                    elif c is None or self._class(b[6] + b[7]) == c:
+                        self._removeAt(hand, b)
+                        return True
+                hand = (hand + self.stride) & self.mask
+            return False
+        finally:
+            self.UINT.pack_into(m, self.HAND, (hand + self.stride) & self.mask)
+
+    # =========================================================================
+    # SLABS
+    # =========================================================================
+
+    def _class(self, length):
+        """Returns the slab class of an entry of the given length: slots of
+        class `c` are `MIN_SLOT << c` bytes."""
+        return max(0, (length - 1).bit_length() - 6)
+
+    def _allocate(self, c):
+        """Returns the offset of a free slot of the given class, evicting an
+        entry when there is none left."""
+        m = self.map
+        offset = self.classes + c * self.CLASS.size
+        size = self.MIN_SLOT << c
+        for _ in range(2):
+            free, bump, end = self.CLASS.unpack_from(m, offset)
+            if free:
+                self.CLASS.pack_into(
+                    m, offset, self.UINT.unpack_from(m, free)[0], bump, end
+                )
+                return free
+            elif bump and bump + size <= end:
+                self.CLASS.pack_into(m, offset, free, bump + size, end)
+                return bump
+            used = self.UINT.unpack_from(m, self.PAGES_USED)[0]
+            if used < self.pages:
+                page = self.pagesOffset + used * self.PAGE_SIZE
+                self.UINT.pack_into(m, self.PAGES_USED, used + 1)
+                self.CLASS.pack_into(
+                    m, offset, free, page + size, page + self.PAGE_SIZE
+                )
+                return page
+            elif not self._evict(c):
+                return None
+        return None
+
+    def _free(self, slot, length):
+        m = self.map
+        offset = self.classes + self._class(length) * self.CLASS.size
+        free, bump, end = self.CLASS.unpack_from(m, offset)
+        self.UINT.pack_into(m, slot, free)
+        self.CLASS.pack_into(m, offset, slot, bump, end)
+
 
 # -----------------------------------------------------------------------------
 #
@@ -421,11 +1814,44 @@ class TimeoutCache(Cache):
 
 
 class FileCache(Cache):
-    """A simplistic filesystem-based cache"""
+    """A filesystem-based cache that stores each entry as a file, named
+    after its key, in one of 256 subdirectories (shards) so that
+    directories stay small. Entries expire `expires` seconds after they
+    were written, based on the modification time of their file.
+
+    Values are written to a temporary file which then replaces the entry,
+    so that readers never see a partial value, and read with a single
+    `open` (and `fstat` to check the expiration).
+
+    With `maxSize`, the cache keeps an index of the entries it knows about
+    (their size and modification time, in LRU order), loaded from the
+    directory on creation, and the least recently used entries are
+    removed once the files exceed `maxSize` bytes. As other processes
+    might have removed, rewritten or cleared the entries, `has` still
+    checks the file with a single `stat`, and updates the index from it.
+    Without `maxSize`, there is no index, so that its memory doesn't grow
+    with every key ever written.
+
+    Temporary files left by writers that crashed are removed once they
+    are `TEMP_EXPIRES` seconds old, by `sweep`, which is called when the
+    index is loaded and at most every `SWEEP_INTERVAL` seconds when
+    entries are evicted. `clear` removes them with the whole directory.
+
+    Tags and generations are stored in the cache directory as well (see
+    `FileTagIndex`).
+
+    >   cache = FileCache("/var/cache/app", maxSize=1024 * 1024 * 1024)
+    """
 
     EXTENSION = ".cache"
     EXPIRES = 60 * 60
     MAX_KEY_LENGTH = 100
+    TEMP_EXTENSION = ".tmp"
+    TEMP_EXPIRES = 10 * 60
+    SWEEP_INTERVAL = 60 * 60
+    # Index is name => [SIZE, MTIME]
+    SIZE = 0
+    MTIME = 1
 
     @staticmethod
     def SHA1_KEY(_):
@@ -460,14 +1886,21 @@ class FileCache(Cache):
         expires=None,
         createPath=True,
         extension=None,
+        maxSize=None,
+        sharded=True,
     ):
         Cache.__init__(self)
         self.serializer = serializer
         self.deserializer = deserializer
-        self.setPath(path, createPath)
         self.keyProcessor = keys or self.NAME_KEY
         self.extension = extension or self.EXTENSION
+        self.maxSize = maxSize
+        self.sharded = sharded
         self.enabled = True
+        self.lock = threading.RLock()
+        self.swept = 0
+        self.setPath(path, createPath)
+        self.tagIndex = FileTagIndex(self)
         if expires != None:
             self.EXPIRES = expires
 
@@ -485,7 +1918,7 @@ class FileCache(Cache):
         return self
 
     def withMD5Keys(self):
-        self.setKeyProcessor(FileCache.SHA1_KEY)
+        self.setKeyProcessor(FileCache.MD5_KEY)
         return self
 
     def setKeyProcessor(self, keys):
@@ -500,49 +1933,223 @@ class FileCache(Cache):
             os.makedirs(path)
         assert os.path.exists(path), "Cache path does not exist: {0}".format(path)
         assert os.path.isdir(path), "Cache path is not a directory: {0}".format(path)
-        self.path = path
+        with self.lock:
+            self.path = path
+            self.index = collections.OrderedDict()
+            self.size = 0
+            self.shards = set()
+            if self.maxSize:
+                self.load()
+
+    def load(self):
+        """Loads the index from the files of the cache directory."""
+        with self.lock:
+            index = collections.OrderedDict()
+            files = []
+            for d in self._directories():
+                for f in os.scandir(d):
+                    if f.name.endswith(self.extension) and f.is_file():
+                        s = f.stat()
+                        files.append((s.st_atime, f.name, s.st_size, s.st_mtime))
+            # The files accessed last are the most recently used
+            for _, name, size, mtime in sorted(files):
+                index[name[: -len(self.extension)]] = [size, mtime]
+            self.index = index
+            self.size = sum(_[self.SIZE] for _ in index.values())
+        self.sweep()
+        return self
+
+    def sweep(self, expires=None):
+        """Removes the temporary files older than `expires` seconds
+        (`TEMP_EXPIRES` by default), which were left by writers that
+        crashed before replacing their entry. Returns the number of files
+        removed."""
+        now = time.time()
+        limit = now - (self.TEMP_EXPIRES if expires is None else expires)
+        self.swept = now
+        count = 0
+        for d in self._directories(all=True):
+            try:
+                files = list(os.scandir(d))
+            except OSError:
+                continue
+            for f in files:
+                if not f.name.endswith(self.TEMP_EXTENSION):
+                    continue
+                try:
+                    if f.stat().st_mtime < limit:
+                        os.unlink(f.path)
+                        count += 1
+                except OSError:
+                    pass
+        return count
+
+    def _directories(self, all=False):
+        """Returns the cache directory and its shards, or all its
+        subdirectories (including the tags) when `all` is set."""
+        return [self.path] + [
+            _.path
+            for _ in os.scandir(self.path)
+            if _.is_dir() and (all or len(_.name) == 2)
+        ]
+
+    def _path(self, name, create=False):
+        if not self.sharded:
+            return self.path + "/" + name + self.extension
+        shard = "{0:02x}".format(zlib.crc32(name.encode("utf8")) & 0xFF)
+        if create and shard not in self.shards:
+            os.makedirs(self.path + "/" + shard, exist_ok=True)
+            self.shards.add(shard)
+        return self.path + "/" + shard + "/" + name + self.extension
+
+    def keys(self):
+        """Returns the keys of the entries in the cache directory. Keys can
+        only be recovered from the file names with the default key
+        processor (`NAME_KEY`), and not when they were too long and were
+        hashed, in which case they are not returned."""
+        if self.keyProcessor != self.NAME_KEY:
+            raise NotImplementedError("Keys are hashed: {0}".format(self))
+        hashed = self.MAX_KEY_LENGTH - len(self.extension)
+        suffix = len(self.extension)
+        res = []
+        for d in self._directories():
+            for f in os.scandir(d):
+                name = f.name
+                if name.endswith(self.extension) and len(name) - suffix < hashed:
+                    res.append(unquote_plus(name[:-suffix]))
+        return res
 
     def mtime(self, key):
-        path = self.path + "/" + self._normKey(key) + self.extension
-        if os.path.exists(path):
-            return os.stat(path)[stat.ST_MTIME]
-        else:
+        name = self._normKey(key)
+        entry = self.index.get(name)
+        if entry is not None:
+            return int(entry[self.MTIME])
+        try:
+            return os.stat(self._path(name))[stat.ST_MTIME]
+        except OSError:
             return None
 
     def has(self, key):
-        path = self.path + "/" + self._normKey(key) + self.extension
-        if os.path.exists(path):
-            s = os.stat(path)
-            if self.EXPIRES > 0:
-                return (time.time() - s[stat.ST_MTIME]) < self.EXPIRES
-            else:
-                return True
-        else:
+        name = self._normKey(key)
+        # NOTE: The index can't answer on its own, as another process might
+        # have removed, rewritten or cleared the entry since.
+        try:
+            s = os.stat(self._path(name))
+        except OSError:
+            self._unindex(name)
             return False
+        entry = self.index.get(name)
+        if entry is None or entry != [s.st_size, s.st_mtime]:
+            self._index(name, s.st_size, s.st_mtime)
+        return self.EXPIRES <= 0 or (time.time() - s.st_mtime) < self.EXPIRES
 
     def get(self, key):
-        if self.has(key):
-            path = self.path + "/" + self._normKey(key) + self.extension
-            with open(path, "rb") as f:
-                res = self._load(f)
-                return res
-        else:
+        name = self._normKey(key)
+        try:
+            f = open(self._path(name), "rb")
+        except OSError:
+            self._unindex(name)
             return None
+        with f:
+            s = os.fstat(f.fileno())
+            if self.EXPIRES > 0 and (time.time() - s.st_mtime) >= self.EXPIRES:
+                return None
+            self._index(name, s.st_size, s.st_mtime)
+            return self._load(f)
 
     def set(self, key, data):
-        path = self.path + "/" + self._normKey(key) + self.extension
-        with open(path, "wb") as f:
+        name = self._normKey(key)
+        path = self._path(name, create=True)
+        temp = "{0}.{1}-{2}{3}".format(
+            path, os.getpid(), threading.get_ident(), self.TEMP_EXTENSION
+        )
+        try:
+            f = open(temp, "wb")
+        except FileNotFoundError:
+            # The directory was cleared by another process
+            self.shards = set()
+            path = self._path(name, create=True)
+            f = open(temp, "wb")
+        with f:
             success = self._save(f, data)
-        if not success:
-            os.unlink(path)
+            # The index holds the size and mtime of the file, so that `has`
+            # can tell when another process rewrote it.
+            f.flush()
+            s = os.fstat(f.fileno())
+        if success:
+            os.replace(temp, path)
+            self._index(name, s.st_size, s.st_mtime)
+        else:
+            os.unlink(temp)
+            self.remove(key)
         return data
 
     def clear(self):
-        assert False, "Not implemented"
+        """Removes all the entries, by moving the cache directory away and
+        removing it in a background thread."""
+        with self.lock:
+            trash = "{0}.{1}-{2}.trash".format(self.path, os.getpid(), time.time())
+            os.rename(self.path, trash)
+            os.makedirs(self.path)
+            # The generations are kept, so that keys with a previous
+            # generation are never valid again.
+            generations = trash + "/" + FileTagIndex.GENERATIONS
+            if os.path.exists(generations):
+                os.rename(generations, self.path + "/" + FileTagIndex.GENERATIONS)
+            self.index = collections.OrderedDict()
+            self.size = 0
+            self.shards = set()
+        self.tagIndex.clear()
+        threading.Thread(
+            target=shutil.rmtree, args=(trash, True), name="retro-cache-clear"
+        ).start()
 
     def remove(self, key):
-        if self.has(key):
-            os.unlink(self.path + "/" + self._normKey(key) + self.extension)
+        name = self._normKey(key)
+        try:
+            os.unlink(self._path(name))
+        except OSError:
+            pass
+        self._unindex(name)
+        self.tagIndex.discard(key)
+
+    def _index(self, name, size, mtime):
+        """Records the given entry as the most recently used, evicting the
+        least recently used ones when over `maxSize`."""
+        if not self.maxSize:
+            return
+        evicted = []
+        sweep = False
+        with self.lock:
+            entry = self.index.pop(name, None)
+            if entry is not None:
+                self.size -= entry[self.SIZE]
+            self.index[name] = [size, mtime]
+            self.size += size
+            while self.maxSize and self.size > self.maxSize and len(self.index) > 1:
+                evicted_name, entry = self.index.popitem(last=False)
+                self.size -= entry[self.SIZE]
+                evicted.append(evicted_name)
+                try:
+                    os.unlink(self._path(evicted_name))
+                except OSError:
+                    pass
+            if evicted and time.time() - self.swept >= self.SWEEP_INTERVAL:
+                # Only one thread sweeps, the others see the new time
+                self.swept = time.time()
+                sweep = True
+        # NOTE: The tag index is updated without holding the lock, as it
+        # might query the cache while compacting.
+        for evicted_name in evicted:
+            self.tagIndex.discardName(evicted_name)
+        if sweep:
+            self.sweep()
+
+    def _unindex(self, name):
+        with self.lock:
+            entry = self.index.pop(name, None)
+            if entry is not None:
+                self.size -= entry[self.SIZE]
 
     def _normKey(self, key):
         return self.keyProcessor(key)
@@ -561,6 +2168,846 @@ class FileCache(Cache):
             return None
 
 
+class FileTagIndex(TagIndex):
+    """The tag index of a `FileCache`, stored in its directory so that it
+    is shared by processes and survives restarts. Each tag is a file of
+    the `TAGS` directory to which keys are appended, one per line, and
+    each generation a file of the `GENERATIONS` directory.
+
+    The index keeps the keys of the tag files it read, and reads the lines
+    that other processes appended since, so that a key is only appended
+    once to a file. A file is compacted to the keys that are still in the
+    cache once its lines doubled, or once `COMPACT_MIN` of its keys were
+    removed. Keys tagged by another process while a file is compacted
+    might be lost, in which case their entries are left to expire."""
+
+    TAGS = ".tags"
+    GENERATIONS = ".generations"
+    COMPACT_MIN = 256
+    # Files is tag => [INODE, OFFSET, LINES, REMOVED, COMPACTED]
+    INODE = 0
+    OFFSET = 1
+    LINES = 2
+    REMOVED = 3
+    COMPACTED = 4
+
+    def __init__(self, cache):
+        TagIndex.__init__(self)
+        # NOTE: Checking the keys of a file while compacting it might
+        # evict entries, and discard their keys.
+        self.lock = threading.RLock()
+        self.cache = cache
+        self.files = {}
+        # Names is the name of an entry => the key it was tagged with
+        self.names = {}
+
+    def _path(self, directory, tag, create=False):
+        path = self.cache.path + "/" + directory
+        if create and not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        return path + "/" + hashlib.md5(str(tag).encode("utf8")).hexdigest()
+
+    # NOTE: The following methods expect the lock to be held
+
+    def _update(self, tag, path):
+        """Reads the lines appended to the file of the given tag since it
+        was last read, or all of them if it was replaced."""
+        state = self.files.get(tag)
+        try:
+            s = os.stat(path)
+            if (
+                state
+                and state[self.INODE] == s.st_ino
+                and state[self.OFFSET] == s.st_size
+            ):
+                return state
+            f = open(path, "rb")
+        except OSError:
+            # The tag was invalidated, or the cache cleared
+            self._forget(tag)
+            return None
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if state is None or state[self.INODE] != inode:
+                self._forget(tag)
+                state = self.files[tag] = [inode, 0, 0, 0, 0]
+            f.seek(state[self.OFFSET])
+            data = f.read()
+        # A line might be being appended
+        end = data.rfind(b"\n") + 1
+        state[self.OFFSET] += end
+        keys = self.tags.setdefault(tag, set())
+        for line in data[:end].split(b"\n"):
+            if line:
+                state[self.LINES] += 1
+                key = line.decode("unicode_escape")
+                if key not in keys:
+                    keys.add(key)
+                    self._link(key, tag)
+        return state
+
+    def _link(self, key, tag):
+        tags = self.keyTags.get(key)
+        if tags is None:
+            tags = self.keyTags[key] = set()
+            self.names[self.cache._normKey(key)] = key
+        tags.add(tag)
+
+    def _forget(self, tag):
+        self.files.pop(tag, None)
+        for key in self.tags.pop(tag, ()):
+            tags = self.keyTags.get(key)
+            if tags is not None:
+                tags.discard(tag)
+                if not tags:
+                    del self.keyTags[key]
+                    self.names.pop(self.cache._normKey(key), None)
+
+    def _compact(self, tag):
+        """Rewrites the file of the given tag with the keys that are still
+        in the cache, and then appends the lines that were appended to the
+        previous file in the meantime."""
+        path = self._path(self.TAGS, tag)
+        state = self._update(tag, path)
+        if state is None:
+            return
+        keys = [_ for _ in list(self.tags.get(tag, ())) if self.cache.has(_)]
+        temp = "{0}.{1}-{2}.tmp".format(path, os.getpid(), threading.get_ident())
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self._forget(tag)
+            return
+        with f:
+            if os.fstat(f.fileno()).st_ino != state[self.INODE]:
+                return
+            with open(temp, "wb") as t:
+                t.write(b"".join(_.encode("unicode_escape") + b"\n" for _ in keys))
+            os.replace(temp, path)
+            f.seek(state[self.OFFSET])
+            appended = f.read()
+        if appended:
+            with open(path, "ab") as f:
+                f.write(appended)
+        self._forget(tag)
+        state = self._update(tag, path)
+        if state is not None:
+            state[self.COMPACTED] = state[self.LINES]
+
+    # =========================================================================
+    # API
+    # =========================================================================
+
+    def add(self, key, tags):
+        key = str(key)
+        line = key.encode("unicode_escape") + b"\n"
+        with self.lock:
+            for tag in tags:
+                path = self._path(self.TAGS, tag, create=True)
+                state = self._update(tag, path)
+                if state is not None and key in self.tags.get(tag, ()):
+                    continue
+                # NOTE: Appending a single line is atomic, so that processes
+                # can tag keys concurrently.
+                with open(path, "ab") as f:
+                    f.write(line)
+                state = self._update(tag, path)
+                if state and state[self.LINES] >= 2 * max(
+                    self.COMPACT_MIN, state[self.COMPACTED]
+                ):
+                    self._compact(tag)
+
+    def discard(self, key):
+        key = str(key)
+        if key not in self.keyTags:
+            return
+        with self.lock:
+            tags = self.keyTags.pop(key, None)
+            if tags is None:
+                return
+            self.names.pop(self.cache._normKey(key), None)
+            for tag in tags:
+                keys = self.tags.get(tag)
+                state = self.files.get(tag)
+                if keys is None or state is None:
+                    continue
+                keys.discard(key)
+                state[self.REMOVED] += 1
+                if state[self.REMOVED] >= max(self.COMPACT_MIN, len(keys)):
+                    self._compact(tag)
+
+    def discardName(self, name):
+        """Forgets the key of the entry with the given name, which the
+        `FileCache` evicted."""
+        key = self.names.get(name)
+        if key is not None:
+            self.discard(key)
+
+    def keys(self, tag):
+        with self.lock:
+            self._update(tag, self._path(self.TAGS, tag))
+            return list(self.tags.get(tag, ()))
+
+    def pop(self, tag):
+        path = self._path(self.TAGS, tag)
+        # The file is moved away first, so that the keys tagged in the
+        # meantime go to a new one.
+        popped = "{0}.{1}-{2}.pop".format(path, os.getpid(), threading.get_ident())
+        with self.lock:
+            self._forget(tag)
+            try:
+                os.rename(path, popped)
+            except OSError:
+                keys = []
+            else:
+                with open(popped, "rb") as f:
+                    lines = f.read().split(b"\n")
+                os.unlink(popped)
+                keys = list({_.decode("unicode_escape") for _ in lines if _})
+        self.advance(tag)
+        return keys
+
+    def generation(self, tag):
+        try:
+            with open(self._path(self.GENERATIONS, tag), "rb") as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def advance(self, tag):
+        path = self._path(self.GENERATIONS, tag, create=True)
+        temp = "{0}.{1}-{2}.tmp".format(path, os.getpid(), threading.get_ident())
+        with self.lock:
+            with open(temp, "wb") as f:
+                f.write(str(self.generation(tag) + 1).encode("ascii"))
+            os.replace(temp, path)
+
+    def clear(self):
+        # NOTE: The files are removed with the cache directory
+        with self.lock:
+            self.tags = {}
+            self.keyTags = {}
+            self.files = {}
+            self.names = {}
+
+
+# -----------------------------------------------------------------------------
+#
+# SQLITE CACHE
+#
+# -----------------------------------------------------------------------------
+
+
+class SQLiteCache(Cache):
+    """A persistent cache stored in an SQLite database, which survives
+    restarts and can be shared by the worker processes of a host. Entries
+    are rows of a single table indexed by key and by expiration time, and
+    the database uses write-ahead logging so that readers are not blocked
+    by the writer.
+
+    With `writeBehind` (the default), `set` and `remove` only queue the
+    change, and a background thread writes the queued changes every
+    `interval` seconds in a single transaction. Queued changes are visible
+    to the process that made them, and written by `flush()` or `close()`.
+    Once `MAX_PENDING` changes are queued, `set` and `remove` write them
+    right away, so that writers can't outpace the writer thread.
+
+    Every `EVICT_INTERVAL` seconds, the expired entries are removed, as
+    well as the oldest written ones once the values exceed `maxSize` bytes.
+    The total size of the values is maintained by triggers in the `stats`
+    table, so that it's not computed by scanning the entries.
+
+    Tags and generations are stored in the database as well (see
+    `SQLiteTagIndex`).
+
+    >   cache = SQLiteCache("/var/cache/app.sqlite", maxSize=512 * 1024 * 1024)
+    """
+
+    EXPIRES = 0
+    INTERVAL = 0.05
+    BATCH_SIZE = 1024
+    MAX_PENDING = 16 * 1024
+    EVICT_INTERVAL = 60
+    TIMEOUT = 10
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, "
+        "expires REAL, size INTEGER, tags TEXT)",
+        "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires) "
+        "WHERE expires > 0",
+        "CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, "
+        "PRIMARY KEY (tag, key)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS tags_key ON tags (key)",
+        "CREATE TABLE IF NOT EXISTS generations (tag TEXT PRIMARY KEY, "
+        "generation INTEGER)",
+        # NOTE: Replaced entries keep their tags, as `REPLACE` only fires
+        # delete triggers when recursive triggers are enabled.
+        "CREATE TRIGGER IF NOT EXISTS cache_untag AFTER DELETE ON cache "
+        "BEGIN DELETE FROM tags WHERE key = old.key; END",
+        "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY, size INTEGER)",
+        "INSERT OR IGNORE INTO stats (id, size) "
+        "SELECT 0, COALESCE(SUM(size), 0) FROM cache",
+        # NOTE: The size of a replaced entry is subtracted before it's
+        # inserted, as its deletion doesn't fire the delete trigger.
+        "CREATE TRIGGER IF NOT EXISTS cache_size_insert BEFORE INSERT ON cache "
+        "BEGIN UPDATE stats SET size = size + new.size - COALESCE("
+        "(SELECT size FROM cache WHERE key = new.key), 0) WHERE id = 0; END",
+        "CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache "
+        "BEGIN UPDATE stats SET size = size - old.size WHERE id = 0; END",
+    )
+    SQL_GET = "SELECT value, expires FROM cache WHERE key = ?"
+    SQL_HAS = "SELECT expires FROM cache WHERE key = ?"
+    SQL_SET = (
+        "INSERT OR REPLACE INTO cache (key, value, expires, size, tags) "
+        "VALUES (?, ?, ?, ?, ?)"
+    )
+    SQL_REMOVE = "DELETE FROM cache WHERE key = ?"
+    SQL_EXPIRE = "DELETE FROM cache WHERE expires > 0 AND expires <= ?"
+    SQL_TAG = "INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)"
+    # The pending value of a removed key
+    REMOVED = object()
+
+    def __init__(
+        self,
+        path=".cache.sqlite",
+        expires=None,
+        maxSize=None,
+        writeBehind=True,
+        interval=None,
+        serializer=lambda _: pickle.dumps(_, pickle.HIGHEST_PROTOCOL),
+        deserializer=pickle.loads,
+    ):
+        Cache.__init__(self)
+        if not sqlite3:
+            raise CacheError("SQLiteCache requires the sqlite3 module")
+        self.path = path
+        self.maxSize = maxSize
+        self.writeBehind = writeBehind
+        self.interval = interval or self.INTERVAL
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.enabled = True
+        # Pending is key => (VALUE, EXPIRES, SIZE, TAGS), or REMOVED, and
+        # flushing holds the pending changes while they are written.
+        # PendingTags is a list of (TAG, KEY).
+        self.pending = {}
+        self.flushing = {}
+        self.pendingTags = []
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.local = threading.local()
+        self.lastEviction = time.time()
+        self._isRunning = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._pid = os.getpid()
+        if expires is not None:
+            self.expires(expires)
+        with self.connection() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+        self.tagIndex = SQLiteTagIndex(self)
+
+    def expires(self, value):
+        self.EXPIRES = value
+        return self
+
+    def connection(self):
+        """Returns the connection of the current thread, which is (re)opened
+        in each thread and process."""
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            # NOTE: Statements are compiled once per connection and kept in
+            # the connection's statement cache.
+            db = sqlite3.connect(
+                self.path, timeout=self.TIMEOUT, cached_statements=256
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    # =========================================================================
+    # CACHE API
+    # =========================================================================
+
+    def get(self, key):
+        entry = self.pending.get(key) or self.flushing.get(key)
+        if entry is self.REMOVED:
+            return None
+        elif entry is not None:
+            data, expires_at = entry[0], entry[1]
+        else:
+            row = self.connection().execute(self.SQL_GET, (key,)).fetchone()
+            if row is None:
+                return None
+            data, expires_at = row
+        if expires_at and expires_at <= time.time():
+            return None
+        try:
+            return self.deserializer(data)
+        except Exception as e:
+            return None
+
+    def has(self, key):
+        entry = self.pending.get(key) or self.flushing.get(key)
+        if entry is self.REMOVED:
+            return False
+        elif entry is not None:
+            expires_at = entry[1]
+        else:
+            row = self.connection().execute(self.SQL_HAS, (key,)).fetchone()
+            if row is None:
+                return False
+            expires_at = row[0]
+        return not (expires_at and expires_at <= time.time())
+
+    def set(self, key, value, expires=None, tags=None):
+        data = self.serializer(value)
+        expires = self.EXPIRES if expires is None else expires
+        entry = (
+            data,
+            time.time() + expires if expires > 0 else 0,
+            len(data),
+            ",{0},".format(",".join(tags)) if tags else None,
+        )
+        self._queue(key, entry)
+        if tags:
+            self.tagIndex.add(key, tags)
+        return value
+
+    def remove(self, key):
+        self._queue(key, self.REMOVED)
+
+    def clear(self):
+        # NOTE: We wait for the changes being flushed to be written, so
+        # that they're removed as well.
+        with self.flushLock:
+            with self.lock:
+                self.pending = {}
+                self.pendingTags = []
+                self.flushing = {}
+            with self.connection() as db:
+                db.execute("DELETE FROM tags")
+                db.execute("DELETE FROM cache")
+
+    def keys(self):
+        self.flush()
+        return [_[0] for _ in self.connection().execute("SELECT key FROM cache")]
+
+    def cleanup(self):
+        """Writes the pending changes and evicts the expired and the
+        oldest entries."""
+        self.flush()
+        self.evict()
+        return self
+
+    def __len__(self):
+        self.flush()
+        return self.connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    # =========================================================================
+    # WRITING
+    # =========================================================================
+
+    def _queue(self, key, entry):
+        if not self.writeBehind:
+            self._write({key: entry})
+        else:
+            with self.lock:
+                self.pending[key] = entry
+                count = len(self.pending)
+            if not self._isRunning or self._pid != os.getpid():
+                self.start()
+            elif count >= self.MAX_PENDING:
+                self.flush()
+            elif count >= self.BATCH_SIZE:
+                self._wakeup.set()
+
+    def _queueTags(self, rows):
+        if not self.writeBehind:
+            self._write({}, rows)
+        else:
+            with self.lock:
+                self.pendingTags.extend(rows)
+                count = len(self.pendingTags)
+            if not self._isRunning or self._pid != os.getpid():
+                self.start()
+            elif count >= self.MAX_PENDING:
+                self.flush()
+
+    def flush(self):
+        """Writes the pending changes in a single transaction."""
+        with self.flushLock:
+            with self.lock:
+                pending = self.pending
+                tags = self.pendingTags
+                if not pending and not tags:
+                    return self
+                self.flushing = pending
+                self.pending = {}
+                self.pendingTags = []
+            try:
+                self._write(pending, tags)
+            except Exception:
+                # We restore the changes that were not superseded, so that
+                # they are retried.
+                with self.lock:
+                    pending.update(self.pending)
+                    self.pending = pending
+                    self.pendingTags = tags + self.pendingTags
+                raise
+            finally:
+                self.flushing = {}
+        return self
+
+    def _write(self, changes, tags=()):
+        removed = [(k,) for k, v in changes.items() if v is self.REMOVED]
+        updated = [(k,) + v for k, v in changes.items() if v is not self.REMOVED]
+        with self.connection() as db:
+            if removed:
+                db.executemany(self.SQL_REMOVE, removed)
+            if updated:
+                db.executemany(self.SQL_SET, updated)
+            if tags:
+                db.executemany(self.SQL_TAG, tags)
+        # NOTE: We only evict from the thread that writes
+        if time.time() - self.lastEviction >= self.EVICT_INTERVAL:
+            self.evict()
+
+    def evict(self):
+        """Removes the expired entries, and then the entries that were
+        written first until the values fit in `maxSize`."""
+        self.lastEviction = time.time()
+        with self.connection() as db:
+            db.execute(self.SQL_EXPIRE, (self.lastEviction,))
+            if self.maxSize:
+                total = db.execute("SELECT size FROM stats WHERE id = 0").fetchone()[0]
+                excess = total - self.maxSize
+                if excess > 0:
+                    # We find the newest row to remove, so that rows are
+                    # removed with a single statement.
+                    last = None
+                    for rowid, size in db.execute(
+                        "SELECT rowid, size FROM cache ORDER BY rowid"
+                    ):
+                        last = rowid
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    db.execute("DELETE FROM cache WHERE rowid <= ?", (last,))
+        return self
+
+    # =========================================================================
+    # WRITER THREAD
+    # =========================================================================
+
+    def start(self):
+        # NOTE: A forked process has to start its own thread
+        if not self._isRunning or self._pid != os.getpid():
+            self._isRunning = True
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(
+                target=self.run, name="retro-cache-sqlite", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the writer thread, writing the pending changes."""
+        if self._isRunning:
+            self._isRunning = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        return self
+
+    def run(self):
+        while self._isRunning:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                sys.stderr.write(
+                    "[!] retro.contrib.cache: could not write to {0}: {1}\n".format(
+                        self.path, e
+                    )
+                )
+
+    def close(self):
+        self.stop()
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+
+class SQLiteTagIndex(TagIndex):
+    """The tag index of an `SQLiteCache`, stored in the `tags` and
+    `generations` tables of its database. Tags are written with the
+    pending changes, and removed with their entries by a trigger."""
+
+    def __init__(self, cache):
+        TagIndex.__init__(self)
+        self.cache = cache
+
+    def add(self, key, tags):
+        self.cache._queueTags([(tag, key) for tag in tags])
+
+    def discard(self, key):
+        pass
+
+    def keys(self, tag):
+        self.cache.flush()
+        return [
+            _[0]
+            for _ in self.cache.connection().execute(
+                "SELECT key FROM tags WHERE tag = ?", (tag,)
+            )
+        ]
+
+    def pop(self, tag):
+        self.cache.flush()
+        with self.cache.connection() as db:
+            keys = [
+                _[0] for _ in db.execute("SELECT key FROM tags WHERE tag = ?", (tag,))
+            ]
+            db.execute("DELETE FROM tags WHERE tag = ?", (tag,))
+            self._advance(db, tag)
+        return keys
+
+    def generation(self, tag):
+        row = (
+            self.cache.connection()
+            .execute("SELECT generation FROM generations WHERE tag = ?", (tag,))
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def advance(self, tag):
+        with self.cache.connection() as db:
+            self._advance(db, tag)
+
+    def _advance(self, db, tag):
+        db.execute(
+            "INSERT INTO generations (tag, generation) VALUES (?, 1) "
+            "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1",
+            (tag,),
+        )
+
+    def clear(self):
+        # NOTE: The tags are removed by `SQLiteCache.clear`
+        pass
+
+
+# -----------------------------------------------------------------------------
+#
+# TIERED CACHE
+#
+# -----------------------------------------------------------------------------
+
+
+class TieredCache(Cache):
+    """Composes a fast cache (`l1`, ie. an `LRUCache`) over a larger one
+    (`l2`, ie. a `FileCache`, `SQLiteCache` or `SharedMemoryCache`). Reads
+    go through the tiers in order, and values found in `l2` are promoted
+    to `l1`.
+
+    Writes go to both tiers, unless `writeBack` is set, in which case
+    they go to `l1` and are written to `l2` by a background thread every
+    `interval` seconds (or on `flush()`).
+
+    With `negative`, misses are remembered for that many seconds, so that
+    keys that are in neither tier don't hit `l2` on every lookup.
+
+    Hits and misses are counted per tier by each instance, as summarized
+    by `stats()`, and in the `retro_cache_lookups_total` metric, labelled
+    with the cache `name` (which adds up the caches that share it). The
+    counters of `stats()` are incremented without a lock, and are only
+    approximate when several threads use the cache.
+
+    >   cache = TieredCache(LRUCache(1000), FileCache("/var/cache/app"))
+    """
+
+    INTERVAL = 0.1
+    NEGATIVE_LIMIT = 10000
+
+    def __init__(
+        self, l1, l2, writeBack=False, negative=None, name="tiered", interval=None
+    ):
+        Cache.__init__(self)
+        self.l1 = l1
+        self.l2 = l2
+        self.writeBack = writeBack
+        self.interval = interval or self.INTERVAL
+        self.negatives = (
+            LRUCache(self.NEGATIVE_LIMIT, expires=negative) if negative else None
+        )
+        self.enabled = True
+        self.dirty = {}
+        # Flushing holds the values being written to l2, and the flush lock
+        # is held while they are, so that removals wait for them.
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self._isRunning = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        # The tags are those of l2, which might persist them
+        self.tagIndex = l2.tagIndex
+        self.TAGS = l2.TAGS
+        lookups = REGISTRY.counter(
+            "retro_cache_lookups_total",
+            "Number of cache lookups, per tier and result",
+            ("cache", "tier", "result"),
+        )
+        self._l1Hits = lookups.labels(name, "l1", "hit")
+        self._l1Misses = lookups.labels(name, "l1", "miss")
+        self._l2Hits = lookups.labels(name, "l2", "hit")
+        self._l2Misses = lookups.labels(name, "l2", "miss")
+        self._negativeHits = lookups.labels(name, "negative", "hit")
+        self.l1Hits = 0
+        self.l1Misses = 0
+        self.l2Hits = 0
+        self.l2Misses = 0
+        self.negativeHits = 0
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None:
+            self.l1Hits += 1
+            self._l1Hits.inc()
+            return value
+        self.l1Misses += 1
+        self._l1Misses.inc()
+        if self.negatives is not None and self.negatives.get(key) is not None:
+            self.negativeHits += 1
+            self._negativeHits.inc()
+            return None
+        # The value might have been evicted from l1 before it was written
+        value = self.dirty.get(key)
+        if value is None:
+            value = self.flushing.get(key)
+        if value is None:
+            value = self.l2.get(key)
+        if value is None:
+            self.l2Misses += 1
+            self._l2Misses.inc()
+            if self.negatives is not None:
+                self.negatives.set(key, True)
+            return None
+        self.l2Hits += 1
+        self._l2Hits.inc()
+        self.l1.set(key, value)
+        return value
+
+    def has(self, key):
+        if self.l1.has(key) or key in self.dirty or key in self.flushing:
+            return True
+        elif self.negatives is not None and self.negatives.has(key):
+            return False
+        else:
+            return self.l2.has(key)
+
+    def set(self, key, value):
+        if self.negatives is not None:
+            self.negatives.remove(key)
+        self.l1.set(key, value)
+        if not self.writeBack:
+            self.l2.set(key, value)
+        else:
+            with self.lock:
+                self.dirty[key] = value
+            if not self._isRunning:
+                self.start()
+        return value
+
+    def remove(self, key):
+        # NOTE: A flush in progress would write the value back to l2
+        with self.flushLock:
+            with self.lock:
+                self.dirty.pop(key, None)
+            self.l1.remove(key)
+            self.l2.remove(key)
+
+    def clear(self):
+        with self.flushLock:
+            with self.lock:
+                self.dirty = {}
+            if self.negatives is not None:
+                self.negatives.clear()
+            self.l1.clear()
+            self.l2.clear()
+
+    def keys(self):
+        self.flush()
+        return list(set(self.l1.keys()) | set(self.l2.keys()))
+
+    def cleanup(self):
+        self.flush()
+        self.l1.cleanup()
+        self.l2.cleanup()
+        return self
+
+    def stats(self):
+        """Returns the number of hits and misses of each tier."""
+        return {
+            "l1": {"hits": self.l1Hits, "misses": self.l1Misses},
+            "l2": {"hits": self.l2Hits, "misses": self.l2Misses},
+            "negative": {"hits": self.negativeHits},
+        }
+
+    # =========================================================================
+    # WRITE BACK
+    # =========================================================================
+
+    def flush(self):
+        """Writes the values that were only set in `l1` to `l2`."""
+        with self.flushLock:
+            with self.lock:
+                dirty = self.flushing = self.dirty
+                self.dirty = {}
+            try:
+                for key, value in dirty.items():
+                    self.l2.set(key, value)
+            finally:
+                self.flushing = {}
+        return self
+
+    def start(self):
+        if not self._isRunning:
+            self._isRunning = True
+            self._thread = threading.Thread(
+                target=self.run, name="retro-cache-writeback", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the write back thread, writing the pending values."""
+        if self._isRunning:
+            self._isRunning = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        return self
+
+    def run(self):
+        while self._isRunning:
+            self._wakeup.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                sys.stderr.write(
+                    "[!] retro.contrib.cache: could not write back to "
+                    "{0}: {1}\n".format(self.l2, e)
+                )
+
+
 # -----------------------------------------------------------------------------
 #
 # SIGNATURE CACHE
@@ -619,4 +3066,336 @@ class SignatureCache(Cache):
             return None
 
 
+# -----------------------------------------------------------------------------
+#
+# RESPONSE CACHE
+#
+# -----------------------------------------------------------------------------
+
+
+class CachedResponse:
+    """A complete response (status, headers and body) as stored by the
+    `ResponseCache`, with an optional gzipped variant of the body. Entries
+    with a `None` body are only there to tell which request headers the
+    actual entries vary on. Entries are fresh until `expires`, and can
+    be served stale until `stale`."""
+
+    __slots__ = (
+        "status",
+        "headers",
+        "body",
+        "gzip",
+        "vary",
+        "etag",
+        "created",
+        "expires",
+        "stale",
+    )
+
+    def __init__(
+        self,
+        status=None,
+        headers=(),
+        body=None,
+        gzip=None,
+        vary=(),
+        etag=None,
+        created=0,
+        expires=0,
+        stale=0,
+    ):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.gzip = gzip
+        self.vary = vary
+        self.etag = etag
+        self.created = created
+        self.expires = expires
+        self.stale = max(stale, expires)
+
+
+class ResponseCache:
+    """Caches complete responses in front of the dispatcher, so that hits
+    are served without matching or invoking any handler. Responses are
+    keyed by host, path and normalized query, and by the values of the
+    request headers listed in their `Vary` header.
+
+    Only successful `GET` responses that declare a `max-age` (like the ones
+    produced by `response.cache(...)`) are stored, the default `maxAge`
+    only applying to the responses that are explicitly `public`. Responses
+    that are `private`, `no-store`, `no-cache`, set cookies or vary on `*`
+    are never stored, and requests with an `Authorization` or `Cookie`
+    header or a `no-cache` directive bypass the cache.
+
+    Responses are served stale for the number of seconds given by their
+    `stale-while-revalidate` directive (or `staleFor` by default) after
+    they expire, while the request is dispatched again in the background
+    to refresh them (see `Revalidator`).
+
+    >   ResponseCache(LRUCache(limit=1000), staleFor=60).install(app)
+    """
+
+    METHODS = ("GET", "HEAD")
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_TYPES = (
+        "text/",
+        "application/json",
+        "application/javascript",
+        "application/xml",
+        "image/svg+xml",
+    )
+    NOT_MODIFIED_HEADERS = (
+        "Cache-Control",
+        "Content-Location",
+        "ETag",
+        "Expires",
+        "Vary",
+        "Age",
+    )
+    RE_MAX_AGE = re.compile(r"(?:s-maxage|max-age)\s*=\s*(\d+)")
+    RE_NO_STORE = re.compile(r"private|no-store|no-cache")
+    RE_PUBLIC = re.compile(r"\bpublic\b")
+    RE_STALE = re.compile(r"stale-while-revalidate\s*=\s*(\d+)")
+    ENVIRON_KEY = "retro.responseCache"
+    REFRESH_KEY = "retro.responseCache.refresh"
+
+    def __init__(self, store=None, maxAge=None, compress=True, staleFor=None):
+        self.store = MemoryCache(limit=1000) if store is None else store
+        self.maxAge = maxAge
+        self.staleFor = staleFor
+        self.compress = compress
+        self.dispatcher = None
+        self.revalidator = Revalidator()
+        self.hits = 0
+        self.misses = 0
+        self.staleHits = 0
+
+    def install(self, application):
+        """Installs this cache in front of the given application's
+        dispatcher."""
+        self.dispatcher = application.dispatcher()
+        self.dispatcher.responseCache = self
+        return self
+
+    def key(self, environ):
+        """Returns the key for the given request, made of its host, path
+        and query, in which the parameters are sorted."""
+        query = environ.get("QUERY_STRING")
+        if query and "&" in query:
+            query = "&".join(sorted(_ for _ in query.split("&") if _))
+        path = (
+            (environ.get("HTTP_HOST") or "")
+            + (environ.get("SCRIPT_NAME") or "")
+            + (environ.get("PATH_INFO") or "/")
+        )
+        return "GET " + path + "?" + query if query else "GET " + path
+
+    def varyKey(self, environ, vary):
+        """Returns the values of the given WSGI variables (like
+        `HTTP_ACCEPT_LANGUAGE`) for the request as a string."""
+        values = []
+        for name in vary:
+            value = environ.get(name) or ""
+            if name == "HTTP_ACCEPT_ENCODING":
+                value = "gzip" if "gzip" in value else ""
+            values.append(value)
+        return "|".join(values)
+
+    def invalidate(self, path, query=None, host=None):
+        """Removes the response cached for the given path and query (and
+        all its variants), as requested for the given host."""
+        environ = {"PATH_INFO": path, "QUERY_STRING": query or "", "HTTP_HOST": host}
+        self.store.remove(self.key(environ))
+        return self
+
+    # =========================================================================
+    # LOOKUP
+    # =========================================================================
+
+    def lookup(self, environ, startResponse):
+        """Returns a WSGI response for the cached response matching the
+        given request, or `None`."""
+        if environ.get("REQUEST_METHOD") not in self.METHODS:
+            return None
+        elif environ.get(self.REFRESH_KEY):
+            environ[self.ENVIRON_KEY] = self.key(environ)
+            return None
+        control = environ.get("HTTP_CACHE_CONTROL")
+        # NOTE: Requests with credentials might get a response specific to
+        # their user, which is neither served from nor stored in the cache.
+        if (
+            environ.get("HTTP_AUTHORIZATION")
+            or environ.get("HTTP_COOKIE")
+            or (control and self.RE_NO_STORE.search(control))
+        ):
+            return None
+        key = entry_key = self.key(environ)
+        entry = self.store.get(key)
+        if entry and entry.body is None:
+            entry_key = key + "|" + self.varyKey(environ, entry.vary)
+            entry = self.store.get(entry_key)
+        now = time.time()
+        if not entry or entry.stale < now:
+            self.misses += 1
+            environ[self.ENVIRON_KEY] = key
+            return None
+        elif entry.expires < now:
+            self.staleHits += 1
+            self.revalidate(environ, entry_key)
+        self.hits += 1
+        return self._respond(entry, environ, startResponse, now)
+
+    def revalidate(self, environ, key):
+        """Dispatches the given request again in the background, so that
+        the response stored at the given key is refreshed. This is done
+        by a task of the running event loop under `retro.aio`."""
+        if not self.dispatcher:
+            return False
+        environ = dict(environ)
+        environ["REQUEST_METHOD"] = "GET"
+        environ[self.REFRESH_KEY] = True
+        for name in ("HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE"):
+            environ.pop(name, None)
+        try:
+            asyncio.get_running_loop()
+            refresh = self._refreshAsync
+        except RuntimeError:
+            refresh = self._refresh
+        return self.revalidator.refresh(key, refresh, environ)
+
+    def _refresh(self, environ):
+        # NOTE: The response is saved by the dispatcher, we only need to
+        # run its coroutine (for async handlers) and release it.
+        result = self.dispatcher(environ, self._discard)
+        if isinstance(result, types.CoroutineType):
+            result = asyncio.run(result)
+        if hasattr(result, "close"):
+            result.close()
+
+    async def _refreshAsync(self, environ):
+        result = self.dispatcher(environ, self._discard)
+        if isinstance(result, types.CoroutineType):
+            result = await result
+        if hasattr(result, "close"):
+            result.close()
+
+    @staticmethod
+    def _discard(status, headers, excInfo=None):
+        pass
+
+    def _respond(self, entry, environ, startResponse, now):
+        headers = list(entry.headers)
+        headers.append(("Age", str(int(now - entry.created))))
+        if entry.etag and etagMatches(environ.get("HTTP_IF_NONE_MATCH"), entry.etag):
+            startResponse(
+                "304 Not Modified",
+                [_ for _ in headers if _[0] in self.NOT_MODIFIED_HEADERS],
+            )
+            return
+        body = entry.body
+        if entry.gzip and "gzip" in (environ.get("HTTP_ACCEPT_ENCODING") or ""):
+            body = entry.gzip
+            headers.append(("Content-Encoding", "gzip"))
+        startResponse(entry.status, headers)
+        yield body
+
+    # =========================================================================
+    # STORAGE
+    # =========================================================================
+
+    def save(self, request, response):
+        """Stores the given response if it was produced for a request that
+        missed the cache and it is cacheable. The response is returned
+        as-is."""
+        key = request.environ(self.ENVIRON_KEY)
+        if (
+            not key
+            or request.method != "GET"
+            or not isinstance(response, Response)
+            or response.status != 200
+        ):
+            return response
+        body = response.content
+        if isinstance(body, str):
+            body = response.content = body.encode("utf8")
+        elif not isinstance(body, bytes):
+            return response
+        response.prepare()
+        control = vary = encoding = etag = contentType = None
+        for name, value in response.headers:
+            lname = name.lower()
+            if lname == "cache-control":
+                control = value
+            elif lname == "vary":
+                vary = value
+            elif lname == "content-encoding":
+                encoding = value
+            elif lname == "etag":
+                etag = value
+            elif lname == "content-type":
+                contentType = value
+            elif lname == "set-cookie":
+                return response
+        if control and self.RE_NO_STORE.search(control):
+            return response
+        match = self.RE_MAX_AGE.search(control) if control else None
+        if match:
+            max_age = int(match.group(1))
+        elif control and self.RE_PUBLIC.search(control):
+            max_age = self.maxAge
+        else:
+            max_age = None
+        if not max_age:
+            return response
+        match = self.RE_STALE.search(control) if control else None
+        stale = int(match.group(1)) if match else self.staleFor or 0
+        names = []
+        for _ in (vary or "").split(","):
+            _ = _.strip()
+            if _ == "*":
+                return response
+            elif _:
+                names.append("HTTP_" + _.upper().replace("-", "_"))
+        headers = [_ for _ in response.headers if _[0].lower() != "vary"]
+        gzip = None
+        if encoding:
+            # The body is already encoded for this client
+            if "HTTP_ACCEPT_ENCODING" not in names:
+                names.append("HTTP_ACCEPT_ENCODING")
+        elif (
+            self.compress
+            and len(body) >= self.COMPRESS_MIN_SIZE
+            and contentType
+            and contentType.startswith(self.COMPRESS_TYPES)
+        ):
+            gzip = compress_gzip(body)
+        vary = [_ for _ in (vary or "").split(",") if _.strip()]
+        if gzip and not any(_.strip().lower() == "accept-encoding" for _ in vary):
+            vary.append("Accept-Encoding")
+        if vary:
+            headers.append(("Vary", ", ".join(_.strip() for _ in vary)))
+        now = time.time()
+        entry = CachedResponse(
+            "200 OK",
+            headers,
+            body,
+            gzip,
+            tuple(names),
+            etag,
+            now,
+            now + max_age,
+            now + max_age + stale,
+        )
+        if names:
+            # We store an entry that tells what the variants depend on
+            index = CachedResponse(
+                vary=entry.vary, expires=entry.expires, stale=entry.stale
+            )
+            self.store.set(key, index)
+            key += "|" + self.varyKey(request.environ(), entry.vary)
+        self.store.set(key, entry)
+        return response
+
+
 # EOF
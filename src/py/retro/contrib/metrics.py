@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro - HTTP Toolkit
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# License   : Revised BSD License
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+__doc__ = """
+The 'metrics' module defines a `Metrics` component that exposes the
+metrics registry (see `retro.metrics`) as a Prometheus scrape endpoint,
+and as JSON for quick inspection.
+
+>   run(components=[MyComponent(), Metrics()])
+>   $ curl http://localhost:8000/metrics
+"""
+
+from retro import *
+from retro.metrics import REGISTRY
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ------------------------------------------------------------------------------
+#
+# METRICS COMPONENT
+#
+# ------------------------------------------------------------------------------
+
+
+class Metrics(Component):
+    """Serves the given registry (the default one by default) as
+    `metrics` (Prometheus text format) and `metrics.json`."""
+
+    def __init__(self, registry=None, name="Metrics", prefix=None):
+        Component.__init__(self, name=name, prefix=prefix)
+        self.registry = registry or REGISTRY
+
+    @on(GET="metrics")
+    def getMetrics(self, request):
+        return request.respond(
+            self.registry.asPrometheus(), contentType=PROMETHEUS_CONTENT_TYPE
+        )
+
+    @on(GET="metrics.json")
+    def getMetricsJSON(self, request):
+        return request.returns(self.registry.export())
+
+
+# EOF
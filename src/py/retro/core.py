@@ -6,7 +6,7 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 12-Apr-2006
-# Last mod  : 07-May-2020
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 # TODO: Decouple WSGI-specific code and allow binding to Thor
@@ -23,14 +23,18 @@ import tempfile
 import string
 import gzip
 import io
+import codecs
+import calendar
 import collections
 import unicodedata
+import asyncio
+import threading
 import logging
 from .compat import *
+from . import metrics
 from urllib.parse import parse_qs
 import urllib.parse as urllib_parse
 from http.server import BaseHTTPRequestHandler
-from http.cookies import SimpleCookie
 
 NOTHING = re
 MIME_TYPES = dict(
@@ -40,6 +44,11 @@ MIME_TYPES = dict(
 
 # FIXME: Date in cache support should be locale
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 try:
     import json as simplejson
 
@@ -81,14 +90,227 @@ def normalizeHeader(h):
 # -----------------------------------------------------------------------------
 
 
+class JSONBackend:
+    """Wraps a JSON library so that `dumps(value, default=None)` returns
+    compact, UTF-8 (not ASCII-escaped) strings and `loads(data)` accepts
+    strings, bytes and buffers. All the backends produce the same output,
+    which is what the stdlib `json` module produces with these settings.
+
+    The `default` function is called with values that the library can't
+    serialize, and must either return a value it can serialize or raise
+    a `TypeError`.
+
+    Backends can also provide `dumpsExact`, which only serializes the
+    builtin types themselves: subclasses are given to `default`, and
+    non-string keys and integers beyond 64 bits raise a `TypeError`. This
+    lets `asJSON` use the backend without checking the value first."""
+
+    def __init__(self, name, dumps, loads, dumpsExact=None):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.dumpsExact = dumpsExact
+
+    def __repr__(self):
+        return "<JSONBackend:{0}>".format(self.name)
+
+
+class JSONUnsupported(TypeError):
+    """Raised by `default` functions when a value can't be serialized, so
+    that backends don't retry with the stdlib."""
+
+
+def _stdlibJSONBackend(module=simplejson, name="json"):
+    encoders = {}
+
+    def dumps(value, default=None):
+        encoder = encoders.get(default)
+        if encoder is None:
+            encoder = encoders[default] = module.JSONEncoder(
+                separators=(",", ":"), ensure_ascii=False, default=default
+            )
+        return encoder.encode(value)
+
+    def loads(data):
+        return module.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+    return JSONBackend(name, dumps, loads)
+
+
+def _simplejsonJSONBackend():
+    import simplejson
+
+    return _stdlibJSONBackend(simplejson, "simplejson")
+
+
+def _orjsonJSONBackend():
+    import orjson
+
+    # NOTE: We let `default` handle dates, dataclasses and subclasses of
+    # builtins, so that they're serialized like the other backends do.
+    # Subclasses (like `Params`) might not be filled in until they're
+    # accessed.
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_SUBCLASS
+    )
+    fallback = _stdlibJSONBackend()
+
+    def dumps(value, default=None):
+        try:
+            return orjson.dumps(value, default=default, option=options).decode("utf8")
+        except TypeError as e:
+            if isinstance(e.__cause__, JSONUnsupported):
+                raise e.__cause__
+            # Integers beyond 64-bit, non-string keys and subclasses when
+            # there's no default are not supported by orjson.
+            return fallback.dumps(value, default)
+
+    def dumpsExact(value, default=None):
+        return orjson.dumps(value, default=default, option=options).decode("utf8")
+
+    return JSONBackend("orjson", dumps, orjson.loads, dumpsExact)
+
+
+def _ujsonJSONBackend():
+    import ujson
+
+    fallback = _stdlibJSONBackend()
+
+    def dumps(value, default=None):
+        try:
+            return ujson.dumps(
+                value,
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+                default=default,
+            )
+        except JSONUnsupported:
+            raise
+        except (TypeError, OverflowError) as e:
+            return fallback.dumps(value, default)
+
+    def loads(data):
+        return ujson.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+    return JSONBackend("ujson", dumps, loads)
+
+
+# The JSON backends by order of preference, as factories that raise an
+# `ImportError` when the backend is not available.
+JSON_BACKENDS = collections.OrderedDict(
+    (
+        ("orjson", _orjsonJSONBackend),
+        ("ujson", _ujsonJSONBackend),
+        ("simplejson", _simplejsonJSONBackend),
+        ("json", _stdlibJSONBackend),
+    )
+)
+JSON_BACKEND = None
+
+
+def registerJSONBackend(name, factory, preferred=False):
+    """Registers the given JSON backend factory, which returns a
+    `JSONBackend` or raises an `ImportError`."""
+    JSON_BACKENDS[name] = factory
+    if preferred:
+        JSON_BACKENDS.move_to_end(name, last=False)
+
+
+def getJSONBackend(name):
+    """Returns the JSON backend with the given name, raising an
+    `ImportError` if it is not available."""
+    return JSON_BACKENDS[name]()
+
+
+def setJSONBackend(name=None):
+    """Sets the JSON backend used by `unjson` and `asJSON`, using
+    the first available one when no name is given."""
+    global JSON_BACKEND
+    if name:
+        JSON_BACKEND = getJSONBackend(name)
+    else:
+        for factory in JSON_BACKENDS.values():
+            try:
+                JSON_BACKEND = factory()
+                break
+            except ImportError as e:
+                continue
+    return JSON_BACKEND
+
+
+setJSONBackend()
+
+
 def json(value, *args, **kwargs):
     assert HAS_JSON
+    # NOTE: The output format is the one of the stdlib, which the backends
+    # don't all support, so use `JSON_BACKEND.dumps` for compact output.
     return simplejson.dumps(value, *args, **kwargs)
 
 
 def unjson(value):
     assert HAS_JSON
-    return simplejson.loads(value)
+    return JSON_BACKEND.loads(value)
+
+
+RE_JSON_NON_ASCII = re.compile("[^\x00-\x7f]")
+JSON_HOOKS = ("asJSON", "asDict", "export", "asJS")
+
+
+def _isJSONTuple(value):
+    """Tells if the given tuple (or named tuple) has none of the hooks
+    of `asJSON`, and can be serialized as an array."""
+    t = type(value)
+    return t is tuple or not any(hasattr(t, _) for _ in JSON_HOOKS)
+
+
+def _isPlainJSON(value):
+    """Tells if the given value is only made of the builtin types (not
+    their subclasses), string keys, dates and sets, which `asJSON`
+    serializes like the JSON backends do."""
+    t = type(value)
+    if t is str or t is int or t is float or t is bool or value is None:
+        return True
+    elif t is dict or t is collections.OrderedDict:
+        for k, v in value.items():
+            if type(k) is not str or not _isPlainJSON(v):
+                return False
+        return True
+    elif t is list or t is set or (isinstance(value, tuple) and _isJSONTuple(value)):
+        for v in value:
+            if not _isPlainJSON(v):
+                return False
+        return True
+    else:
+        name = t.__name__
+        return name == "datetime" or name == "date"
+
+
+def _asJSONDefault(value):
+    """The `default` function used by `asJSON` to serialize the values
+    that JSON libraries don't natively support. Subclasses of the builtin
+    types are left to the recursive serializer, as they might have hooks
+    (or, like `Params`, not be filled in yet)."""
+    t = type(value)
+    name = t.__name__
+    if name == "datetime" or name == "date":
+        return tuple(value.timetuple())
+    elif t is set or (isinstance(value, tuple) and _isJSONTuple(value)):
+        return list(value)
+    elif t is collections.OrderedDict:
+        return dict(value)
+    else:
+        raise JSONUnsupported(name)
+
+
+def _escapeJSONChar(match):
+    c = ord(match.group(0))
+    if c < 0x10000:
+        return "\\u{0:04x}".format(c)
+    c -= 0x10000
+    return "\\u{0:04x}\\u{1:04x}".format(0xD800 | (c >> 10), 0xDC00 | (c & 0x3FF))
 
 
 def asJSON(value, **options):
@@ -103,6 +325,28 @@ def asJSON(value, **options):
     """
     # FIXME: It might be better to use json(asPrimitive(value,options)) if it
     # does not have a performance penalty
+    if not options:
+        # NOTE: Most values are made of primitives, dates and sets, which
+        # the backend serializes at native speed. Other values (including
+        # subclasses and non-string keys) make the backend fail, or are
+        # not plain, and are serialized below. Like `json`, the output is
+        # ASCII-escaped.
+        try:
+            backend = JSON_BACKEND
+            if backend.dumpsExact:
+                res = backend.dumpsExact(value, _asJSONDefault)
+            elif _isPlainJSON(value):
+                res = backend.dumps(value, _asJSONDefault)
+            else:
+                res = None
+            if res is not None:
+                return (
+                    res
+                    if res.isascii()
+                    else RE_JSON_NON_ASCII.sub(_escapeJSONChar, res)
+                )
+        except (TypeError, ValueError) as e:
+            pass
     if "currentDepth" in options:
         options["currentDepth"] = options["currentDepth"] + 1
     else:
@@ -120,7 +364,9 @@ def asJSON(value, **options):
         res = json(value)
     elif isinstance(value, str) or isinstance(value, unicode):
         return json(value)
-    elif type(value) in (list, tuple, set):
+    elif type(value) in (list, tuple, set) or (
+        isinstance(value, tuple) and _isJSONTuple(value)
+    ):
         res = "[%s]" % (",".join([asJSON(x, **options) for x in value]))
     elif isinstance(value, dict) or isinstance(value, collections.OrderedDict):
         r = []
@@ -133,11 +379,11 @@ def asJSON(value, **options):
         res = asJSON(tuple(value.timetuple()), **options)
     elif hasattr(value, "__class__") and value.__class__.__name__ == "struct_time":
         res = asJSON(tuple(value), **options)
-    elif hasattr(value, "asJSON") and isinstance(value.asJSON, collections.Callable):
+    elif hasattr(value, "asJSON") and callable(value.asJSON):
         res = value.asJSON(asJSON, **options)
-    elif hasattr(value, "asDict") and isinstance(value.asDict, collections.Callable):
+    elif hasattr(value, "asDict") and callable(value.asDict):
         res = json(value.asDict())
-    elif hasattr(value, "export") and isinstance(value.export, collections.Callable):
+    elif hasattr(value, "export") and callable(value.export):
         try:
             value = value.export(**options)
         except:
@@ -145,7 +391,7 @@ def asJSON(value, **options):
         res = asJSON(value)
     # The asJS is not JSON, but rather only JavaScript objects, so this implies
     # that there is a library implemented on the client side
-    elif hasattr(value, "asJS") and isinstance(value.asJS, collections.Callable):
+    elif hasattr(value, "asJS") and callable(value.asJS):
         res = value.asJS(asJSON, **options)
     # There may be a "serializer" function that knows better about the different
     # types of object. We use it if it is provided.
@@ -180,11 +426,9 @@ def asPrimitive(value, **options):
         res = tuple(value.timetuple())
     elif hasattr(value, "__class__") and value.__class__.__name__ == "struct_time":
         res = tuple(value)
-    elif hasattr(value, "asPrimitive") and isinstance(
-        value.asPrimitive, collections.Callable
-    ):
+    elif hasattr(value, "asPrimitive") and callable(value.asPrimitive):
         res = value.asPrimitive(processor=asPrimitive, **options)
-    elif hasattr(value, "export") and isinstance(value.export, collections.Callable):
+    elif hasattr(value, "export") and callable(value.export):
         try:
             res = value.export(**options)
         except:
@@ -201,7 +445,7 @@ def asPrimitive(value, **options):
 
 # -----------------------------------------------------------------------------
 #
-# CACHE TIMESTAMP
+# HTTP DATES
 #
 # -----------------------------------------------------------------------------
 
@@ -214,7 +458,7 @@ MONTHS = (
     "Apr",
     "May",
     "Jun",
-    "July",
+    "Jul",
     "Aug",
     "Sep",
     "Oct",
@@ -223,18 +467,224 @@ MONTHS = (
 )
 
 
+class HTTPDate:
+    """Formats and parses the dates used in HTTP headers (`Last-Modified`,
+    `Expires`, `If-Modified-Since`). As the same few values come up over
+    and over (the current second, file modification times, the dates
+    sent back by clients), all of them are cached.
+
+    >   HTTPDate.Format(784111777) == "Sun, 06 Nov 1994 08:49:37 GMT"
+    >   HTTPDate.Parse("Sunday, 06-Nov-94 08:49:37 GMT") == 784111777
+    """
+
+    FORMAT = "%s, %02d %s %04d %02d:%02d:%02d GMT"
+    MONTH_INDEX = dict((_, i + 1) for i, _ in enumerate(MONTHS))
+    CACHE_SIZE = 1024
+    # Maps an offset to the current second and its formatted date
+    NOW = {}
+    FORMATTED = collections.OrderedDict()
+    PARSED = collections.OrderedDict()
+
+    @classmethod
+    def Seconds(cls, t):
+        """Returns the given time (a timestamp or a `time.struct_time`)
+        as a number of seconds since the epoch."""
+        if isinstance(t, time.struct_time):
+            return calendar.timegm(t)
+        else:
+            return int(t)
+
+    @classmethod
+    def Now(cls, offset=0):
+        """Returns the current time plus the given offset (in seconds)
+        formatted as an HTTP date, only formatting it once per second."""
+        now = int(time.time())
+        cached = cls.NOW.get(offset)
+        if cached and cached[0] == now:
+            return cached[1]
+        res = cls.Format(now + offset, False)
+        cls.NOW[offset] = (now, res)
+        return res
+
+    @classmethod
+    def Format(cls, t, cached=True):
+        """Formats the given time (a timestamp or a `time.struct_time`) as an
+        IMF-fixdate. Formatted dates are kept in an LRU cache, so that
+        file modification times are only formatted once."""
+        t = cls.Seconds(t)
+        if cached:
+            try:
+                res = cls.FORMATTED[t]
+                cls.FORMATTED.move_to_end(t)
+                return res
+            except KeyError:
+                pass
+        g = time.gmtime(t)
+        res = cls.FORMAT % (
+            DAYS[g.tm_wday],
+            g.tm_mday,
+            MONTHS[g.tm_mon - 1],
+            g.tm_year,
+            g.tm_hour,
+            g.tm_min,
+            g.tm_sec,
+        )
+        if cached:
+            cls._Store(cls.FORMATTED, t, res)
+        return res
+
+    @classmethod
+    def Parse(cls, text):
+        """Parses the given HTTP date (IMF-fixdate, RFC 850 or asctime) and
+        returns it as seconds since the epoch, or `None` if it is invalid."""
+        if not text:
+            return None
+        try:
+            res = cls.PARSED[text]
+            cls.PARSED.move_to_end(text)
+            return res
+        except KeyError:
+            pass
+        try:
+            res = cls._Parse(text)
+        except (ValueError, KeyError, OverflowError):
+            res = None
+        cls._Store(cls.PARSED, text, res)
+        return res
+
+    @classmethod
+    def _Parse(cls, text):
+        parts = text.split()
+        n = len(parts)
+        if n == 6 and parts[5] == "GMT":
+            # IMF-fixdate: Sun, 06 Nov 1994 08:49:37 GMT
+            _, day, month, year, hms, _ = parts
+            year = int(year)
+        elif n == 4 and parts[3] == "GMT":
+            # RFC 850: Sunday, 06-Nov-94 08:49:37 GMT
+            day, month, year = parts[1].split("-")
+            hms = parts[2]
+            year = int(year)
+            # SEE: RFC 7231 7.1.1.1, years more than 50 years in the future
+            # are in the past.
+            year += 2000 if year + 2000 <= time.gmtime().tm_year + 50 else 1900
+        elif n == 5:
+            # asctime: Sun Nov  6 08:49:37 1994
+            _, month, day, hms, year = parts
+            year = int(year)
+        else:
+            return None
+        hour, minute, second = hms.split(":")
+        month = cls.MONTH_INDEX[month]
+        day, hour, minute, second = int(day), int(hour), int(minute), int(second)
+        if not (
+            1 <= day <= 31 and 0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 61
+        ):
+            return None
+        return calendar.timegm((year, month, day, hour, minute, second))
+
+    @classmethod
+    def _Store(cls, cache, key, value):
+        cache[key] = value
+        if len(cache) > cls.CACHE_SIZE:
+            try:
+                cache.popitem(last=False)
+            except KeyError:
+                pass
+
+
 def cache_timestamp(t):
-    # NOTE: We  have to do it here as we don't want to force the locale
-    # FORMAT: If-Modified-Since: Sat, 29 Oct 1994 19:43:31 GMT
-    return "%s, %02d %s %d %d:%d:%d GMT" % (
-        DAYS[t.tm_wday],
-        t.tm_mday,
-        MONTHS[t.tm_mon - 1],
-        t.tm_year,
-        t.tm_hour,
-        t.tm_min,
-        t.tm_sec,
-    )
+    """Formats the given `time.struct_time` (or timestamp) as an HTTP
+    date, see `HTTPDate.Format`."""
+    return HTTPDate.Format(t)
+
+
+# -----------------------------------------------------------------------------
+#
+# ETAGS
+#
+# -----------------------------------------------------------------------------
+
+
+def etag(data):
+    """Returns a strong ETag for the given bytes, using `xxhash` when
+    available and BLAKE2b otherwise. Neither is cryptographic here, we
+    only need a fast hash with a low collision rate.
+
+    >   etag(b"Hello") == '"' + hashlib.blake2b(b"Hello", digest_size=16).hexdigest() + '"'
+    """
+    if xxhash:
+        return '"' + xxhash.xxh3_128_hexdigest(data) + '"'
+    else:
+        return '"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+
+
+def etagMatches(header, tag):
+    """Tells if the given `If-None-Match` header matches the given ETag,
+    using the weak comparison mandated by RFC 7232."""
+    if not header or not tag:
+        return False
+    elif header == tag:
+        return True
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for _ in header.split(","):
+        _ = _.strip()
+        if _.startswith("W/"):
+            _ = _[2:]
+        if _ == tag or _ == "*":
+            return True
+    return False
+
+
+# -----------------------------------------------------------------------------
+#
+# COOKIES
+#
+# -----------------------------------------------------------------------------
+
+
+def parseCookies(text):
+    """Parses the given `Cookie` header into a dict of raw (still quoted)
+    values. Unlike `SimpleCookie`, malformed pairs are skipped instead of
+    interrupting the parsing, and the first occurence of a name wins, as
+    user agents send the cookies with the most specific path first.
+
+    >   parseCookies('a=1; b="x y"; a=2') == {"a": "1", "b": "x y"}
+    """
+    cookies = {}
+    if not text:
+        return cookies
+    for pair in text.split(";"):
+        name, sep, value = pair.partition("=")
+        if not sep:
+            continue
+        name = name.strip()
+        if not name or name in cookies:
+            continue
+        value = value.strip()
+        if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+        cookies[name] = value
+    return cookies
+
+
+def quoteCookie(text):
+    """Quotes the given cookie name, value or path, skipping `quote` for
+    the common alphanumeric case."""
+    return text if text.isalnum() and text.isascii() else quote(text)
+
+
+def formatCookie(name, value, path="/", quoted=True):
+    """Returns the value of a `Set-Cookie` header for the given cookie.
+    Name, value and path are quoted unless `quoted` is `False`, in which
+    case they're expected to be valid already."""
+    value = unicode(value)
+    if quoted:
+        name = quoteCookie(name)
+        value = quoteCookie(value)
+        path = quoteCookie(path) if path else path
+    return f"{name}={value}; path={path}" if path else f"{name}={value}"
 
 
 # -----------------------------------------------------------------------------
@@ -246,7 +696,9 @@ def cache_timestamp(t):
 
 def compress_gzip(data):
     out = io.BytesIO()
-    f = gzip.GzipFile(fileobj=out, mode="w")
+    # NOTE: We don't store the time, so that the same data always gives
+    # the same output (and ETag).
+    f = gzip.GzipFile(fileobj=out, mode="w", mtime=0)
     f.write(data)
     f.close()
     return out.getvalue()
@@ -472,6 +924,607 @@ class FormData:
             yield (meta, data_file)
 
 
+# -----------------------------------------------------------------------------
+#
+# PARAMS
+#
+# -----------------------------------------------------------------------------
+
+
+class Params(dict):
+    """The parameters of a request, as a dictionary that is filled lazily
+    from query strings and URL-encoded forms: sources are only split on
+    the first access, and values are only unquoted when they're accessed.
+    Values given more than once are kept as a list (use `getlist` to always
+    get a list), values are decoded with the given charset, and sources can
+    be given as bytes.
+
+    >   params = Params()
+    >   params.feed("a=1&b=2&a=3")
+    >   params["a"]
+    >   ['1', '3']
+
+    Encoders that read the dictionary directly, like the C encoder of the
+    stdlib `json`, see it empty until it is parsed (with `parse` or any
+    access), which is why `Request.params` returns parsed parameters.
+    """
+
+    __slots__ = ("charset", "_sources", "_quoted")
+
+    def __init__(self, charset=None):
+        dict.__init__(self)
+        self.charset = charset or "utf-8"
+        self._sources = None
+        self._quoted = 0
+
+    def feed(self, data, charset=None, bare=False):
+        """Adds the given query string or URL-encoded form to the sources.
+        When `bare` is set and the data has no value (like `?page`), the
+        data is used both as a key and as the value of the `""` key."""
+        if data:
+            if self._sources is None:
+                self._sources = []
+            self._sources.append((data, charset or self.charset, bare))
+        return self
+
+    def add(self, name, value):
+        """Adds the given value, which turns the existing value into a list
+        when there is one already."""
+        self._parse()
+        self._add(name, value)
+
+    def _add(self, name, value):
+        # We flatten the  value if it's an array with one element (as this
+        # is what is returned when parsing query strings).
+        if value and type(value) is list and len(value) == 1:
+            value = value[0]
+        if not dict.__contains__(self, name):
+            dict.__setitem__(self, name, value)
+        else:
+            current = dict.__getitem__(self, name)
+            if type(current) is list:
+                current.append(value)
+            else:
+                dict.__setitem__(self, name, [current, value])
+
+    def getlist(self, name):
+        """Returns the list of values for the given name."""
+        value = self.get(name)
+        if value is None:
+            return []
+        return value if type(value) is list else [value]
+
+    # =========================================================================
+    # PARSING
+    # =========================================================================
+
+    def parse(self):
+        """Parses the sources fed so far, leaving the values quoted until
+        they're accessed."""
+        self._parse()
+        return self
+
+    def _parse(self):
+        sources = self._sources
+        if sources:
+            self._sources = None
+            for data, charset, bare in sources:
+                count = dict.__len__(self)
+                if isinstance(data, str):
+                    self._parseString(data, charset)
+                else:
+                    self._parseBytes(data, charset)
+                if bare and dict.__len__(self) == count:
+                    if not isinstance(data, str):
+                        data = bytes(data).decode(charset, "replace")
+                    data = unquote(data)
+                    dict.__setitem__(self, data, "")
+                    dict.__setitem__(self, "", data)
+
+    def _parseString(self, data, charset):
+        # NOTE: This is the hot path, so we only go through `_add` for
+        # repeated keys.
+        contains = dict.__contains__
+        setitem = dict.__setitem__
+        quoted = 0
+        for pair in data.split("&"):
+            name, _, value = pair.partition("=")
+            # NOTE: Like `parse_qs`, we skip blank values
+            if not value:
+                continue
+            if "%" in name or "+" in name:
+                name = QuotedParam(name, charset).decode()
+            if "%" in value or "+" in value:
+                value = QuotedParam(value, charset)
+                quoted += 1
+            if contains(self, name):
+                self._add(name, value)
+            else:
+                setitem(self, name, value)
+        self._quoted += quoted
+
+    def _parseBytes(self, data, charset):
+        contains = dict.__contains__
+        setitem = dict.__setitem__
+        quoted = 0
+        for pair in bytes(data).split(b"&"):
+            name, _, value = pair.partition(b"=")
+            if not value:
+                continue
+            if b"%" in name or b"+" in name:
+                name = QuotedParam(name, charset).decode()
+            else:
+                name = name.decode(charset, "replace")
+            if b"%" in value or b"+" in value:
+                value = QuotedParam(value, charset)
+                quoted += 1
+            else:
+                value = value.decode(charset, "replace")
+            if contains(self, name):
+                self._add(name, value)
+            else:
+                setitem(self, name, value)
+        self._quoted += quoted
+
+    def _decode(self, name, value):
+        """Returns the given value with its quoted values decoded, updating
+        the stored value."""
+        if type(value) is QuotedParam:
+            value = value.decode()
+            dict.__setitem__(self, name, value)
+            self._quoted -= 1
+        elif type(value) is list:
+            for i, v in enumerate(value):
+                if type(v) is QuotedParam:
+                    value[i] = v.decode()
+                    self._quoted -= 1
+        return value
+
+    def _decodeAll(self):
+        self._parse()
+        if self._quoted:
+            for name, value in list(dict.items(self)):
+                self._decode(name, value)
+
+    # =========================================================================
+    # DICT INTERFACE
+    # =========================================================================
+
+    def __getitem__(self, name):
+        self._parse()
+        return self._decode(name, dict.__getitem__(self, name))
+
+    def get(self, name, default=None):
+        self._parse()
+        if dict.__contains__(self, name):
+            return self._decode(name, dict.__getitem__(self, name))
+        return default
+
+    def __setitem__(self, name, value):
+        self._parse()
+        self._decode(name, dict.get(self, name))
+        dict.__setitem__(self, name, value)
+
+    def __delitem__(self, name):
+        self._parse()
+        self._decode(name, dict.get(self, name))
+        dict.__delitem__(self, name)
+
+    def __contains__(self, name):
+        self._parse()
+        return dict.__contains__(self, name)
+
+    def __iter__(self):
+        self._parse()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._parse()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._decodeAll()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._decodeAll()
+        return dict.__repr__(self)
+
+    def keys(self):
+        self._parse()
+        return dict.keys(self)
+
+    def values(self):
+        self._decodeAll()
+        return dict.values(self)
+
+    def items(self):
+        self._decodeAll()
+        return dict.items(self)
+
+    def copy(self):
+        self._decodeAll()
+        return dict(dict.items(self))
+
+    def setdefault(self, name, value=None):
+        if name in self:
+            return self[name]
+        dict.__setitem__(self, name, value)
+        return value
+
+    def pop(self, name, *default):
+        if name in self:
+            self[name]
+        return dict.pop(self, name, *default)
+
+    def popitem(self):
+        self._decodeAll()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        self._parse()
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def clear(self):
+        self._sources = None
+        self._quoted = 0
+        dict.clear(self)
+
+    __hash__ = None
+
+
+class QuotedParam:
+    """A parameter value that is still URL-quoted, as a string or bytes."""
+
+    __slots__ = ("data", "charset")
+
+    # Maps the (any case) hex digits following a `%` to their byte
+    HEX = {}
+    for _ in range(256):
+        for _h in {"%02x" % _, "%02X" % _, "%x%X" % divmod(_, 16), "%X%x" % divmod(_, 16)}:
+            HEX[_h.encode("ascii")] = bytes((_,))
+    del _, _h
+
+    @classmethod
+    def Unquote(cls, data):
+        """Unquotes the given bytes, as `unquote_to_bytes` does, with `+`
+        as spaces."""
+        parts = data.replace(b"+", b" ").split(b"%")
+        if len(parts) == 1:
+            return parts[0]
+        hex = cls.HEX
+        res = [parts[0]]
+        for part in parts[1:]:
+            c = hex.get(part[:2])
+            if c is None:
+                res.append(b"%")
+                res.append(part)
+            else:
+                res.append(c)
+                res.append(part[2:])
+        return b"".join(res)
+
+    def __init__(self, data, charset):
+        self.data = data
+        self.charset = charset
+
+    def decode(self):
+        data = self.data
+        if isinstance(data, str):
+            if not data.isascii():
+                return urllib_parse.unquote_plus(data, self.charset, "replace")
+            data = data.encode("ascii")
+        return self.Unquote(data).decode(self.charset, "replace")
+
+
+# -----------------------------------------------------------------------------
+#
+# JSON STREAM
+#
+# -----------------------------------------------------------------------------
+
+
+class JSONStream:
+    """Incrementally decodes a JSON document fed in chunks, returning the
+    elements of a top-level array (or the `(key, value)` members of a
+    top-level object) as soon as they are complete. Only the current
+    element is kept in memory, which is what makes it possible to process
+    huge bulk payloads.
+
+    >   parser = JSONStream()
+    >   for chunk in chunks:
+    >       for item in parser.feed(chunk):
+    >           process(item)
+    >   parser.feed(b"", final=True)
+
+    A top-level scalar is returned as a single item."""
+
+    RE_WHITESPACE = re.compile(r"[ \t\n\r]*")
+    NUMBER = "0123456789.eE+-"
+
+    @staticmethod
+    def Items(value):
+        """Iterates on the items of an already decoded value, in the same
+        way as the stream would."""
+        if isinstance(value, list):
+            return iter(value)
+        elif isinstance(value, dict):
+            return iter(value.items())
+        else:
+            return iter((value,))
+
+    def __init__(self):
+        self.decoder = simplejson.JSONDecoder()
+        self.text = ""
+        self.offset = 0
+        self.container = None
+        self.state = None
+        self.isComplete = False
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._retry = 0
+
+    def feed(self, data, final=False):
+        """Feeds the given bytes (or text) to the parser, returning the list
+        of items completed so far. The last call must set `final`, which
+        raises a `ValueError` if the document is incomplete."""
+        if isinstance(data, str):
+            text = data
+        else:
+            text = self._utf8.decode(data, final)
+        if self.offset:
+            self.text = self.text[self.offset :] + text
+            self.offset = 0
+        else:
+            self.text += text
+        items = []
+        # NOTE: When an element spans several chunks, we wait for the
+        # pending text to double before trying again, so that decoding
+        # large elements stays linear.
+        if final or len(self.text) >= self._retry:
+            self._parse(items, final)
+        if final and not self.isComplete:
+            raise ValueError("Incomplete JSON document")
+        return items
+
+    def _isCut(self, text, end):
+        # NOTE: An element that ends with the text, or that is followed by
+        # what could be the rest of a number (`1` then `.5`) might continue
+        # in the next chunk.
+        return end >= len(text) or text[end] in self.NUMBER
+
+    def _skip(self, text, offset):
+        return self.RE_WHITESPACE.match(text, offset).end()
+
+    def _parse(self, items, final):
+        text = self.text
+        n = len(text)
+        o = self.offset
+        decode = self.decoder.raw_decode
+        while not self.isComplete:
+            o = self._skip(text, o)
+            if o >= n:
+                break
+            c = text[o]
+            state = self.state
+            if self.container is None:
+                if c == "[" or c == "{":
+                    self.container = c
+                    self.state = "first"
+                    o += 1
+                    continue
+                try:
+                    value, end = decode(text, o)
+                except ValueError as e:
+                    if final:
+                        raise
+                    break
+                if not final and self._isCut(text, end):
+                    break
+                items.append(value)
+                self.isComplete = True
+                o = end
+            elif state == "sep":
+                if c == ",":
+                    self.state = "item"
+                    o += 1
+                elif c == ("]" if self.container == "[" else "}"):
+                    self.isComplete = True
+                    o += 1
+                else:
+                    raise ValueError(
+                        "Expected ',' or end of container at {0}: {1}".format(
+                            o, repr(text[o : o + 20])
+                        )
+                    )
+            elif state == "first" and c == ("]" if self.container == "[" else "}"):
+                self.isComplete = True
+                o += 1
+            else:
+                try:
+                    if self.container == "[":
+                        item, end = decode(text, o)
+                    else:
+                        if c != '"':
+                            raise ValueError(
+                                "Expected a key at {0}: {1}".format(
+                                    o, repr(text[o : o + 20])
+                                )
+                            )
+                        key, end = decode(text, o)
+                        end = self._skip(text, end)
+                        if end >= n:
+                            break
+                        if text[end] != ":":
+                            raise ValueError(
+                                "Expected ':' at {0}: {1}".format(
+                                    end, repr(text[end : end + 20])
+                                )
+                            )
+                        end = self._skip(text, end + 1)
+                        value, end = decode(text, end)
+                        item = (key, value)
+                except ValueError as e:
+                    # The element is either incomplete or invalid, which we
+                    # can only tell once we've got the whole document.
+                    if final:
+                        raise
+                    break
+                if not final and self._isCut(text, end):
+                    break
+                items.append(item)
+                self.state = "sep"
+                o = end
+        self.offset = o
+        self._retry = 2 * (n - o) if not self.isComplete else 0
+        if self.isComplete and self._skip(text, o) < n:
+            raise ValueError(
+                "Extra data after JSON document at {0}: {1}".format(
+                    o, repr(text[o : o + 20])
+                )
+            )
+
+
+# -----------------------------------------------------------------------------
+#
+# REQUEST BODY
+#
+# -----------------------------------------------------------------------------
+
+
+class RequestBody:
+    """Holds the body of a request. Bodies of up to `memoryLimit` bytes are
+    stored in a single `bytearray` preallocated from the request's
+    `Content-Length`, while larger bodies are spilled to a temporary file
+    in the given `directory` (which can be a `tmpfs` mount).
+
+    A request body is file-like (`write`, `read`, `readinto`, `seek` and
+    `tell`), and `view()` returns the in-memory data without copying it."""
+
+    FILL_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, size, memoryLimit, directory=None):
+        self.length = 0
+        self.position = 0
+        if size <= memoryLimit:
+            self.buffer = bytearray(size)
+            self.file = None
+        else:
+            self.buffer = None
+            self.file = tempfile.TemporaryFile(dir=directory)
+
+    @property
+    def isInMemory(self):
+        return self.file is None
+
+    def fill(self, stream, size):
+        """Reads at most `size` bytes from the given stream straight into
+        the body using `stream.readinto`, returning the number of bytes
+        read."""
+        read = 0
+        if self.file is None:
+            self._reserve(self.length + size)
+            with memoryview(self.buffer) as view:
+                while read < size:
+                    n = stream.readinto(view[self.length : self.length + size - read])
+                    if not n:
+                        break
+                    self.length += n
+                    read += n
+        else:
+            chunk = bytearray(min(size, self.FILL_CHUNK_SIZE))
+            with memoryview(chunk) as view:
+                self.file.seek(self.length)
+                while read < size:
+                    n = stream.readinto(view[: min(len(chunk), size - read)])
+                    if not n:
+                        break
+                    self.file.write(view[:n])
+                    self.length += n
+                    read += n
+        return read
+
+    def write(self, data):
+        n = len(data)
+        if self.file is None:
+            end = self.length + n
+            self._reserve(end)
+            self.buffer[self.length : end] = data
+        else:
+            self.file.seek(self.length)
+            self.file.write(data)
+        self.length += n
+        return n
+
+    def _reserve(self, size):
+        if size > len(self.buffer):
+            self.buffer.extend(bytes(size - len(self.buffer)))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self.length
+        else:
+            end = min(self.length, self.position + size)
+        if self.file is None:
+            with memoryview(self.buffer) as view:
+                res = view[self.position : end].tobytes()
+        else:
+            self.file.seek(self.position)
+            res = self.file.read(end - self.position)
+        self.position += len(res)
+        return res
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.length
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def view(self):
+        """Returns a `memoryview` on the body's data, which is only a copy
+        when the body was spilled to a file."""
+        if self.file is None:
+            return memoryview(self.buffer)[: self.length]
+        else:
+            self.file.seek(0)
+            return memoryview(self.file.read(self.length))
+
+    def getvalue(self):
+        """Returns the body's data as bytes."""
+        if self.file is None:
+            if self.length == len(self.buffer):
+                return bytes(self.buffer)
+            with memoryview(self.buffer) as view:
+                return view[: self.length].tobytes()
+        else:
+            self.file.seek(0)
+            return self.file.read(self.length)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.buffer = None
+        self.length = self.position = 0
+
+    def __len__(self):
+        return self.length
+
+
 # ------------------------------------------------------------------------------
 #
 # REQUEST OBJECT
@@ -484,7 +1537,14 @@ class Request:
     webserver, it is not directly built by the developer. As web server receive
     requests, they have to build responses to fullfill the requests."""
 
-    DATA_SPOOL_SIZE = 64 * 1024
+    # Bodies up to this size are kept in memory, larger ones are spilled
+    # to a temporary file in `BODY_DIRECTORY` (the system's default if
+    # `None`).
+    BODY_MEMORY_LIMIT = 1024 * 1024
+    BODY_DIRECTORY = None
+    # JSON bodies up to this size are decoded at once by `streamJSON`
+    JSON_STREAM_THRESHOLD = 1024 * 1024
+    JSON_STREAM_CHUNK_SIZE = 64 * 1024
     REQUEST_URI = "REQUEST_URI"
     REQUEST_METHOD = "REQUEST_METHOD"
     CONTENT_TYPE = "CONTENT_TYPE"
@@ -503,6 +1563,7 @@ class Request:
     HEADER_EXPIRES = "Expires"
     HEADER_CONTENT_TYPE = "Content-Type"
     HEADER_IF_NONE_MATCH = "If-None-Match"
+    HEADER_ETAG = "ETag"
     HEADER_IF_MODIFIED_SINCE = "If-Modified-Since"
 
     def __init__(self, environ, charset=None):
@@ -510,13 +1571,15 @@ class Request:
         self._environ = environ
         self._headers = None
         self._charset = charset
-        # FIXME: Not sure while we create one directly
-        self._data = tempfile.SpooledTemporaryFile(max_size=self.DATA_SPOOL_SIZE)
+        # NOTE: The body is only created once we start loading it, as we
+        # then know its size.
+        self._data = None
         self._component = None
         self._cookies = None
         self._files = None
         self._params = None
         self._responseHeaders = []
+        self._responseCookies = None
         self._bodyLoader = None
         self.protocol = "http"
         self.isClosed = False
@@ -528,6 +1591,11 @@ class Request:
     def createRequestBodyLoader(self, request, complete=False):
         return RequestBodyLoader(request, complete)
 
+    def createRequestBody(self, size):
+        """Creates the `RequestBody` that will hold a body of the given
+        size."""
+        return RequestBody(size, self.BODY_MEMORY_LIMIT, self.BODY_DIRECTORY)
+
     @property
     def headers(self):
         if self._headers is None:
@@ -627,34 +1695,19 @@ class Request:
         load as True, this will only return the parameters containes in the
         request URI, not the parameters contained in the form data, in the
         case of a POST."""
-        # Otherwise, if the parameters are empty
-        if not self._params:
-            query = self._environ.get(self.QUERY_STRING)
-            if query:
-                # We try to parse the query string
-                query_params = parse_qs(query)
-                # FIXME: What about unquote?
-                # for key, value in params.items():
-                # 	if name == key:
-                # 		if len(value) == 1: return urllib.unquote(value[0])
-                # 		return urllib.unquote(value)
-                # TODO: Decode support
-                # if not self._charset is None:
-                # for key, value in d.iteritems():
-                # d[key] = [i.decode(self._charset, 'ignore') for i in value]
-                # In some cases we may only have a string as query, so we consider
-                # it as a key
-                if not query_params:
-                    query = urllib_parse.unquote(query)
-                    query_params = {query: "", "": query}
-                for k, v in list(query_params.items()):
-                    self._addParam(k, v)
-            else:
-                self._params = {}
-            # We load if we haven't loaded yet and load is True
-            if load and not self.isLoaded():
-                self.load()
-        return self._params
+        if self._params is None:
+            # NOTE: The query string is only parsed once the parameters
+            # are accessed.
+            self._params = Params(self._charset).feed(
+                self._environ.get(self.QUERY_STRING), bare=True
+            )
+        # We load if we haven't loaded yet and load is True
+        if load and not self.isLoaded():
+            self.load()
+        # NOTE: The parameters are returned parsed, as JSON encoders might
+        # not go through the dictionary interface. The values are still
+        # only unquoted when they're accessed.
+        return self._params.parse()
 
     def parseParams(self, **processors):
         """Returns uses the `processors:Dict[str,Function]` to parse
@@ -711,60 +1764,66 @@ class Request:
         return result
 
     def cookies(self):
-        """Returns the cookies (as a 'Cookie.SimpleCookie' instance)
-        attached to this request."""
-        if self._cookies != None:
-            return self._cookies
-        cookies = SimpleCookie()
-        cookies.load(self.environ(self.HTTP_COOKIE) or "")
-        self._cookies = cookies
+        """Returns the cookies attached to this request as a dict of raw
+        (quoted) values, the `Cookie` header being only parsed on the
+        first call."""
+        if self._cookies is None:
+            self._cookies = parseCookies(self.environ(self.HTTP_COOKIE))
         return self._cookies
 
     def cookie(self, name, value=NOTHING, path="/"):
         """Returns the value of the given cookie or 'None', if a value is set,
         will make sure that any generated response will set the given cookie."""
         if value is NOTHING:
-            c = self.cookies().get(urllib_parse.quote(name))
-            if c:
-                return urllib_parse.unquote(c.value)
+            value = self.cookies().get(quoteCookie(name))
+            if value and "%" in value:
+                return unquote(value)
             else:
-                return None
+                return value
         else:
-            # NOTE: See also Response.setCookie
-            found = False
-            i = 0
             # We update the current cookie jar, so that the cookies can
             # be retrieved. It might seem that you don't want to touch the
             # request, but at the same time, the request actuall reflects
             # the state of the session.
-            cookies = self.cookies()
-            cookies[name] = value
-            cookies[name]["path"] = path
-            # And now we update the response headers
-            cookie_name = urllib_parse.quote(name) + "="
-            cookie_path = ("; path=" + urllib_parse.quote(path)) if path else ""
-            cookie_value = urllib_parse.quote(unicode(value))
-            # We'll only replace the cookies with the same name and path
-            for header in self._responseHeaders:
-                if (
-                    header[0] == self.HEADER_SET_COOKIE
-                    and header[1].startswith(cookie_name)
-                    and cookie_path in header[1]
-                ):
-                    self._responseHeaders[i] = (
-                        header[0],
-                        "%s%s%s" % (cookie_name, cookie_value, cookie_path),
-                    )
-                    found = True
-                i += 1
+            header = formatCookie(name, value, path)
+            self.cookies()[quoteCookie(name)] = quoteCookie(unicode(value))
+            # NOTE: See also Response.setCookie. We'll only replace the
+            # cookies with the same name and path, which we index.
+            key = (name, path)
+            if self._responseCookies is None:
+                self._responseCookies = {}
+            i = self._responseCookies.get(key)
+            if i is None:
+                self._responseCookies[key] = len(self._responseHeaders)
+                self._responseHeaders.append((self.HEADER_SET_COOKIE, header))
+            else:
+                self._responseHeaders[i] = (self.HEADER_SET_COOKIE, header)
+
+    def etagMatches(self, tag):
+        """Tells if the given ETag matches the request's `If-None-Match`
+        header, in which case the client already has the content."""
+        return etagMatches(self.header(self.HEADER_IF_NONE_MATCH), tag)
+
+    def ifChanged(self, version):
+        """Tells if the content identified by the given version (any value
+        that changes along with the content, like a revision number or an
+        update time) differs from the client's cached copy. The
+        corresponding ETag is added to the response, so handlers can skip
+        producing the content altogether:
+
+        >   if not request.ifChanged(article.revision):
+        >       return request.notModified()
+        """
+        tag = etag(ensureBytes(unicode(version)))
+        # NOTE: We replace in place, as the cookies index the headers
+        headers = self._responseHeaders
+        for i, header in enumerate(headers):
+            if header[0] == self.HEADER_ETAG:
+                headers[i] = (self.HEADER_ETAG, tag)
                 break
-            if not found:
-                self._responseHeaders.append(
-                    (
-                        self.HEADER_SET_COOKIE,
-                        "%s%s%s" % (cookie_name, cookie_value, cookie_path),
-                    )
-                )
+        else:
+            headers.append((self.HEADER_ETAG, tag))
+        return not self.etagMatches(tag)
 
     def has(self, name, load=False):
         """Tells if the request has the given parameter."""
@@ -814,13 +1873,16 @@ class Request:
         else:
             return session.value(name, value)
 
-    def data(self, data=NOTHING, asFile=False, partial=False):
+    def data(self, data=NOTHING, asFile=False, partial=False, asView=False):
         """Gets/sets the request data as a file object. Note that when using
         the `asFile` parameter, you should be sure to not do any concurrent access
         to the data as a file, as you'll use the same file descriptor.
+
+        With `asView`, the data is returned as a `memoryview` which, unlike
+        the default `bytes`, does not copy bodies held in memory.
         """
         self._data_load(data, partial)
-        return self._data_process(data, asFile, partial)
+        return self._data_process(data, asFile, partial, asView)
 
     def _data_load(self, data, partial):
         if data == NOTHING and not partial:
@@ -829,29 +1891,64 @@ class Request:
                 if asyncio_iscoroutine(load):
                     raise Exception("Synchronous request used with async server")
 
-    def _data_process(self, data, asFile, partial):
-        if data == NOTHING:
+    def _data_process(self, data, asFile, partial, asView=False):
+        if data is NOTHING:
+            if self._data is None:
+                self._data = self.createRequestBody(0)
             if asFile:
                 return self._data
+            elif asView:
+                return self._data.view()
             else:
-                position = self._data.tell()
-                self._data.seek(0)
-                res = self._data.read()
-                self._data.seek(position)
-                return res
+                return self._data.getvalue()
         else:
             # We reset the parameters and files
-            self._params = {}
+            self._params = None
             self._files = []
             # We simulate a load if the data was set
             self._environ[self.CONTENT_LENGTH] = len(data)
             if self._data:
                 self._data.close()
-            self._data = tempfile.SpooledTemporaryFile(max_size=self.DATA_SPOOL_SIZE)
+            self._data = self.createRequestBody(len(data))
             self._data.write(data)
             self._bodyLoader = self.createRequestBodyLoader(self, complete=True)
             return self._bodyLoader
 
+    def streamJSON(self, chunkSize=JSON_STREAM_CHUNK_SIZE):
+        """Iterates on the elements of a top-level JSON array (or on the
+        `(key, value)` members of a top-level object) in the request body,
+        decoding them as the body is read so that bulk payloads can be
+        processed one record at a time:
+
+        >   for record in request.streamJSON():
+        >       store.add(record)
+
+        Bodies smaller than `JSON_STREAM_THRESHOLD` are loaded and decoded
+        at once. In both cases the body is not decoded into params."""
+        if self.isLoaded() or self.contentLength < self.JSON_STREAM_THRESHOLD:
+            yield from self._streamJSONLoaded()
+            return
+        loader = self._streamLoader()
+        parser = JSONStream()
+        while not loader.isComplete():
+            chunk = loader.load(min(loader.remainingBytes, chunkSize), writeData=False)
+            yield from parser.feed(chunk)
+        yield from parser.feed(b"", True)
+
+    def _streamJSONLoaded(self):
+        if not self.isLoaded():
+            self.load(decode=False)
+        data = self.data()
+        return JSONStream.Items(unjson(data)) if data else iter(())
+
+    def _streamLoader(self):
+        if not self._bodyLoader:
+            self._bodyLoader = self.createRequestBodyLoader(self)
+        # NOTE: A streamed body is never written to the request's data,
+        # so there's nothing to decode.
+        self._bodyLoader._decoded = True
+        return self._bodyLoader
+
     def body(self, body=re):
         """Gets/sets the request body (it is an alias for data)"""
         return self.data(body)
@@ -875,7 +1972,7 @@ class Request:
         body.
 
         This will basically read a chunk of data from the incoming
-        request, and write it to the `_data` spooled file. Once the
+        request, and write it to the `_data` request body. Once the
         request in completely read, the body decoder will decode
         the data
         """
@@ -891,6 +1988,8 @@ class Request:
     def _load_prepare(self):
         if not self._bodyLoader:
             self._bodyLoader = self.createRequestBodyLoader(self)
+        if self._data is None:
+            self._data = self.createRequestBody(self.contentLength)
 
     def _load_load(self, size):
         if not self._bodyLoader.isComplete():
@@ -1029,7 +2128,12 @@ class Request:
         options=None,
     ):
         if not raw:
-            value = asJSON(value, **(options or {}))
+            if metrics.ENABLED:
+                started = metrics.now()
+                value = asJSON(value, **(options or {}))
+                metrics.SERIALIZATION_TIME.observe(metrics.now() - started)
+            else:
+                value = asJSON(value, **(options or {}))
         h = [("Content-Type", contentType or "application/json")]
         if headers:
             h.extend(headers)
@@ -1062,17 +2166,13 @@ class Request:
         has_changed = True
         headers = []
         # FIXME: Not sure why this would be necessary with etag
-        if has_range or (lastModified is not None):  # or etag:
-            headers.append(("Last-Modified", cache_timestamp(lastModified)))
-            modified_since = self.header(self.HEADER_IF_MODIFIED_SINCE)
-            try:
-                modified_since = time.strptime(
-                    modified_since, "%a, %d %b %Y %H:%M:%S GMT"
-                )
-                if modified_since > lastModified:
-                    has_changed = False
-            except Exception as e:
-                pass
+        if lastModified is not None:  # or etag:
+            headers.append(("Last-Modified", HTTPDate.Format(lastModified)))
+            modified_since = HTTPDate.Parse(
+                self.header(self.HEADER_IF_MODIFIED_SINCE)
+            )
+            if modified_since is not None:
+                has_changed = HTTPDate.Seconds(lastModified) > modified_since
         # If the file has changed or if we request ranges or stream
         # then we'll load it and do the whole she bang
         data = None
@@ -1136,7 +2236,7 @@ class Request:
         elif (
             etag is True
             and etag_sig
-            and self.header(self.HEADER_IF_NONE_MATCH) == etag_sig
+            and self.etagMatches(etag_sig)
         ):
             return self.notModified(contentType=contentType)
         # and if nothing works, we'll return the response
@@ -1213,17 +2313,13 @@ class Request:
         has_changed = True
         headers = []
         if has_range or lastModified or etag:
-            last_modified = time.gmtime(os.path.getmtime(path))
-            headers.append(("Last-Modified", cache_timestamp(last_modified)))
-            modified_since = self.header(self.HEADER_IF_MODIFIED_SINCE)
-            try:
-                modified_since = time.strptime(
-                    modified_since, "%a, %d %b %Y %H:%M:%S GMT"
-                )
-                if modified_since > last_modified:
-                    has_changed = False
-            except Exception as e:
-                pass
+            last_modified = int(os.path.getmtime(path))
+            headers.append(("Last-Modified", HTTPDate.Format(last_modified)))
+            modified_since = HTTPDate.Parse(
+                self.header(self.HEADER_IF_MODIFIED_SINCE)
+            )
+            if modified_since is not None:
+                has_changed = last_modified > modified_since
         # If the file has changed or if we request ranges or stream
         # then we'll load it and do the whole she bang
         data = None
@@ -1291,7 +2387,7 @@ class Request:
         elif (
             etag is True
             and etag_sig
-            and self.header(self.HEADER_IF_NONE_MATCH) == etag_sig
+            and self.etagMatches(etag_sig)
         ):
             return self.notModified(contentType=contentType)
         # and if nothing works, we'll return the response
@@ -1313,12 +2409,18 @@ class Request:
         """Returns an Error 501"""
         return Response(content, status=status, compression=False)
 
-    def notModified(self, content="Not modified", status=304, contentType=None):
-        """Returns an OK 304"""
-        headers = None
+    def notModified(self, content="", status=304, contentType=None):
+        """Returns an OK 304, which includes the response headers set on
+        this request (like the `ETag` set by `ifChanged`)."""
+        headers = []
         if contentType:
             headers = [(self.HEADER_CONTENT_TYPE, contentType)]
-        return Response(content, status=status, headers=headers, compression=False)
+        return Response(
+            content,
+            status=status,
+            headers=self._mergeHeaders(headers) or None,
+            compression=False,
+        )
 
     def fail(self, content=None, status=412, headers=None):
         """Returns an Error 412 with the given content"""
@@ -1330,7 +2432,7 @@ class Request:
         )
 
     def cacheID(self):
-        return "%s:%s" % (self.method(), self.uri())
+        return "%s:%s" % (self.method, self.uri)
 
     def _mergeHeaders(self, headersA, headersB=NOTHING):
         """Returns headersB + headersA, where headersB is self._responseHeaders
@@ -1352,19 +2454,7 @@ class Request:
         - if there are more values, it will be `param[name] = [value,value]`
 
         """
-        if self._params is None:
-            self._params = {}
-        # We flatten the  value if it's an array with one element (as this
-        # is what is returned when parsing query strings).
-        if value and type(value) is list and len(value) == 1:
-            value = value[0]
-        if name not in self._params:
-            self._params[name] = value
-        else:
-            if type(self._params[name]) is list:
-                self._params[name].append(value)
-            else:
-                self._params[name] = [self._params[name], value]
+        self.params(load=False).add(name, value)
 
     def _addFile(self, name, value):
         """A wrapper function to add files. This is used when decoding
@@ -1455,6 +2545,18 @@ class RequestBodyLoader:
         request data and returns it."""
         # If the load is complete, we don't have anything to do
         to_read = self._load_prepare(size)
+        stream = self.request._environ["wsgi.input"]
+        if to_read and writeData and hasattr(stream, "readinto"):
+            # NOTE: We read straight into the request's body, which saves
+            # an intermediate copy of the data.
+            read_count = self.request._data.fill(stream, to_read)
+            self._load_count(read_count)
+            assert (
+                read_count == to_read
+            ), "Request was cut, read {0:d} out of {1:d} bytes".format(
+                read_count, to_read
+            )
+            return read_count
         read_data = self._load_load(to_read)
         return self._load_post(to_read, read_data, writeData)
 
@@ -1469,10 +2571,14 @@ class RequestBodyLoader:
         read_data = self.request._environ["wsgi.input"].read(to_read)
         if asyncio_iscoroutine(read_data):
             raise Exception("Synchronous request used with async server")
-        read_count = len(read_data)
-        self.contentRead += read_count
+        self._load_count(len(read_data))
         return read_data
 
+    def _load_count(self, count):
+        self.contentRead += count
+        if metrics.ENABLED:
+            metrics.BYTES_IN.inc(count)
+
     def _load_post(self, to_read, read_data, writeData):
         assert (
             len(read_data) == to_read
@@ -1550,14 +2656,10 @@ class RequestBodyLoader:
             else:
                 charset = "utf-8"
             dataFile.seek(0)
-            data = dataFile.read()
-            # NOTE: Encoding is not supported yet
-            query_params = parse_qs(data)
-            for k, v in list(query_params.items()):
-                self.request._addParam(k, v)
+            params.feed(dataFile.read(), charset)
         elif content_type.startswith("application/json"):
             dataFile.seek(0)
-            data = simplejson.load(dataFile)
+            data = unjson(dataFile.read())
             if type(data) is dict:
                 for key in data:
                     self.request._addParam(key, data[key])
@@ -1609,6 +2711,9 @@ class Response:
         self.produceEventGuard = None
         self.compression = compression
         self.isCompressed = False
+        # Maps `(name, path)` to the index and header of the cookies set
+        # with `setCookie`.
+        self._cookies = {}
 
     def cache(
         self,
@@ -1640,7 +2745,7 @@ class Response:
                     (Request.HEADER_CACHE_CONTROL, "max-age=%d, public" % (duration))
                 )
             if expires is True:
-                expires = cache_timestamp(time.gmtime(time.time() + duration))
+                expires = HTTPDate.Now(duration)
                 self.headers.append((Request.HEADER_EXPIRES, expires))
         return self
 
@@ -1677,20 +2782,24 @@ class Response:
         return self
 
     def setCookie(self, name, value, path="/"):
-        """Sets the cookie with the given name and value."""
-        # NOTE: This is the same code as a branch of Request.cookie
-        found = False
-        i = 0
-        for header in self.headers:
-            if header[0] == Request.HEADER_SET_COOKIE:
-                self.headers[i] = (header[0], f"{name}={value}; path={path}")
-                found = True
-            i += 1
-            break
-        if not found:
-            self.headers.append(
-                (Request.HEADER_SET_COOKIE, f"{name}={value}; path={path}")
-            )
+        """Sets the cookie with the given name and value, replacing any
+        cookie previously set with the same name and path."""
+        # NOTE: This is the same logic as a branch of Request.cookie, except
+        # that the name and value are not quoted. As the headers might have
+        # been changed since, we make sure the indexed one is still ours.
+        header = (Request.HEADER_SET_COOKIE, formatCookie(name, value, path, False))
+        key = (name, path)
+        headers = self.headers
+        i, previous = self._cookies.get(key, (-1, None))
+        if previous is not None and not (i < len(headers) and headers[i] is previous):
+            # The headers were rebuilt or reordered, so we look it up
+            i = next((j for j, _ in enumerate(headers) if _ is previous), -1)
+        if i >= 0:
+            headers[i] = header
+        else:
+            i = len(headers)
+            headers.append(header)
+        self._cookies[key] = (i, header)
         return self
 
     def setContentType(self, mimeType):
@@ -1780,6 +2889,193 @@ class Response:
         return "%s %s\r\n" % (self.status, self.reason or reason)
 
 
+# -----------------------------------------------------------------------------
+#
+# EVENT CHANNEL
+#
+# -----------------------------------------------------------------------------
+# SEE: https://html.spec.whatwg.org/multipage/server-sent-events.html
+
+
+class Channel:
+    """A channel broadcasts Server-Sent Events to its subscribers. Each
+    published event is encoded once into a shared frame which is then
+    appended to the bounded queue of every subscriber. Subscribers that
+    can't keep up (their queue is full) are dropped, and can catch up when
+    they reconnect as the last `history` events are replayed based on the
+    `Last-Event-ID` header (at most `queueSize` of them).
+
+    >   EVENTS = Channel()
+    >
+    >   @on(GET="/events")
+    >   def events(self, request):
+    >       return EVENTS.subscribe(request)
+    >
+    >   EVENTS.publish({"status": "ok"}, event="update")
+
+    Subscriptions stream through an asynchronous generator, and thus require
+    the `retro.aio` server. Publishing can be done from any thread."""
+
+    HISTORY = 256
+    QUEUE_SIZE = 64
+    KEEP_ALIVE = 15
+    CONTENT_TYPE = "text/event-stream"
+
+    @staticmethod
+    def Encode(data, event=None, id=None, retry=None):
+        """Encodes the given event as a Server-Sent Events frame. Data that
+        is not a string is serialized as JSON, and its line breaks are
+        normalized so that each line is a `data:` field. The event and id
+        must not contain line breaks, as they would inject fields."""
+        if not isinstance(data, (str, bytes)):
+            data = asJSON(data)
+        data = ensureString(data)
+        if "\r" in data:
+            data = data.replace("\r\n", "\n").replace("\r", "\n")
+        lines = []
+        for name, value in (("id", id), ("event", event)):
+            if value is not None and ("\n" in str(value) or "\r" in str(value)):
+                raise ValueError(
+                    "Event {0} must not contain line breaks: {1!r}".format(name, value)
+                )
+        if id is not None:
+            lines.append("id: {0}".format(id))
+        if event:
+            lines.append("event: {0}".format(event))
+        if retry:
+            lines.append("retry: {0:d}".format(retry))
+        for line in data.split("\n"):
+            lines.append("data: " + line)
+        return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+    def __init__(self, history=HISTORY, queueSize=QUEUE_SIZE, keepAlive=KEEP_ALIVE):
+        self.subscribers = set()
+        self.history = collections.deque(maxlen=history)
+        self.queueSize = queueSize
+        self.keepAlive = keepAlive
+        self.lastID = 0
+        self.dropped = 0
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def publish(self, data, event=None):
+        """Publishes the given data to all the subscribers, returning the
+        event id."""
+        # NOTE: Events published by concurrent threads get distinct ids,
+        # and are appended to the history and fanned out in that order.
+        with self._lock:
+            event_id = self.lastID + 1
+            frame = self.Encode(data, event, event_id)
+            self.lastID = event_id
+            self.history.append((event_id, frame))
+            loop = self._loop
+            if loop and not self._isInLoop(loop):
+                loop.call_soon_threadsafe(self._fanout, frame)
+            else:
+                self._fanout(frame)
+        return event_id
+
+    def _isInLoop(self, loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _fanout(self, frame):
+        for subscriber in list(self.subscribers):
+            if not subscriber.push(frame):
+                self.dropped += 1
+                subscriber.close()
+
+    def replay(self, lastID):
+        """Returns the frames published after the given event id, which
+        are still in the history."""
+        with self._lock:
+            return [frame for id, frame in self.history if id > lastID]
+
+    def subscribe(self, request, headers=None):
+        """Subscribes the given request to this channel, returning the
+        streaming response."""
+        self._loop = asyncio.get_event_loop()
+        subscriber = ChannelSubscriber(self, self.queueSize)
+        last_id = request.header("Last-Event-ID")
+        if last_id:
+            try:
+                # The replay can't exceed the queue of the subscriber
+                for frame in self.replay(int(last_id))[-self.queueSize :]:
+                    subscriber.queue.append(frame)
+            except ValueError:
+                pass
+        self.subscribers.add(subscriber)
+        h = [
+            ("Content-Type", self.CONTENT_TYPE),
+            ("Cache-Control", "no-cache"),
+            ("X-Accel-Buffering", "no"),
+        ]
+        if headers:
+            h.extend(headers)
+        return Response(subscriber.stream(), headers=h, status=200)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def __len__(self):
+        return len(self.subscribers)
+
+
+class ChannelSubscriber:
+    """A subscriber to a `Channel`, which holds the frames that haven't been
+    sent yet."""
+
+    __slots__ = ("channel", "queue", "queueSize", "waiter", "isClosed")
+
+    def __init__(self, channel, queueSize):
+        self.channel = channel
+        self.queue = collections.deque()
+        self.queueSize = queueSize
+        self.waiter = None
+        self.isClosed = False
+
+    def push(self, frame):
+        """Queues the given frame, returning `False` if the queue is
+        full."""
+        if self.isClosed or len(self.queue) >= self.queueSize:
+            return False
+        self.queue.append(frame)
+        waiter = self.waiter
+        if waiter and not waiter.done():
+            waiter.set_result(True)
+        return True
+
+    def close(self):
+        self.isClosed = True
+        waiter = self.waiter
+        if waiter and not waiter.done():
+            waiter.set_result(False)
+
+    async def stream(self):
+        """Yields the queued frames (joined when several are pending), or
+        a comment every `keepAlive` seconds to keep the connection open."""
+        queue = self.queue
+        loop = asyncio.get_event_loop()
+        try:
+            while not self.isClosed:
+                if queue:
+                    frames = b"".join(queue) if len(queue) > 1 else queue[0]
+                    queue.clear()
+                    yield frames
+                else:
+                    self.waiter = loop.create_future()
+                    try:
+                        await asyncio.wait_for(self.waiter, self.channel.keepAlive)
+                    except asyncio.TimeoutError:
+                        yield b": keep-alive\n\n"
+                    self.waiter = None
+        finally:
+            self.isClosed = True
+            self.channel.unsubscribe(self)
+
+
 CRAWLERS = {
     "plumtreewebaccessor": True,
     "suke": True,
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro - HTTP Toolkit
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# License   : Revised BSD License
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+import time
+import threading
+from bisect import bisect_left
+
+__doc__ = """
+A low-overhead metrics registry with counters, gauges and fixed-bucket
+histograms. Each metric keeps one shard per thread, so that updates never
+take a lock: a thread only ever writes to its own shard and the shards are
+merged when the metrics are read (typically by a scrape of the
+`retro.contrib.metrics.Metrics` component). The shards of a thread are
+merged into the base of their metrics once the thread ends, so that
+short-lived threads don't leak shards.
+
+>   from retro.metrics import REGISTRY
+>   hits = REGISTRY.counter("myapp_hits_total", "Number of hits")
+>   hits.inc()
+
+Retro's own instrumentation (dispatch, handler and serialization time,
+bytes in/out, active connections) can be disabled by setting `ENABLED` to
+`False`.
+"""
+
+ENABLED = True
+
+# The default buckets for latencies, in seconds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+now = time.perf_counter
+get_ident = threading.get_ident
+
+# -----------------------------------------------------------------------------
+#
+# THREAD SHARDS
+#
+# -----------------------------------------------------------------------------
+
+
+class ThreadShards:
+    """Holds the shards created by a thread, which is stored in the
+    thread's local data so that it's released when the thread ends, at
+    which point the shards are merged into the base of their metrics."""
+
+    def __init__(self):
+        self.shards = []
+
+    def __del__(self):
+        for metric, tid, shard in self.shards:
+            metric._reclaim(tid, shard)
+
+
+LOCAL = threading.local()
+
+# -----------------------------------------------------------------------------
+#
+# METRICS
+#
+# -----------------------------------------------------------------------------
+
+
+class Metric:
+    """The base class for metrics. Metrics declared with `labels` are
+    parents of children metrics, one per combination of label values,
+    which are accessed with `labels(...)`."""
+
+    TYPE = None
+
+    def __init__(self, name, help="", labels=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labels)
+        self.labelValues = ()
+        self._children = {}
+        self._shards = {}
+        self._base = self._createShard()
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the child metric for the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            assert len(values) == len(
+                self.labelNames
+            ), "Metric {0} expects labels {1}, got {2}".format(
+                self.name, self.labelNames, values
+            )
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._createChild(values)
+                    self._children[values] = child
+        return child
+
+    def _createChild(self, values):
+        child = self.__class__.__new__(self.__class__)
+        child.__dict__.update(self.__dict__)
+        child.labelValues = values
+        child._children = {}
+        child._shards = {}
+        child._base = child._createShard()
+        child._lock = threading.Lock()
+        return child
+
+    def _shard(self):
+        # NOTE: Shards are only ever created by their own thread, so
+        # there's no contention here.
+        tid = get_ident()
+        shard = self._shards.get(tid)
+        if shard is None:
+            shard = self._shards[tid] = self._createShard()
+            owner = getattr(LOCAL, "shards", None)
+            if owner is None:
+                owner = LOCAL.shards = ThreadShards()
+            owner.shards.append((self, tid, shard))
+        return shard
+
+    def _createShard(self):
+        return [0]
+
+    def _reclaim(self, tid, shard):
+        """Merges the shard of a thread that ended into the base."""
+        with self._lock:
+            # The identifier might have been reused by a new thread
+            if self._shards.get(tid) is shard:
+                del self._shards[tid]
+            for i, v in enumerate(shard):
+                self._base[i] += v
+
+    def merged(self):
+        """Returns the sum of the base and of all the shards."""
+        with self._lock:
+            res = list(self._base)
+            for shard in list(self._shards.values()):
+                for i, v in enumerate(shard):
+                    res[i] += v
+        return res
+
+    def children(self):
+        """Returns the list of metrics that hold values, which is either
+        the children or this metric if it has no labels."""
+        if self.labelNames:
+            return list(self._children.values())
+        else:
+            return [self]
+
+    def samples(self):
+        """Returns a list of `(suffix, labels, value)` samples."""
+        raise NotImplementedError
+
+    def export(self):
+        return dict(
+            name=self.name,
+            type=self.TYPE,
+            samples=[
+                (self.name + suffix, labels, value)
+                for child in self.children()
+                for suffix, labels, value in child.samples()
+            ],
+        )
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    TYPE = "counter"
+
+    def inc(self, value=1):
+        self._shard()[0] += value
+
+    @property
+    def value(self):
+        return self.merged()[0]
+
+    def samples(self):
+        return [("", dict(zip(self.labelNames, self.labelValues)), self.value)]
+
+
+class Gauge(Metric):
+    """A value that can go up and down. Gauges can also be bound to a
+    function that returns the current value with `track`."""
+
+    TYPE = "gauge"
+
+    def __init__(self, name, help="", labels=()):
+        Metric.__init__(self, name, help, labels)
+        self._function = None
+
+    def inc(self, value=1):
+        self._shard()[0] += value
+
+    def dec(self, value=1):
+        self._shard()[0] -= value
+
+    def set(self, value):
+        # NOTE: The shards are kept, as their threads are still writing to
+        # them: the base is offset so that the total is the given value.
+        # Concurrent `inc` calls are counted after the `set`.
+        with self._lock:
+            self._base[0] = value - sum(_[0] for _ in list(self._shards.values()))
+
+    def track(self, function):
+        """Uses the given function to get the gauge value on read."""
+        self._function = function
+        return self
+
+    @property
+    def value(self):
+        if self._function:
+            return self._function()
+        return self.merged()[0]
+
+    def samples(self):
+        return [("", dict(zip(self.labelNames, self.labelValues)), self.value)]
+
+
+class Histogram(Metric):
+    """A fixed-bucket histogram. Each shard is a list of bucket counts
+    followed by the sum of the observed values, and `merged()` returns
+    `[count..., +Inf count, sum]`."""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help="", labels=(), buckets=LATENCY_BUCKETS):
+        # NOTE: The buckets are needed to create the base shard
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, help, labels)
+
+    def _createShard(self):
+        # One count per bucket, one for +Inf and the sum
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        """Returns a context manager that observes the time spent within
+        its block."""
+        return Timer(self)
+
+    @property
+    def count(self):
+        return sum(self.merged()[:-1])
+
+    @property
+    def sum(self):
+        return self.merged()[-1]
+
+    def samples(self):
+        labels = dict(zip(self.labelNames, self.labelValues))
+        merged = self.merged()
+        res = []
+        total = 0
+        for i, bound in enumerate(self.buckets):
+            total += merged[i]
+            res.append(("_bucket", dict(labels, le=repr(bound)), total))
+        total += merged[-2]
+        res.append(("_bucket", dict(labels, le="+Inf"), total))
+        res.append(("_sum", labels, merged[-1]))
+        res.append(("_count", labels, total))
+        return res
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started = None
+
+    def __enter__(self):
+        self.started = now()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(now() - self.started)
+
+
+# -----------------------------------------------------------------------------
+#
+# REGISTRY
+#
+# -----------------------------------------------------------------------------
+
+
+class Registry:
+    """Holds named metrics, creating them on first access."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **options):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, help, labels, **options)
+        assert isinstance(
+            metric, cls
+        ), "Metric {0} already registered as {1}".format(name, metric.TYPE)
+        return metric
+
+    def counter(self, name, help="", labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def export(self):
+        return [_.export() for _ in list(self.metrics.values())]
+
+    def asPrometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            if metric.help:
+                lines.append("# HELP {0} {1}".format(name, metric.help))
+            lines.append("# TYPE {0} {1}".format(name, metric.TYPE))
+            for child in metric.children():
+                for suffix, labels, value in child.samples():
+                    if labels:
+                        labels = ",".join(
+                            '{0}="{1}"'.format(
+                                k,
+                                str(v)
+                                .replace("\\", "\\\\")
+                                .replace('"', '\\"')
+                                .replace("\n", "\\n"),
+                            )
+                            for k, v in labels.items()
+                        )
+                        lines.append(
+                            "{0}{1}{{{2}}} {3}".format(name, suffix, labels, value)
+                        )
+                    else:
+                        lines.append("{0}{1} {2}".format(name, suffix, value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# -----------------------------------------------------------------------------
+#
+# RETRO INSTRUMENTATION
+#
+# -----------------------------------------------------------------------------
+
+DISPATCH_TIME = REGISTRY.histogram(
+    "retro_dispatch_seconds", "Time spent matching requests to handlers"
+)
+HANDLER_TIME = REGISTRY.histogram(
+    "retro_handler_seconds", "Time spent in request handlers", labels=("route",)
+)
+SERIALIZATION_TIME = REGISTRY.histogram(
+    "retro_serialization_seconds", "Time spent serializing responses to JSON"
+)
+REQUEST_TIME = REGISTRY.histogram(
+    "retro_request_seconds", "Total request time, as seen by the server"
+)
+RESPONSES = REGISTRY.counter(
+    "retro_responses_total", "Responses sent, by status", labels=("status",)
+)
+BYTES_IN = REGISTRY.counter("retro_bytes_in_total", "Request body bytes received")
+BYTES_OUT = REGISTRY.counter("retro_bytes_out_total", "Response body bytes sent")
+CONNECTIONS = REGISTRY.gauge("retro_connections_active", "Active connections")
+
+
+def route(handler):
+    """Returns the route label for the given handler, which is the
+    qualified name of the handler's function."""
+    function = getattr(handler, "function", handler)
+    return getattr(function, "__qualname__", None) or function.__class__.__name__
+
+
+# EOF
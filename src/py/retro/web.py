@@ -6,7 +6,7 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 12-Apr-2006
-# Last mod  : 16-Sep-2021
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 import os
@@ -15,7 +15,8 @@ import sys
 import functools
 import traceback
 import datetime
-from retro.core import Request, Response, json, unjson, NOTHING, urllib_parse, ensureUnicode
+from retro.core import Request, Response, json, unjson, etag, NOTHING, urllib_parse, ensureUnicode
+from retro import metrics
 from .compat import *
 
 LOG_ENABLED = True
@@ -99,6 +100,7 @@ _RETRO_EXPOSE_COMPRESS = "_retro_expose_compress"
 _RETRO_EXPOSE_CONTENT_TYPE = "_retro_expose_content_type"
 _RETRO_WHEN = "_retro_when"
 _RETRO_IS_PREDICATE = "_retro_isPredicate"
+_RETRO_CONDITIONAL = "_retro_conditional"
 _RETRO_EXTRA = (
     _RETRO_ON,
     _RETRO_ON_PRIORITY,
@@ -109,6 +111,7 @@ _RETRO_EXTRA = (
     _RETRO_EXPOSE_CONTENT_TYPE,
     _RETRO_WHEN,
     _RETRO_IS_PREDICATE,
+    _RETRO_CONDITIONAL,
 )
 
 
@@ -213,6 +216,23 @@ def restrict(*predicates):
     return when(*predicates)
 
 
+def conditional(enabled=True):
+    """The @conditional() decorator makes the wrapped handler answer
+    conditional requests: an `ETag` is computed from the body of its
+    (string) responses, and a `304 Not Modified` is returned instead when
+    it matches the request's `If-None-Match`.
+
+    This can be enabled for the whole application with the `conditional`
+    configuration property, in which case `@conditional(False)` opts out.
+    Handlers that can tell cheaply whether their content changed should
+    use `request.ifChanged(version)` instead, as it avoids producing the
+    content altogether."""
+    def decorator(function):
+        function.__dict__[_RETRO_CONDITIONAL] = enabled
+        return function
+    return decorator
+
+
 def cache_id(value):
     """Returns a cache id for the given value"""
     try:
@@ -232,29 +252,62 @@ def cache_signature(prefix, args=[], kwargs=dict()):
 # FIXME: Cache deos not seem to work well when there is an authentication
 
 
-def cache(store, signature=None):
+def cache(store, signature=None, timeout=None):
     """The @cache(store) decorator can be used to decorate functions (including request handlers)
     cache the response into the given cache object that must have 'has', 'get'
-    and 'set' methods, and should be able to store response objects."""
+    and 'set' methods, and should be able to store response objects.
+
+    Concurrent requests that miss the same key wait for a single call
+    of the function, for at most `timeout` seconds (see
+    `retro.contrib.cache.SingleFlight`). The results of coroutine functions
+    (like `async` handlers) are awaited and then cached. Keys are tagged
+    with the function name, so that `store.invalidate(function)` removes
+    them."""
+    # NOTE: The contrib module imports this one
+    from retro.contrib.cache import SingleFlight, AsyncSingleFlight
     def decorator(f):
+        is_async = asyncio_iscoroutinefunction(f)
+        flight = (AsyncSingleFlight if is_async else SingleFlight)(timeout)
+        def key(args, kwargs):
+            return cache_signature(
+                f.__name__, args, kwargs) if signature is None else signature(f, args, kwargs)
+        def tag(k):
+            # NOTE: Keys are only tagged once set, as the call might fail
+            if getattr(store, "TAGS", False):
+                store.tag(k, f.__name__)
         # FIXME: Cache should work with both @expose and @on
         def wrapper(*args, **kwargs):
-            key = cache_signature(
-                f.__name__, args, kwargs) if signature is None else signature(f, args, kwargs)
             if store.enabled:
+                k = key(args, kwargs)
                 result = None
-                if store.has(key):
-                    result = store.get(key)
+                if store.has(k):
+                    result = store.get(k)
                 if not result:
-                    result = f(*args, **kwargs)
-                    store.set(key, result)
+                    result = flight.run(k, store, f, *args, **kwargs)
+                    tag(k)
                     return result
                 else:
                     return result
             else:
                 return f(*args, **kwargs)
-        functools.update_wrapper(wrapper, f)
-        return wrapper
+        async def async_wrapper(*args, **kwargs):
+            if store.enabled:
+                k = key(args, kwargs)
+                result = None
+                if store.has(k):
+                    result = store.get(k)
+                if not result:
+                    result = await flight.run(k, store, f, *args, **kwargs)
+                    tag(k)
+                    return result
+                else:
+                    return result
+            else:
+                return await f(*args, **kwargs)
+        res = async_wrapper if is_async else wrapper
+        functools.update_wrapper(res, f)
+        res.flight = flight
+        return res
     return decorator
 
 # ------------------------------------------------------------------------------
@@ -322,6 +375,10 @@ class Dispatcher:
         'lang': (r"((\w\w)/)?", lambda x: x[:-1]),
     }
 
+    # The headers that are kept in a 304 response, SEE: RFC 7232 4.1
+    NOT_MODIFIED_HEADERS = ("Cache-Control", "Content-Location",
+                            "Date", "ETag", "Expires", "Vary", "Set-Cookie")
+
     @staticmethod
     def EnableLog(value=True):
         global LOG_DISPATCHER_ON
@@ -337,6 +394,8 @@ class Dispatcher:
         self.patterns = {}
         self._routesInfo = []
         self._onException = []
+        # An optional `retro.contrib.cache.ResponseCache`
+        self.responseCache = None
         for key, value in list(self.PATTERNS.items()):
             self.patterns[key] = value
 
@@ -548,7 +607,12 @@ class Dispatcher:
         # We try the handlers (the fallback handler is contained within the
         # list)
         if handlers is NOTHING:
-            handlers = self.match(environ)
+            if metrics.ENABLED:
+                started = metrics.now()
+                handlers = self.match(environ)
+                metrics.DISPATCH_TIME.observe(metrics.now() - started)
+            else:
+                handlers = self.match(environ)
         if request == None:
             assert environ, "Dispatcher.dispatch: request or environ is required"
             request = self.createRequest(environ, self.app.config("charset"))
@@ -604,7 +668,20 @@ class Dispatcher:
         request.environ("retro.variables",      variables)
         # TODO: ADD PROPER ERROR HANDLER
         # The app is expected to produce a response object
-        response = handler(request, **variables)
+        if metrics.ENABLED:
+            started = metrics.now()
+            response = handler(request, **variables)
+            if asyncio_iscoroutine(response):
+                response = self._timeCoroutine(response, handler, started)
+            else:
+                metrics.HANDLER_TIME.labels(metrics.route(handler)).observe(
+                    metrics.now() - started)
+        else:
+            response = handler(request, **variables)
+        if self.responseCache or self._isConditional(handler):
+            if asyncio_iscoroutine(response):
+                return self._postProcessCoroutine(request, handler, response)
+            response = self._postProcess(request, handler, response)
         if asyncio_iscoroutine(response):
             return response
         # try:
@@ -627,9 +704,68 @@ class Dispatcher:
             raise WebRuntimeError("Handler {0} for {1} should return a Response object, got {2}".format(
                 handler, request.path(), response))
 
+    async def _timeCoroutine(self, response, handler, started):
+        """Awaits the response of an asynchronous handler, observing the
+        handler time once it completes."""
+        try:
+            return await response
+        finally:
+            metrics.HANDLER_TIME.labels(metrics.route(handler)).observe(
+                metrics.now() - started)
+
+    def _isConditional(self, handler):
+        """Tells if the responses of the given handler should be made
+        conditional, as set by `@conditional` or the application's
+        `conditional` configuration property."""
+        enabled = getattr(handler, _RETRO_CONDITIONAL, None)
+        return self.app.config("conditional") if enabled is None else enabled
+
+    def _conditional(self, request, response):
+        """Sets the ETag of the given response, computed from its body if
+        it has none yet, and returns a 304 response instead if the
+        client's copy is the same."""
+        if not isinstance(response, Response) or response.status != 200 \
+                or request.method not in ("GET", "HEAD"):
+            return response
+        tag = None
+        for name, value in response.headers:
+            if name == Request.HEADER_ETAG:
+                tag = value
+        if not tag:
+            content = response.content
+            if isinstance(content, str):
+                # NOTE: We encode once here, so that `asWSGI` doesn't have to
+                content = response.content = content.encode("utf8")
+            elif not isinstance(content, bytes):
+                # Streamed responses are left as-is
+                return response
+            tag = etag(content)
+            response.headers.append((Request.HEADER_ETAG, tag))
+        if request.etagMatches(tag):
+            return Response(b"", [_ for _ in response.headers if _[0] in self.NOT_MODIFIED_HEADERS], 304)
+        else:
+            return response
+
+    def _postProcess(self, request, handler, response):
+        """Makes the response conditional if the handler asks for it, and
+        stores it in the response cache (if any)."""
+        if self._isConditional(handler):
+            response = self._conditional(request, response)
+        if self.responseCache:
+            response = self.responseCache.save(request, response)
+        return response
+
+    async def _postProcessCoroutine(self, request, handler, response):
+        return self._postProcess(request, handler, await response)
+
     def __call__(self, environ, start_response, request=None):
         """Delegate request to the appropriate Application. This is the main
         method of the dispatcher, which is WSGI-compatible."""
+        # Cached responses are served before matching the handlers
+        if self.responseCache:
+            cached = self.responseCache.lookup(environ, start_response)
+            if cached is not None:
+                return cached
         def processor(r, h, v): return self._processWSGI(
             r, h, v, start_response)
         return self.dispatch(environ, processor=processor, request=request)
@@ -818,6 +954,7 @@ class Application(Component):
             defaults = function.__defaults__
             code = function.__code__
             self.functionArgs = list(code.co_varnames[:code.co_argcount])
+            setattr(self, _RETRO_CONDITIONAL, getattr(function, _RETRO_CONDITIONAL, None))
 
         def __call__(self, request, **kwargs):
             # We try to invoke the function with the optional arguments
@@ -1081,6 +1218,7 @@ class Configuration:
     - `charset`   is the default charset for handling request/response data
     - `root`      is the location of the server root (default '.')
     - `session`   is the name of the session adapter (for now, 'FLUP' or 'BEAKER')
+    - `conditional` enables ETags and 304 responses for all handlers (see `@conditional`)
 
     It should be noted that unless absolute, paths are all relative to the
     configured application root, which is set by default to the current working
@@ -1092,6 +1230,7 @@ class Configuration:
             "charset": "UTF-8",
             "prefix": None,
             "port": None,
+            "conditional": False,
         }
         self._logfile = None
         if defaults:
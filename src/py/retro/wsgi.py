@@ -10,7 +10,7 @@
 # License   : Revised BSD License
 # -----------------------------------------------------------------------------
 # Creation  : 15-Apr-2006
-# Last mod  : 22-Jul-2015
+# Last mod  : 19-Oct-2026
 # -----------------------------------------------------------------------------
 
 # FIXME: Reactor is broken (and probably unnecessary)
@@ -50,7 +50,7 @@ except ImportError:
     import logging
     reporter = None
 
-from . import core, web
+from . import core, web, accesslog, metrics
 
 # Jython has no signal module
 try:
@@ -401,20 +401,29 @@ Use request methods to create a response(request.respond, request.returns, ...)
     ERROR = "Error"
 
     def log_request(self, code="-", size=""):
-        if hasattr(self, "_startTime"):
-            line = "{0:60s} [{1}] {2:0.3f}s".format(
-                self.requestline, code, (time.time() - self._startTime))
+        # NOTE: This is called by `send_response`, before the body is
+        # written: the requests processed by `run` are logged when they
+        # end, with the number of bytes that were actually written.
+        status = code if isinstance(code, int) else 0
+        if getattr(self, "_isLogPending", False):
+            self._status = status
         else:
-            line = "{0:60s} [{1}]".format(self.requestline, code)
-        if code >= 400:
-            logging.error(line)
-        elif code >= 300 and code < 400:
-            if reporter:
-                logging.info(line, code=code, color=reporter.COLOR_DARK_GRAY)
-            else:
-                logging.info(line)
-        else:
-            logging.info(line)
+            self._logAccess(status, size if isinstance(size, int) else 0)
+
+    def _logAccess(self, status, size):
+        # NOTE: The record is written by the access log's writer thread.
+        elapsed = (time.time() - self._startTime) if hasattr(self, "_startTime") else 0.0
+        if metrics.ENABLED:
+            metrics.REQUEST_TIME.observe(elapsed)
+            metrics.RESPONSES.labels(status).inc()
+        accesslog.log(
+            self.command,
+            self.path,
+            status,
+            size,
+            elapsed,
+            self.client_address[0],
+        )
 
     def log_error(self, format, *args):
         logging.error("{0} - - [{1}] {2}".format(
@@ -464,6 +473,12 @@ Use request methods to create a response(request.respond, request.returns, ...)
         parameter is True(this is the case by default)."""
         self._state = self.STARTED
         self._rendezvous = None
+        self._isLogPending = True
+        self._status = 0
+        self._bytesWritten = 0
+        self._isCounted = metrics.ENABLED
+        if self._isCounted:
+            metrics.CONNECTIONS.inc()
         # When using the reactor, we simply submit the application for
         # execution(we delegate the execution to the reactor)
         if usesReactor():
@@ -589,6 +604,9 @@ Use request methods to create a response(request.respond, request.returns, ...)
 
     def _processEnd(self):
         # TODO: Should close the request
+        if getattr(self, "_isCounted", False):
+            self._isCounted = False
+            metrics.CONNECTIONS.dec()
         self._state = self.ENDED
         if(not self._sentHeaders):
             # If we have an exception here in the socket, we can safely ignore
@@ -598,6 +616,9 @@ Use request methods to create a response(request.respond, request.returns, ...)
                 self._writeData(core.ensureBytes(" "))
             except:
                 pass
+        if self._isLogPending:
+            self._isLogPending = False
+            self._logAccess(self._status, self._bytesWritten)
         self._finish()
         return self._state
 
@@ -642,6 +663,9 @@ Use request methods to create a response(request.respond, request.returns, ...)
                 if not isinstance(data, bytes):
                     data = bytes(data, encoding="utf8")
             self.wfile.write(data)
+            self._bytesWritten += len(data)
+            if metrics.ENABLED:
+                metrics.BYTES_OUT.inc(len(data))
         except socket.error as socketErr:
             logging.debug("Cannot send data: (%s) %s" %
                           (str(socketErr.args[0]), socketErr.args[1]))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the access log pipeline (`retro.accesslog`): formatting, sampling,
+# dropping, a single writer thread under concurrent requests, the flush at
+# exit and the bytes logged by the threaded WSGI server:
+#
+# >   python access_log.py
+
+import io
+import os
+import sys
+import json
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from retro import *
+import retro.wsgi
+import retro.accesslog
+from retro.accesslog import AccessLog, StreamSink, FileSink, formatJSON
+
+PORT = 8208
+
+
+class Main(Component):
+    @on(GET="/hello")
+    def hello(self, request):
+        return request.respond("Hello, World!")
+
+
+def writers():
+    return [_ for _ in threading.enumerate() if _.name == "retro-accesslog"]
+
+
+def testPipeline():
+    stream = io.StringIO()
+    log = AccessLog([StreamSink(stream, formatJSON)], sample=0.0, limit=3, interval=60)
+    # Successful requests are sampled, errors are always logged
+    assert not log.log("GET", "/", 200, 10, 0.001, "127.0.0.1")
+    assert log.log("GET", "/missing", 404, 0, 0.001, "127.0.0.1")
+    log.log("GET", "/error", 500)
+    log.log("GET", "/error", 500)
+    # Records are dropped once the queue is full
+    assert not log.log("GET", "/error", 500) and log.dropped == 1
+    log.stop()
+    records = [json.loads(_) for _ in stream.getvalue().splitlines()]
+    assert [_["status"] for _ in records] == [404, 500, 500], records
+    assert records[0]["uri"] == "/missing" and records[0]["peer"] == "127.0.0.1"
+    print("OK  formatting, sampling, dropping")
+
+
+def testConcurrentStart():
+    before = len(writers())
+    log = AccessLog([StreamSink(io.StringIO())], interval=60)
+    barrier = threading.Barrier(16)
+
+    def request():
+        barrier.wait()
+        log.log("GET", "/", 200)
+
+    threads = [threading.Thread(target=request) for _ in range(16)]
+    for _ in threads:
+        _.start()
+    for _ in threads:
+        _.join()
+    assert len(writers()) == before + 1, writers()
+    log.stop()
+    assert len(writers()) == before and not log.queue
+    print("OK  a single writer thread")
+
+
+def testExit(directory):
+    # The pending records are written when the interpreter exits
+    path = os.path.join(directory, "access.log")
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-c",
+            "import retro.accesslog as a;"
+            "a.configure(format='clf', path={0!r}).interval = 60;"
+            "a.log('GET', '/exit', 200, 5)".format(path),
+        ],
+        env=dict(os.environ),
+    )
+    with open(path) as f:
+        assert '"GET /exit HTTP/1.1" 200 5' in f.read()
+    print("OK  flushed at exit")
+
+
+def testRestart(directory):
+    # Logging once stopped restarts the writer, which reopens the file
+    path = os.path.join(directory, "restart.log")
+    log = AccessLog([FileSink(path)], interval=60)
+    log.log("GET", "/first", 200, 1)
+    log.stop()
+    log.log("GET", "/second", 200, 2)
+    log.stop()
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2 and "/second" in lines[1], lines
+    print("OK  restarted after stop")
+
+
+def testWSGI():
+    stream = io.StringIO()
+    retro.accesslog.configure(format="json", stream=stream)
+    server = retro.wsgi.WSGIServer(
+        ("127.0.0.1", PORT), Application(components=[Main()])
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with urllib.request.urlopen(
+            "http://127.0.0.1:{0}/hello".format(PORT)
+        ) as response:
+            body = response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+    retro.accesslog.get().flush()
+    records = [json.loads(_) for _ in stream.getvalue().splitlines()]
+    assert len(records) == 1, records
+    assert records[0]["status"] == 200 and records[0]["bytes"] == len(body), records
+    print("OK  wsgi: logs the bytes written")
+
+
+if __name__ == "__main__":
+    testPipeline()
+    testConcurrentStart()
+    with tempfile.TemporaryDirectory() as directory:
+        testExit(directory)
+        testRestart(directory)
+    testWSGI()
+
+# EOF
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the admission control and read timeouts of `retro.aio.Server`:
+# requests over capacity get a 503, slow headers and bodies a 408, and the
+# occupancy of the server returns to zero afterwards:
+#
+# >   python aio_admission.py
+
+import asyncio
+from retro import *
+import retro.aio
+
+PORT = 8207
+
+
+class Main(Component):
+    def __init__(self):
+        Component.__init__(self)
+        self.release = None
+
+    @on(GET="/slow")
+    async def slow(self, request):
+        await self.release.wait()
+        return request.respond("slow")
+
+    @on(GET="/fast")
+    def fast(self, request):
+        return request.respond("fast")
+
+    @on(POST="/upload")
+    async def upload(self, request):
+        data = await request.data()
+        return request.respond(str(len(data)))
+
+
+async def send(data, wait=None):
+    """Sends the given data, waiting for `wait` seconds before reading the
+    response, and returns the status and the raw response."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(data)
+    if wait:
+        await asyncio.sleep(wait)
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1]) if response else None
+    return status, response
+
+
+def get(path):
+    return send("GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(path).encode())
+
+
+async def test():
+    main = Main()
+    main.release = asyncio.Event()
+    server = retro.aio.Server(
+        Application(components=[main]),
+        "127.0.0.1",
+        PORT,
+        maxRequests=1,
+        maxBodyBytes=1000,
+        headerTimeout=0.2,
+        bodyTimeout=0.2,
+    )
+    listener = await asyncio.start_server(server.request, "127.0.0.1", PORT)
+    try:
+        # A request over capacity gets a 503, once the slot is taken
+        slow = asyncio.ensure_future(get("/slow"))
+        while server.requests < 1:
+            await asyncio.sleep(0.01)
+        status, response = await get("/fast")
+        assert status == 503 and b"Retry-After: 1" in response, response
+        main.release.set()
+        status, response = await slow
+        assert status == 200 and response.endswith(b"slow"), response
+        assert (await get("/fast"))[0] == 200
+        # ...and so does a body over the byte limit
+        status, _ = await send(
+            b"POST /upload HTTP/1.1\r\nContent-Length: 2000\r\n\r\n" + b"x" * 2000
+        )
+        assert status == 503
+        # Slow headers get a 408
+        status, _ = await send(b"GET /fast HTTP/1.1\r\nHost: local")
+        assert status == 408, status
+        # ...and so do slow bodies
+        status, _ = await send(
+            b"POST /upload HTTP/1.1\r\nContent-Length: 100\r\n\r\n" + b"x" * 10
+        )
+        assert status == 408, status
+        status, response = await send(
+            b"POST /upload HTTP/1.1\r\nContent-Length: 100\r\n\r\n" + b"x" * 100
+        )
+        assert status == 200 and response.endswith(b"100"), response
+        # The occupancy returns to zero after errors, once the connections
+        # are closed on the server side as well.
+        await asyncio.sleep(0.05)
+        occupancy = server.occupancy()
+        assert occupancy["connections"] == 0, occupancy
+        assert occupancy["requests"] == 0 and occupancy["bodyBytes"] == 0, occupancy
+        assert occupancy["rejected"] == 2 and occupancy["timeouts"] == 2, occupancy
+    finally:
+        listener.close()
+        await listener.wait_closed()
+    print("OK  503 over capacity, 408 on slow headers and bodies, occupancy")
+
+
+if __name__ == "__main__":
+    asyncio.run(test())
+
+# EOF
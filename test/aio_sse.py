@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests Server-Sent Events channels with the `retro.aio` server (replay
+# with `Last-Event-ID`, dropping of slow consumers), and benchmarks the
+# publishing of events to many subscribers:
+#
+# >   python aio_sse.py [SUBSCRIBERS]
+
+import sys
+import time
+import asyncio
+import threading
+from retro import *
+import retro.aio
+from retro.core import ChannelSubscriber
+
+PORT = 8201
+EVENTS = Channel(history=16)
+
+
+class Events(Component):
+    @on(GET="/events")
+    def events(self, request):
+        return EVENTS.subscribe(request)
+
+
+async def readEvents(reader, count):
+    events = []
+    while len(events) < count:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b"data: "):
+            events.append(line[6:].strip().decode("utf8"))
+    return events
+
+
+async def connect(lastID=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    headers = "GET /events HTTP/1.1\r\nHost: localhost\r\n"
+    if lastID is not None:
+        headers += "Last-Event-ID: {0}\r\n".format(lastID)
+    writer.write((headers + "\r\n").encode("ascii"))
+    status = await reader.readline()
+    assert b"200" in status, status
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    return reader, writer
+
+
+async def testServer():
+    reader, writer = await connect()
+    while not EVENTS.subscribers:
+        await asyncio.sleep(0.01)
+    for i in range(3):
+        EVENTS.publish("event {0}".format(i), event="test")
+    events = await readEvents(reader, 3)
+    assert events == ["event 0", "event 1", "event 2"], events
+    writer.close()
+    # A reconnecting client gets the events it missed
+    reader, writer = await connect(lastID=1)
+    events = await readEvents(reader, 2)
+    assert events == ["event 1", "event 2"], events
+    writer.close()
+    # The replay is capped to the queue size, keeping the latest events
+    EVENTS.queueSize = 2
+    try:
+        reader, writer = await connect(lastID=0)
+        events = await readEvents(reader, 2)
+        assert events == ["event 1", "event 2"], events
+        writer.close()
+    finally:
+        EVENTS.queueSize = Channel.QUEUE_SIZE
+    print("OK  server: delivery and Last-Event-ID replay")
+
+
+def testFrames():
+    # Line breaks in the data can't inject fields
+    frame = Channel.Encode("a\r\nb\rc\nd", event="test", id=1)
+    assert frame == b"id: 1\nevent: test\ndata: a\ndata: b\ndata: c\ndata: d\n\n", frame
+    for event, id in (("test\ndata: injected", 1), ("test", "1\rretry: 1")):
+        try:
+            Channel.Encode("data", event=event, id=id)
+            assert False, "Line breaks are rejected"
+        except ValueError:
+            pass
+    # Concurrent publishers get distinct ids, in the order of the history
+    channel = Channel(history=8000)
+    threads = [
+        threading.Thread(target=lambda: [channel.publish(i) for i in range(1000)])
+        for _ in range(8)
+    ]
+    for _ in threads:
+        _.start()
+    for _ in threads:
+        _.join()
+    assert channel.lastID == 8000
+    assert [_[0] for _ in channel.history] == list(range(1, 8001))
+    print("OK  frames, concurrent publishing")
+
+
+def testSlowConsumer():
+    channel = Channel(queueSize=4)
+    slow = ChannelSubscriber(channel, channel.queueSize)
+    channel.subscribers.add(slow)
+    for i in range(5):
+        channel.publish(i)
+    assert slow.isClosed and channel.dropped == 1
+    print("OK  slow consumers are dropped")
+
+
+async def benchmark(count, events=100):
+    channel = Channel(queueSize=events + 1)
+    received = [0]
+
+    async def consume(subscriber):
+        async for frames in subscriber.stream():
+            received[0] += frames.count(b"\n\n")
+
+    subscribers = [ChannelSubscriber(channel, channel.queueSize) for _ in range(count)]
+    channel.subscribers.update(subscribers)
+    tasks = [asyncio.ensure_future(consume(_)) for _ in subscribers]
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    for i in range(events):
+        channel.publish({"index": i, "payload": "x" * 64}, event="tick")
+    published = time.perf_counter() - started
+    while received[0] < count * events:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    for _ in subscribers:
+        _.close()
+    await asyncio.gather(*tasks)
+    print(
+        "{0} events to {1} subscribers: publish {2:.1f}µs/event ({3:.2f}µs/subscriber), delivered in {4:.3f}s ({5:,.0f} frames/s)".format(
+            events,
+            count,
+            published * 1e6 / events,
+            published * 1e6 / events / count,
+            elapsed,
+            count * events / elapsed,
+        )
+    )
+
+
+async def main(count):
+    app = Application(components=[Events()])
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+    try:
+        await testServer()
+    finally:
+        for _ in list(EVENTS.subscribers):
+            _.close()
+        await asyncio.sleep(0.1)
+        server.close()
+    testSlowConsumer()
+    testFrames()
+    await benchmark(count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
+
+# EOF
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the streaming of request bodies with `retro.aio` (`request.stream()`
+# and `request.readinto()`), making sure that large bodies are processed
+# in constant memory:
+#
+# >   python aio_stream_body.py [MEGABYTES]
+
+import sys
+import time
+import asyncio
+import hashlib
+import tracemalloc
+from retro import *
+import retro.aio
+
+PORT = 8202
+CHUNK = bytes(range(256)) * 256
+
+
+class Main(Component):
+    @on(POST="/stream")
+    async def stream(self, request):
+        digest = hashlib.sha256()
+        async for chunk in request.stream():
+            digest.update(chunk)
+        return request.respond(digest.hexdigest())
+
+    @on(POST="/readinto")
+    async def readinto(self, request):
+        digest = hashlib.sha256()
+        buffer = bytearray(32 * 1024)
+        view = memoryview(buffer)
+        while n := await request.readinto(buffer):
+            digest.update(view[:n])
+        return request.respond(digest.hexdigest())
+
+    @on(POST="/load")
+    async def load(self, request):
+        data = await request.data()
+        return request.respond(hashlib.sha256(data).hexdigest())
+
+
+async def post(path, size):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(
+        "POST {0} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {1}\r\n\r\n".format(
+            path, size
+        ).encode("ascii")
+    )
+    sent = 0
+    while sent < size:
+        chunk = CHUNK[: size - sent]
+        writer.write(chunk)
+        sent += len(chunk)
+        await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.rsplit(b"\r\n", 1)[-1].decode("ascii")
+
+
+async def main(megabytes):
+    size = megabytes * 1024 * 1024
+    expected = hashlib.sha256()
+    for i in range(0, size, len(CHUNK)):
+        expected.update(CHUNK[: size - i])
+    expected = expected.hexdigest()
+    app = Application(components=[Main()])
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+    try:
+        for path in ("/stream", "/readinto", "/load"):
+            tracemalloc.start()
+            started = time.perf_counter()
+            digest = await post(path, size)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert digest == expected, (path, digest)
+            print(
+                "OK  {0:10s} {1}MB in {2:.2f}s ({3:.0f}MB/s), peak Python heap {4:.1f}MB".format(
+                    path, megabytes, elapsed, megabytes / elapsed, peak / 1024 / 1024
+                )
+            )
+            if path != "/load":
+                assert peak < 4 * 1024 * 1024, "Streaming should use constant memory"
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 64))
+
+# EOF
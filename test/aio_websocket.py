@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the WebSocket support of `retro.aio` with a minimal client, and
+# measures the memory used per idle connection:
+#
+# >   python aio_websocket.py [CONNECTIONS]
+
+import os
+import sys
+import zlib
+import base64
+import struct
+import asyncio
+import resource
+import tracemalloc
+from retro import *
+import retro.aio
+from retro.aio import WebSocket
+
+PORT = 8200
+
+
+class Main(Component):
+
+    @on(WS="/echo")
+    async def echo(self, request, ws):
+        async for message in ws:
+            await ws.send(message)
+
+    @on(WS="/idle")
+    async def idle(self, request, ws):
+        await ws.receive()
+
+
+# -----------------------------------------------------------------------------
+#
+# CLIENT
+#
+# -----------------------------------------------------------------------------
+
+
+class Client:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def Connect(cls, path, deflate=False):
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+        key = base64.b64encode(os.urandom(16))
+        writer.write(
+            b"GET " + path.encode() + b" HTTP/1.1\r\n"
+            b"Host: localhost\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Key: " + key + b"\r\n"
+            b"Sec-WebSocket-Version: 13\r\n"
+            + (b"Sec-WebSocket-Extensions: permessage-deflate\r\n" if deflate else b"")
+            + b"\r\n"
+        )
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 101"), head
+        return cls(reader, writer)
+
+    def frame(self, opcode, payload, fin=True, rsv1=False, rsv=0):
+        mask = os.urandom(4)
+        n = len(payload)
+        b0 = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | rsv | opcode
+        if n < 126:
+            head = struct.pack("!BB", b0, 0x80 | n)
+        elif n < 65536:
+            head = struct.pack("!BBH", b0, 0x80 | 126, n)
+        else:
+            head = struct.pack("!BBQ", b0, 0x80 | 127, n)
+        self.writer.write(head + mask + WebSocket.unmask(payload, mask))
+
+    async def read(self):
+        b0, b1 = await self.reader.readexactly(2)
+        n = b1 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        payload = await self.reader.readexactly(n)
+        if b0 & 0x40:
+            payload = zlib.decompressobj(-15).decompress(payload + b"\x00\x00\xff\xff")
+        return b0 & 0x0F, payload
+
+
+# -----------------------------------------------------------------------------
+#
+# TESTS
+#
+# -----------------------------------------------------------------------------
+
+
+async def test_echo():
+    c = await Client.Connect("/echo")
+    c.frame(0x1, "Hello, World!".encode())
+    assert await c.read() == (0x1, b"Hello, World!")
+    # A large binary message, fragmented, with a ping in between
+    data = os.urandom(200000)
+    c.frame(0x2, data[:100000], fin=False)
+    c.frame(0x9, b"ping")
+    c.frame(0x0, data[100000:])
+    assert await c.read() == (0xA, b"ping")
+    assert await c.read() == (0x2, data)
+    c.frame(0x8, struct.pack("!H", 1000))
+    assert (await c.read())[0] == 0x8
+    c.writer.close()
+
+
+async def test_deflate():
+    c = await Client.Connect("/echo", deflate=True)
+    text = "retro " * 1000
+    z = zlib.compressobj(9, zlib.DEFLATED, -15)
+    payload = (z.compress(text.encode()) + z.flush(zlib.Z_SYNC_FLUSH))[:-4]
+    c.frame(0x1, payload, rsv1=True)
+    assert await c.read() == (0x1, text.encode())
+    c.writer.close()
+
+
+async def test_version():
+    # An unsupported version is refused with the one we support
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(
+        b"GET /echo HTTP/1.1\r\n"
+        b"Host: localhost\r\n"
+        b"Upgrade: websocket\r\n"
+        b"Connection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: " + base64.b64encode(os.urandom(16)) + b"\r\n"
+        b"Sec-WebSocket-Version: 8\r\n"
+        b"\r\n"
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 426"), head
+    assert b"\r\nSec-WebSocket-Version: 13\r\n" in head, head
+    writer.close()
+
+
+async def test_protocol_errors():
+    # Each of these frames is closed with a protocol error
+    for frame in (
+        dict(opcode=0x1, payload=b"rsv1", rsv1=True),
+        dict(opcode=0x1, payload=b"rsv2", rsv=0x20),
+        dict(opcode=0x1, payload=b"rsv3", rsv=0x10),
+        dict(opcode=0x9, payload=b"ping", fin=False),
+        dict(opcode=0x9, payload=b"x" * 126),
+        dict(opcode=0x3, payload=b"reserved opcode"),
+    ):
+        c = await Client.Connect("/echo")
+        c.frame(**frame)
+        opcode, payload = await c.read()
+        assert opcode == 0x8, (frame, opcode)
+        assert struct.unpack("!H", payload[:2])[0] == 1002, (frame, payload)
+        c.writer.close()
+    # ...but RSV1 is fine on a negotiated permessage-deflate connection,
+    # and a 125-byte ping is the largest allowed.
+    c = await Client.Connect("/echo", deflate=True)
+    c.frame(0x9, b"x" * 125)
+    assert await c.read() == (0xA, b"x" * 125)
+    c.writer.close()
+
+
+async def test_memory(count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    clients = []
+    for i in range(count):
+        clients.append(await Client.Connect("/idle"))
+    await asyncio.sleep(0.5)
+    after = tracemalloc.take_snapshot()
+    size = sum(_.size_diff for _ in after.compare_to(before, "filename"))
+    # NOTE: The clients live in the same process, so this is the cost of
+    # both ends of the connection.
+    print(
+        "{0} idle connections: {1:.1f}KB/connection (Python heap, client+server), max RSS +{2}MB".format(
+            count,
+            size / count / 1024,
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) // 1024,
+        )
+    )
+    tracemalloc.stop()
+    for c in clients:
+        c.writer.close()
+    await asyncio.sleep(0.5)
+
+
+async def main(count):
+    app = Application(components=[Main()])
+    app.start()
+    server = retro.aio.Server(app, "127.0.0.1", PORT, maxConnections=count + 10)
+    s = await asyncio.start_server(server.request, "127.0.0.1", PORT, backlog=1024)
+    await test_echo()
+    await test_deflate()
+    await test_version()
+    await test_protocol_errors()
+    print("OK")
+    await test_memory(count)
+    s.close()
+
+
+if __name__ == "__main__":
+    resource.setrlimit(resource.RLIMIT_NOFILE, resource.getrlimit(resource.RLIMIT_NOFILE)[1:] * 2)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
+
+# EOF
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the caching decorators (`cached`, `Cache.wrap`, `Cache.memoized` and
+# `retro.web.cache`) with coroutine functions and async handlers served by
+# `retro.aio`, and benchmarks concurrent requests to a slow async handler:
+#
+# >   python cache_async.py [REQUESTS]
+
+import sys
+import time
+import asyncio
+from retro import *
+from retro.web import cache
+from retro.contrib.cache import MemoryCache, cached
+import retro.aio
+
+PORT = 8206
+
+
+async def testDecorators():
+    store = MemoryCache()
+    calls = []
+
+    @cached(store)
+    async def square(n):
+        calls.append(n)
+        await asyncio.sleep(0.01)
+        return n * n
+
+    @store.wrap(lambda n: "cube:{0}".format(n))
+    async def cube(n):
+        calls.append(n)
+        await asyncio.sleep(0.01)
+        return n * n * n
+
+    @store.memoized
+    async def config():
+        calls.append("config")
+        await asyncio.sleep(0.01)
+        return {"debug": False}
+
+    @cache(store)
+    async def double(n):
+        calls.append(n)
+        await asyncio.sleep(0.01)
+        return n * 2
+
+    for function, expected in (
+        (square, 9),
+        (cube, 27),
+        (lambda _: config(), {"debug": False}),
+        (double, 6),
+    ):
+        calls.clear()
+        # Concurrent calls await a single call, and the awaited value is
+        # cached (not the coroutine).
+        assert await asyncio.gather(*[function(3) for _ in range(10)]) == [
+            expected
+        ] * 10
+        assert await function(3) == expected and len(calls) == 1, calls
+    assert store.get("cube:3") == 27 and store.get("config") == {"debug": False}
+    assert asyncio.iscoroutinefunction(cube) and asyncio.iscoroutinefunction(double)
+    # Synchronous functions are unchanged
+    calls.clear()
+
+    @store.wrap(lambda n: "sync:{0}".format(n))
+    def sync(n):
+        calls.append(n)
+        return n
+
+    assert sync(1) == 1 and sync(1) == 1 and calls == [1]
+    print("OK  cached, Cache.wrap, Cache.memoized, web.cache: coroutines")
+
+
+class Site(Component):
+    def __init__(self):
+        Component.__init__(self)
+        self.calls = 0
+
+    @on(GET="/cached/{n:int}")
+    @cached(MemoryCache())
+    async def cachedPage(self, request, n):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return request.respond("Cached {0}".format(n))
+
+    @on(GET="/web/{n:int}")
+    @cache(MemoryCache(), signature=lambda f, args, kwargs: kwargs["n"])
+    async def webPage(self, request, n):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return request.respond("Web {0}".format(n))
+
+    @on(GET="/slow/{n:int}")
+    async def slowPage(self, request, n):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return request.respond("Slow {0}".format(n))
+
+
+async def get(path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write("GET {0} HTTP/1.1\r\n\r\n".format(path).encode("ascii"))
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split(b" ", 2)[1]), body
+
+
+async def testServer(requests):
+    site = Site()
+    app = Application(components=[site])
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+    try:
+        # Handlers returning a `Response` are cached
+        for path, body in (("/web/1", b"Web 1"), ("/cached/1", b"Cached 1")):
+            site.calls = 0
+            responses = await asyncio.gather(*[get(path) for _ in range(10)])
+            assert responses == [(200, body)] * 10, responses
+            assert await get(path) == (200, body) and site.calls == 1
+        print("OK  aio: cached async handlers returning responses")
+        # Benchmark
+        print("{0:,d} concurrent requests on 10 paths:".format(requests))
+        for prefix in ("/slow/", "/web/", "/cached/"):
+            site.calls = 0
+            started = time.perf_counter()
+            responses = await asyncio.gather(
+                *[get(prefix + str(_ % 10 + 2)) for _ in range(requests)]
+            )
+            elapsed = time.perf_counter() - started
+            assert all(_[0] == 200 for _ in responses)
+            calls = site.calls
+            started = time.perf_counter()
+            for _ in range(50):
+                await get(prefix + str(_ % 10 + 2))
+            latency = (time.perf_counter() - started) / 50
+            print(
+                "  {0:10s} {1:8.1f}ms {2:6,d} handler calls, then {3:6.2f}ms "
+                "per sequential request".format(
+                    prefix, elapsed * 1e3, calls, latency * 1e3
+                )
+            )
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(testDecorators())
+    asyncio.run(testServer(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
+
+# EOF
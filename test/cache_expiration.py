@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the expiration of the in-memory caches (`ExpirationIndex`), with a
+# background thread and an asyncio task, and shows that memory stays bounded
+# while millions of short-lived keys are set:
+#
+# >   python cache_expiration.py [KEYS]
+
+import os
+import sys
+import time
+import asyncio
+import collections
+from retro.contrib.cache import ExpirationIndex, LRUCache, MemoryCache, TimeoutCache
+
+
+def rss():
+    """Returns the resident memory of the process, in MB."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def testIndex():
+    index = ExpirationIndex()
+    for i in range(10):
+        index.schedule(i, 100 + i)
+    index.schedule(0, 200)
+    index.cancel(1)
+    assert index.next() == 102 and len(index) == 9
+    assert index.due(104) == [2, 3, 4]
+    assert index.due(1000, limit=2) == [5, 6]
+    assert index.due(1000) == [7, 8, 9, 0] and len(index) == 0
+    # Stale entries are compacted
+    for i in range(100000):
+        index.schedule(i % 10, i)
+    assert len(index) == 10 and len(index.heap) <= 2 * index.COMPACT_MIN + 1
+    print("OK  index: ordering, cancellation, compaction")
+
+
+def testCallbacks():
+    evicted = collections.Counter()
+    cache = LRUCache(
+        limit=3, onEvict=lambda key, value, cause: evicted.update([cause])
+    )
+    for k in "abcd":
+        cache.set(k, k, expires=0.05)
+    assert evicted["evicted"] == 1 and len(cache.expiration) == 3
+    cache.set("e", "e")
+    time.sleep(0.1)
+    assert cache.expire() == 2 and evicted["expired"] == 2
+    assert cache.keys() == ["e"] and cache.weight == 1
+    # Expired entries that are accessed are reported as well
+    cache = TimeoutCache(
+        MemoryCache(limit=1000),
+        timeout=0.05,
+        onEvict=lambda key, value, cause: evicted.update([key]),
+    )
+    cache.set("k", "v")
+    time.sleep(0.1)
+    assert cache.get("k") is None and evicted["k"] == 1 and not cache.expiration
+    print("OK  callbacks: evicted and expired entries")
+
+
+def testThread():
+    for cache in (TimeoutCache(timeout=0.05), LRUCache(10000, expires=0.05)):
+        for i in range(5000):
+            cache.set(i, i)
+        cache.start(interval=0.01)
+        time.sleep(0.2)
+        assert not cache.keys() and not cache.expiration, len(cache.keys())
+        cache.stop()
+    print("OK  thread: entries expire without being accessed")
+
+
+async def testAsync():
+    cache = TimeoutCache(timeout=0.05)
+    task = asyncio.create_task(cache.expiring(interval=0.01))
+    for i in range(5000):
+        cache.set(i, i)
+    await asyncio.sleep(0.2)
+    task.cancel()
+    assert not cache.keys() and not cache.expiration
+    print("OK  asyncio: entries expire without being accessed")
+
+
+def load(name, cache, keys, ttl):
+    """Sets the given number of keys, each once, returning the maximum number
+    of entries held by the cache."""
+    data = cache.cache.data if isinstance(cache, TimeoutCache) else cache.data
+    before = rss()
+    largest = 0
+    started = time.time()
+    for i in range(keys):
+        if isinstance(cache, LRUCache):
+            cache.set(i, i, expires=ttl)
+        else:
+            cache.set(i, i)
+        if i % 10000 == 0:
+            largest = max(largest, len(data), len(cache.expiration.heap))
+    elapsed = time.time() - started
+    print(
+        "{0:22s} {1:,d} keys at {2:,.0f}/s: at most {3:,d} entries, "
+        "{4:,d} left, {5:+.0f}MB".format(
+            name, keys, keys / elapsed, largest, len(data), rss() - before
+        )
+    )
+    return largest
+
+
+if __name__ == "__main__":
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    ttl = 0.05
+    testIndex()
+    testCallbacks()
+    testThread()
+    asyncio.run(testAsync())
+    # Without the index, the memory grows with the number of keys
+    # that were ever set.
+    for name, cache in (
+        ("TimeoutCache", TimeoutCache(timeout=ttl)),
+        ("LRUCache", LRUCache(limit=keys, expires=ttl)),
+    ):
+        largest = load(name, cache, keys, ttl)
+        assert largest < keys / 10, largest
+
+# EOF
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the `FileCache` (atomic writes, shards, index, size-bounded eviction
+# and `clear`), and benchmarks it against the previous implementation:
+#
+# >   python cache_file.py [KEYS]
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import tempfile
+import threading
+from retro.contrib.cache import Cache, FileCache, TimeoutCache
+
+
+class LegacyFileCache(FileCache):
+    """The previous implementation, which wrote in place in a single
+    directory and checked the file twice per `get`."""
+
+    def __init__(self, path):
+        FileCache.__init__(self, path, sharded=False)
+
+    def has(self, key):
+        path = self.path + "/" + self._normKey(key) + self.extension
+        if os.path.exists(path):
+            s = os.stat(path)
+            return self.EXPIRES <= 0 or (time.time() - s.st_mtime) < self.EXPIRES
+        else:
+            return False
+
+    def get(self, key):
+        if self.has(key):
+            path = self.path + "/" + self._normKey(key) + self.extension
+            with open(path, "rb") as f:
+                return self._load(f)
+        else:
+            return None
+
+    def set(self, key, data):
+        path = self.path + "/" + self._normKey(key) + self.extension
+        with open(path, "wb") as f:
+            self._save(f, data)
+        return data
+
+
+def tornReads(cache, duration=0.5):
+    """Reads a key while another thread rewrites it, returning the number
+    of reads that did not get a complete value."""
+    values = [b"a" * 200000, b"b" * 200000]
+    cache.set("key", values[0])
+    running = True
+    torn = 0
+
+    def writer():
+        i = 0
+        while running:
+            i += 1
+            cache.set("key", values[i % 2])
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    end = time.time() + duration
+    while time.time() < end:
+        if cache.get("key") not in values:
+            torn += 1
+    running = False
+    thread.join()
+    return torn
+
+
+def test(directory):
+    cache = FileCache(os.path.join(directory, "test"))
+    # Shards
+    for i in range(1000):
+        cache.set("key:{0}".format(i), i)
+    shards = [_ for _ in os.listdir(cache.path)]
+    assert len(shards) == 256 and all(len(_) == 2 for _ in shards), shards
+    assert all(cache.get("key:{0}".format(i)) == i for i in range(1000))
+    # Entries written by another instance (or process) are found
+    other = FileCache(cache.path)
+    assert other.has("key:1") and other.get("key:2") == 2
+    other.remove("key:3")
+    assert cache.get("key:3") is None and not cache.has("key:3")
+    # ...and so are the entries they removed
+    assert cache.has("key:5")
+    other.remove("key:5")
+    assert not cache.has("key:5")
+    # Without `maxSize`, there is no index
+    assert not cache.index and not other.index
+    # The keys are recovered from the file names, unless they were hashed
+    keys = cache.keys()
+    assert len(keys) == 998 and "key:999" in keys and "key:3" not in keys
+    cache.set("x" * 200, 1)
+    assert len(cache.keys()) == 998
+    cache.remove("x" * 200)
+    try:
+        FileCache(cache.path).withSHA1Keys().keys()
+        assert False, "SHA1 keys can't be listed"
+    except NotImplementedError:
+        pass
+    # Expiration
+    cache.expires(0.05)
+    time.sleep(0.1)
+    assert cache.get("key:1") is None and not cache.has("key:1")
+    cache.expires(60)
+    # Clear
+    assert cache.has("key:7")
+    other.clear()
+    assert not cache.has("key:7")
+    cache.clear()
+    assert cache.get("key:2") is None and os.listdir(cache.path) == []
+    cache.set("key:2", 2)
+    assert other.get("key:2") == 2
+    other.set("key:4", 4)
+    assert cache.get("key:4") == 4
+    # A `TimeoutCache` can scan the entries of a `FileCache`
+    timeout = TimeoutCache(FileCache(os.path.join(directory, "timeout")), timeout=60)
+    timeout.set("a", 1)
+    timeout.cache.set("b", ("old", time.time() - 120))
+    timeout.cleanup(scan=True)
+    assert timeout.keys() == ["a"] and timeout.get("a") == 1
+    # Atomic writes
+    assert tornReads(FileCache(os.path.join(directory, "atomic"))) == 0
+    # Size-bounded eviction of the least recently used entries
+    value = b"x" * 1000
+    size = len(pickle.dumps(value))
+    cache = FileCache(os.path.join(directory, "bounded"), maxSize=10 * size)
+    for i in range(10):
+        cache.set(i, value)
+    cache.get(0)
+    cache.set(10, value)
+    assert not cache.has(1) and cache.has(0) and cache.size == 10 * size
+    # The index is loaded from the directory
+    reloaded = FileCache(cache.path, maxSize=10 * size)
+    assert len(reloaded.index) == 10 and reloaded.size == 10 * size
+    # ...and follows the entries that other instances remove or rewrite
+    name = cache._normKey(2)
+    reloaded.remove(2)
+    assert not cache.has(2) and name not in cache.index
+    time.sleep(0.01)
+    reloaded.set(3, b"y")
+    name = cache._normKey(3)
+    assert cache.has(3) and cache.index[name] == reloaded.index[name]
+    # Temporary files left by crashed writers are swept on eviction, once
+    # they are old enough
+    stale = cache._path("11", create=True) + ".1234-5678.tmp"
+    fresh = cache._path("12", create=True) + ".1234-5678.tmp"
+    for path in (stale, fresh):
+        with open(path, "wb") as f:
+            f.write(value)
+    os.utime(stale, (time.time() - cache.TEMP_EXPIRES - 1,) * 2)
+    cache.set(13, value)
+    assert os.path.exists(stale), "swept before SWEEP_INTERVAL"
+    cache.swept = 0
+    cache.set(14, value)
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+    # ...or on demand
+    assert cache.sweep(expires=0) == 1 and not os.path.exists(fresh)
+    print("OK  shards, keys, atomic writes, expiration, clear, eviction, sweep")
+
+
+def timed(function, count):
+    started = time.perf_counter()
+    function()
+    return (time.perf_counter() - started) / count
+
+
+def benchmark(directory, count):
+    value = {"title": "Page", "body": "Lorem ipsum " * 20}
+    keys = ["/page/{0}".format(i) for i in range(count)]
+    print("{0:,d} keys".format(count))
+    for name, factory in (
+        ("previous", LegacyFileCache),
+        ("FileCache", FileCache),
+        ("FileCache+maxSize", lambda path: FileCache(path, maxSize=1 << 40)),
+    ):
+        path = os.path.join(directory, name)
+        cache = factory(path)
+
+        def write():
+            for k in keys:
+                cache.set(k, value)
+
+        def read():
+            for k in keys:
+                cache.get(k)
+
+        def has():
+            for k in keys:
+                cache.has(k)
+
+        w = timed(write, count)
+        r = timed(read, count)
+        h = timed(has, count)
+        t = tornReads(cache)
+        c = timed(lambda: cache.clear() if name != "previous" else shutil.rmtree(path), 1)
+        print(
+            "  {0:18s} set {1:5.1f}µs  get {2:5.1f}µs  has {3:5.1f}µs  "
+            "clear {4:7.1f}ms  torn reads {5}".format(
+                name, w * 1e6, r * 1e6, h * 1e6, c * 1e3, t
+            )
+        )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        test(directory)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(__file__) or ".") as d:
+        benchmark(d, int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+
+# EOF
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the `LRUCache` (recency, weights, TTL and TinyLFU admission), and
+# benchmarks its throughput with 1, 8 and 32 threads against the previous
+# implementation:
+#
+# >   python cache_lru.py [SECONDS]
+
+import sys
+import time
+import random
+import threading
+from retro.contrib.cache import Cache, LRUCache
+
+
+class LegacyLRUCache(Cache):
+    """The previous implementation, where the Python 2 `cmp` sort was
+    replaced by its `key` equivalent so that it can run at all."""
+
+    WEIGHT = 0
+    HITS = 1
+    TIMESTAMP = 2
+    VALUE = 3
+    EXPIRES = -1
+
+    def __init__(self, limit=100):
+        Cache.__init__(self)
+        self.data = {}
+        self.weight = 0
+        self.limit = limit
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        d = self.data.get(key)
+        if d:
+            if self.EXPIRES <= 0 or (time.time() - d[self.TIMESTAMP]) < self.EXPIRES:
+                d[self.HITS] += 1
+                return d[self.VALUE]
+            else:
+                self.remove(key)
+                return None
+        else:
+            return None
+
+    def set(self, key, data, weight=1):
+        self.lock.acquire()
+        if key in self.data:
+            previous = self.data[key]
+            self.weight -= previous[self.WEIGHT]
+            previous[self.WEIGHT] = weight
+            previous[self.TIMESTAMP] = time.time()
+            previous[self.VALUE] = data
+            self.data[key] = previous
+        else:
+            self.data[key] = [weight, 0, time.time(), data]
+            self.weight += weight
+        self.lock.release()
+        if self.weight > self.limit:
+            self.cleanup()
+        return data
+
+    def remove(self, key):
+        self.lock.acquire()
+        if key in self.data:
+            self.weight -= self.data[key][self.WEIGHT]
+            del self.data[key]
+        self.lock.release()
+
+    def cleanup(self):
+        self.lock.acquire()
+        items = list(self.data.items())
+        items.sort(key=lambda _: _[1][self.HITS])
+        i = 0
+        while self.weight > self.limit and i < len(items):
+            key, value = items[i]
+            self.weight -= value[self.WEIGHT]
+            del self.data[key]
+            i += 1
+        self.lock.release()
+
+
+def test():
+    # Recency: the least recently used key is evicted
+    cache = LRUCache(limit=3)
+    for k in "abc":
+        cache.set(k, k)
+    cache.get("a")
+    cache.set("d", "d")
+    assert cache.keys() == ["c", "a", "d"], cache.keys()
+    # Weights
+    cache = LRUCache(limit=10, weigher=LRUCache.Size)
+    cache.set("a", b"12345")
+    cache.set("b", "1234")
+    cache.set("c", b"123")
+    assert cache.keys() == ["b", "c"] and cache.weight == 7
+    cache.set("big", b"x" * 11)
+    assert not cache.has("big") and cache.weight == 7
+    cache.remove("b")
+    assert cache.weight == 3
+    # TTL
+    cache = LRUCache(limit=10, expires=60)
+    cache.set("short", 1, expires=0.05)
+    cache.set("long", 2)
+    time.sleep(0.1)
+    assert cache.get("short") is None and not cache.has("short")
+    assert cache.get("long") == 2
+    cache.set("short", 1, expires=0.01)
+    time.sleep(0.02)
+    assert len(cache.cleanup()) == 1
+    # Admission: hot keys survive a scan of keys that are used once
+    plain, admitted = LRUCache(limit=100), LRUCache(limit=100, admission=True)
+    for cache in (plain, admitted):
+        for _ in range(20):
+            for k in range(100):
+                if cache.get(k) is None:
+                    cache.set(k, k)
+        for k in range(1000, 2000):
+            if cache.get(k) is None:
+                cache.set(k, k)
+    assert sum(plain.has(k) for k in range(100)) == 0
+    assert sum(admitted.has(k) for k in range(100)) == 100
+    print("OK  recency, weights, TTL and admission")
+
+
+def workload(cache, barrier, duration, keys, results):
+    """Runs a mix of 90% gets and 10% sets on skewed keys."""
+    rnd = random.Random()
+    picks = [int(keys * rnd.random() ** 4) for _ in range(8192)]
+    ops = misses = 0
+    barrier.wait()
+    end = time.time() + duration
+    i = 0
+    while time.time() < end:
+        for _ in range(100):
+            key = picks[i & 8191]
+            i += 1
+            if cache.get(key) is None:
+                misses += 1
+                cache.set(key, key)
+            elif i % 10 == 0:
+                cache.set(key, key)
+        ops += 100
+    results.append((ops, misses))
+
+
+def throughput(cache, threads, duration, keys):
+    results = []
+    barrier = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(
+            target=workload, args=(cache, barrier, duration, keys, results)
+        )
+        for _ in range(threads)
+    ]
+    for _ in workers:
+        _.start()
+    barrier.wait()
+    started = time.time()
+    for _ in workers:
+        _.join()
+    elapsed = time.time() - started
+    ops = sum(_[0] for _ in results)
+    return ops / elapsed, 1 - sum(_[1] for _ in results) / ops
+
+
+def benchmark(duration):
+    limit = 1000
+    keys = 10 * limit
+    print(
+        "{0:20s} {1:>12s} {2:>12s} {3:>12s} {4:>10s}".format(
+            "ops/s", "1", "8", "32", "hit ratio"
+        )
+    )
+    for name, factory in (
+        ("previous", lambda: LegacyLRUCache(limit)),
+        ("LRUCache", lambda: LRUCache(limit)),
+        ("LRUCache+admission", lambda: LRUCache(limit, admission=True)),
+    ):
+        results = [throughput(factory(), n, duration, keys) for n in (1, 8, 32)]
+        print(
+            "{0:20s} {1:12,.0f} {2:12,.0f} {3:12,.0f} {4:10.1%}".format(
+                name, *[_[0] for _ in results], results[0][1]
+            )
+        )
+
+
+if __name__ == "__main__":
+    test()
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 1)
+
+# EOF
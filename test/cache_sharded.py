@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the lock-striped `ShardedCache` and benchmarks it with 64 threads
+# against a single locked cache, for read and write heavy workloads:
+#
+# >   python cache_sharded.py [SECONDS]
+
+import sys
+import time
+import random
+import threading
+from retro.contrib.cache import cached, Cache, LRUCache, MemoryCache, ShardedCache
+
+THREADS = 64
+
+
+class LockedCache(Cache):
+    """A cache where every operation takes the same lock, as a baseline."""
+
+    def __init__(self, cache):
+        Cache.__init__(self)
+        self.cache = cache
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            return self.cache.set(key, value)
+
+
+def test():
+    cache = ShardedCache(limit=1600, shards=16)
+    for i in range(10000):
+        cache.set(i, i)
+    assert len(cache) == 1600 and all(len(_) == 100 for _ in cache.shards)
+    assert cache.get(9999) == 9999 and cache.get(0) is None
+    cache.remove(9999)
+    assert not cache.has(9999)
+    cache.clear()
+    assert len(cache) == 0
+    # Shards can be any cache
+    cache = ShardedCache(shards=4, factory=lambda: MemoryCache(limit=-1))
+    for i in range(1000):
+        cache["key:{0}".format(i)] = i
+    assert sorted(cache.keys()) == sorted("key:{0}".format(i) for i in range(1000))
+    # The factory is called once, even with concurrent callers
+    calls = []
+
+    def factory(key):
+        calls.append(key)
+        time.sleep(0.05)
+        return key * 2
+
+    barrier = threading.Barrier(THREADS)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(cache.getOrSet(21, factory, 21))
+
+    workers = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for _ in workers:
+        _.start()
+    for _ in workers:
+        _.join()
+    assert calls == [21] and results == [42] * THREADS, (calls, results)
+    # It is a drop-in store for `@cached`
+    store = ShardedCache()
+    double = cached(store)(lambda x: x * 2)
+    assert double(4) == 8 and double(4) == 8 and len(store) == 1
+    print("OK  shards, limit, getOrSet, @cached")
+
+
+def workload(cache, barrier, duration, writes, results):
+    rnd = random.Random()
+    picks = [int(100000 * rnd.random() ** 3) for _ in range(8192)]
+    ops = 0
+    barrier.wait()
+    end = time.time() + duration
+    i = 0
+    while time.time() < end:
+        for _ in range(100):
+            key = picks[i & 8191]
+            i += 1
+            if cache.get(key) is None or rnd.random() < writes:
+                cache.set(key, key)
+        ops += 100
+    results.append(ops)
+
+
+def throughput(cache, duration, writes):
+    results = []
+    barrier = threading.Barrier(THREADS + 1)
+    workers = [
+        threading.Thread(
+            target=workload, args=(cache, barrier, duration, writes, results)
+        )
+        for _ in range(THREADS)
+    ]
+    for _ in workers:
+        _.start()
+    barrier.wait()
+    started = time.time()
+    for _ in workers:
+        _.join()
+    return sum(results) / (time.time() - started)
+
+
+def benchmark(duration):
+    limit = 10000
+    print(
+        "{0:28s} {1:>14s} {2:>14s}".format(
+            "{0} threads, ops/s".format(THREADS), "10% writes", "50% writes"
+        )
+    )
+    for name, factory in (
+        ("LRUCache with one lock", lambda: LockedCache(LRUCache(limit))),
+        ("LRUCache", lambda: LRUCache(limit)),
+        ("ShardedCache (16 LRU)", lambda: ShardedCache(limit)),
+        ("ShardedCache (64 LRU)", lambda: ShardedCache(limit, shards=64)),
+    ):
+        rates = [throughput(factory(), duration, writes) for writes in (0.1, 0.5)]
+        print("{0:28s} {1:14,.0f} {2:14,.0f}".format(name, *rates))
+
+
+if __name__ == "__main__":
+    test()
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 1)
+
+# EOF
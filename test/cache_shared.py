@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the `SharedMemoryCache` (hash table, slabs, clock eviction and
+# concurrent writers), and benchmarks worker processes sharing it against
+# workers with their own `LRUCache`:
+#
+# >   python cache_shared.py [WORKERS] [SECONDS]
+
+import os
+import sys
+import time
+import random
+import multiprocessing
+from retro.web import cache as webcache
+from retro.contrib.cache import SharedMemoryCache, LRUCache, CacheError, cached
+
+NAME = "test-{0}".format(os.getpid())
+MB = 1024 * 1024
+
+
+class CheckedCache(SharedMemoryCache):
+    """Checks that the slots are only freed once no reader can use them."""
+
+    def _free(self, slot, length):
+        for i in range(self.capacity):
+            b = self._bucket(i)
+            assert b[1] != self.USED or b[5] != slot or b[0] & 1, (i, b)
+        SharedMemoryCache._free(self, slot, length)
+
+
+def testRemovals():
+    cache = CheckedCache(NAME + "-checked", size=4 * MB, capacity=256)
+    try:
+        for i in range(150):
+            cache.set(i, b"" if i % 2 else "")
+        for i in range(0, 150, 2):
+            cache.remove(i)
+        for i in range(150, 300):
+            cache.set(i, i, expires=0.01 if i % 3 else -1)
+        time.sleep(0.02)
+        cache.cleanup()
+        assert all(cache.get(i) in (b"", None) for i in range(150))
+        # The sequences are all even once the removals are done
+        assert all(not cache._bucket(i)[0] & 1 for i in range(cache.capacity))
+        print("OK  slots are freed while their bucket is being updated")
+    finally:
+        cache.unlink()
+        cache.close()
+
+
+def test():
+    cache = SharedMemoryCache(NAME, size=4 * MB, capacity=1024)
+    try:
+        # Keys and values of any type
+        for key, value in (
+            ("text", "Hello, World"),
+            (b"bytes", b"\x00\x01"),
+            (("tuple", 1), {"dict": [1, 2]}),
+            ("", b""),
+        ):
+            cache.set(key, value)
+            assert cache.get(key) == value and cache.has(key), key
+        assert cache.get(b"text") is None and cache.get("missing") is None
+        assert len(cache) == 4
+        # Overwrites, across slab classes
+        cache.set("text", "x" * 5000)
+        assert cache.get("text") == "x" * 5000 and len(cache) == 4
+        # Removal shifts back colliding buckets
+        cache.clear()
+        for i in range(700):
+            cache.set(i, i)
+        for i in range(0, 700, 3):
+            cache.remove(i)
+        assert all(cache.get(i) == (None if i % 3 == 0 else i) for i in range(700))
+        assert len(cache) == 700 - 234 == len(cache.keys())
+        # Expiration
+        cache.set("short", 1, expires=0.05)
+        time.sleep(0.1)
+        assert cache.get("short") is None and "short" in cache.keys()
+        cache.cleanup()
+        assert "short" not in cache.keys()
+        # The clock evicts entries that were not read, once the table is full
+        cache.clear()
+        for i in range(100):
+            cache.set("hot:{0}".format(i), i)
+        for i in range(10000):
+            cache.set("cold:{0}".format(i), i)
+            if i % 10 == 0:
+                for j in range(100):
+                    cache.get("hot:{0}".format(j))
+        assert len(cache) <= 1024 * SharedMemoryCache.LOAD_FACTOR
+        assert all(cache.has("hot:{0}".format(i)) for i in range(100))
+        # Slabs are reused when the pages are all assigned
+        cache.clear()
+        for i in range(20000):
+            cache.set(i, b"x" * 1000)
+        assert 0 < len(cache) <= 3 * 1024 and cache.get(19999) == b"x" * 1000
+        # Entries larger than a page are not cached
+        cache.set("large", b"x" * 2 * MB)
+        assert not cache.has("large")
+        # ...and don't leave the previous value in place
+        cache.set("k", b"v1")
+        cache.set("k", b"x" * 2 * MB)
+        assert cache.get("k") is None and not cache.has("k")
+        # Tags would only be known to this process
+        for operation in (
+            lambda: cache.tag("k", "letters"),
+            lambda: cache.invalidate(tag="letters"),
+            lambda: cached(cache, tags=("letters",)),
+        ):
+            try:
+                operation()
+                assert False, "Tags are not supported"
+            except CacheError:
+                pass
+        double = webcache(cache)(lambda n: n * 2)
+        assert double(2) == 4 and double(2) == 4
+        print("OK  types, overwrites, removals, expiration, eviction, no tags")
+    finally:
+        cache.unlink()
+        cache.close()
+
+
+def writer(n, count):
+    cache = SharedMemoryCache(NAME, size=16 * MB)
+    for i in range(count):
+        key = "key:{0}".format(random.randrange(2000))
+        value = cache.get(key)
+        assert value is None or value == key * 10, (key, value)
+        cache.set(key, key * 10)
+    cache.close()
+
+
+def testProcesses():
+    cache = SharedMemoryCache(NAME, size=16 * MB)
+    try:
+        workers = [
+            multiprocessing.Process(target=writer, args=(_, 20000)) for _ in range(4)
+        ]
+        for _ in workers:
+            _.start()
+        for _ in workers:
+            _.join()
+        assert all(_.exitcode == 0 for _ in workers)
+        keys = cache.keys()
+        assert len(keys) == len(set(keys)) == len(cache) and len(keys) > 1500
+        assert all(cache.get(k) == k * 10 for k in keys)
+        print("OK  {0} processes: consistent concurrent writes".format(len(workers)))
+    finally:
+        cache.unlink()
+        cache.close()
+
+
+def render(key):
+    """A page that takes about 100µs to produce."""
+    return ("<li>{0}</li>".format(key) * 20).encode("utf8") + bytes(
+        sum(range(2000)) & 0xFF
+    )
+
+
+def worker(shared, entries, duration, results):
+    cache = (
+        SharedMemoryCache(NAME, size=64 * MB)
+        if shared
+        else LRUCache(entries)
+    )
+    rnd = random.Random()
+    picks = [int(50000 * rnd.random() ** 3) for _ in range(1 << 17)]
+    ops = misses = i = 0
+    end = time.time() + duration
+    while time.time() < end:
+        for _ in range(100):
+            key = "/page/{0}".format(picks[i & 0x1FFFF])
+            i += 1
+            if cache.get(key) is None:
+                misses += 1
+                cache.set(key, render(key))
+        ops += 100
+    results.put((ops, misses))
+
+
+def benchmark(workers, duration):
+    entries = 20000
+    print(
+        "{0} workers, {1:,d} entries in total, 50k keys: {2:>12s} {3:>10s}".format(
+            workers, entries, "ops/s", "hit ratio"
+        )
+    )
+    for name, shared in (("LRUCache per worker", False), ("SharedMemoryCache", True)):
+        if shared:
+            cache = SharedMemoryCache(NAME, size=64 * MB, capacity=entries)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=worker, args=(shared, entries // workers, duration, results)
+            )
+            for _ in range(workers)
+        ]
+        for _ in processes:
+            _.start()
+        stats = [results.get() for _ in processes]
+        for _ in processes:
+            _.join()
+        ops = sum(_[0] for _ in stats)
+        misses = sum(_[1] for _ in stats)
+        print(
+            "  {0:45s} {1:12,.0f} {2:10.1%}".format(
+                name, ops / duration, 1 - misses / ops
+            )
+        )
+        if shared:
+            cache.unlink()
+            cache.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("fork")
+    test()
+    testRemovals()
+    testProcesses()
+    benchmark(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 3,
+    )
+
+# EOF
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Load-tests the coalescing of cache misses (`SingleFlight`) with threads and
+# coroutines, showing that expiring keys are recomputed once per expiry
+# instead of once per concurrent caller:
+#
+# >   python cache_singleflight.py [SECONDS]
+
+import sys
+import time
+import random
+import asyncio
+import threading
+import collections
+from retro.contrib.cache import (
+    cached,
+    MemoryCache,
+    TimeoutCache,
+    SingleFlight,
+    AsyncSingleFlight,
+    CacheTimeout,
+)
+
+KEYS = 4
+EXPIRES = 0.25
+BACKEND_TIME = 0.02
+
+
+class Backend:
+    """A slow backend (ie. a database) that counts its calls per key."""
+
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    def query(self, key):
+        self.calls[key] += 1
+        time.sleep(BACKEND_TIME)
+        return "value-{0}".format(key)
+
+    async def aquery(self, key):
+        self.calls[key] += 1
+        await asyncio.sleep(BACKEND_TIME)
+        return "value-{0}".format(key)
+
+
+def store():
+    return TimeoutCache(MemoryCache(limit=1000), timeout=EXPIRES)
+
+
+def uncoalesced(store, function):
+    """The previous `@cached` logic, for comparison."""
+
+    def wrapper(key):
+        k = "query({0})".format(key)
+        value = store.get(k) if store.has(k) else None
+        return store.set(k, function(key)) if value is None else value
+
+    return wrapper
+
+
+def hammer(function, threads, duration):
+    errors = []
+
+    def worker():
+        end = time.time() + duration
+        while time.time() < end:
+            try:
+                key = random.randrange(KEYS)
+                assert function(key) == "value-{0}".format(key)
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for _ in workers:
+        _.start()
+    for _ in workers:
+        _.join()
+    assert not errors, errors[:3]
+
+
+def loadThreads(duration, threads=64):
+    expiries = duration / EXPIRES
+    for name in ("without single flight", "with single flight"):
+        backend = Backend()
+        if name.startswith("without"):
+            function = uncoalesced(store(), backend.query)
+        else:
+            function = cached(store())(backend.query)
+        hammer(function, threads, duration)
+        calls = max(backend.calls.values())
+        print(
+            "{0:6s} {1:22s} {2:5d} backend calls per key ({3:.0f} expiries)".format(
+                "thread", name, calls, expiries
+            )
+        )
+    # NOTE: Each expiry costs one call, plus the time it takes to compute
+    assert calls <= duration / (EXPIRES + BACKEND_TIME) + 2, backend.calls
+
+
+async def loadAsync(duration, tasks=512):
+    backend = Backend()
+    function = cached(store())(backend.aquery)
+    end = time.time() + duration
+
+    async def worker():
+        while time.time() < end:
+            key = random.randrange(KEYS)
+            assert await function(key) == "value-{0}".format(key)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker() for _ in range(tasks)))
+    calls = max(backend.calls.values())
+    print(
+        "{0:6s} {1:22s} {2:5d} backend calls per key ({3:.0f} expiries)".format(
+            "async", "with single flight", calls, duration / EXPIRES
+        )
+    )
+    assert calls <= duration / (EXPIRES + BACKEND_TIME) + 2, backend.calls
+
+
+def testErrors():
+    flight = SingleFlight(timeout=0.1)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def failing():
+        time.sleep(0.05)
+        raise ValueError("Backend failure")
+
+    def worker():
+        barrier.wait()
+        try:
+            flight.run("key", MemoryCache(), failing)
+        except ValueError as e:
+            results.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(8)]
+    for _ in workers:
+        _.start()
+    for _ in workers:
+        _.join()
+    # All the callers got the same error
+    assert len(results) == 8 and len(set(map(id, results))) == 1, results
+    assert len(flight) == 0
+    # Waiting callers time out
+    slow = threading.Thread(
+        target=lambda: flight.run("slow", MemoryCache(), time.sleep, 0.3)
+    )
+    slow.start()
+    time.sleep(0.05)
+    try:
+        flight.run("slow", MemoryCache(), time.sleep, 0.3)
+        assert False, "Should have timed out"
+    except CacheTimeout:
+        pass
+    slow.join()
+    print("OK  thread: errors are propagated, waiting callers time out")
+
+
+async def testAsyncErrors():
+    flight = AsyncSingleFlight(timeout=0.1)
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("Backend failure")
+
+    results = await asyncio.gather(
+        *(flight.run("key", MemoryCache(), failing) for _ in range(8)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(_, ValueError) for _ in results), results
+    results = await asyncio.gather(
+        flight.run("slow", MemoryCache(), asyncio.sleep, 0.3, "done"),
+        flight.run("slow", MemoryCache(), asyncio.sleep, 0.3, "done"),
+        return_exceptions=True,
+    )
+    # The leader completes even though the follower timed out
+    assert results[0] == "done" and isinstance(results[1], CacheTimeout), results
+    print("OK  async: errors are propagated, waiting callers time out")
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    testErrors()
+    asyncio.run(testAsyncErrors())
+    loadThreads(duration)
+    asyncio.run(loadAsync(duration))
+
+# EOF
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the `SQLiteCache` (write-behind, expiration, size-bounded eviction,
+# sharing between processes), and benchmarks it against the `FileCache` with
+# 10k keys, or the given numbers of keys (ie. `10000,100000,1000000`):
+#
+# >   python cache_sqlite.py [KEYS,...]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import multiprocessing
+from retro.contrib.cache import SQLiteCache, FileCache
+
+
+def test(directory):
+    path = os.path.join(directory, "test.sqlite")
+    cache = SQLiteCache(path, interval=0.05)
+    # Pending writes are visible, and written in the background
+    cache.set("a", {"value": 1})
+    cache.set("b", b"bytes", tags=("users", "pages"))
+    cache.remove("b")
+    assert cache.get("a") == {"value": 1} and cache.pending
+    assert cache.get("b") is None and not cache.has("b")
+    time.sleep(0.2)
+    assert not cache.pending and cache.keys() == ["a"]
+    # Entries survive a restart
+    cache.close()
+    cache = SQLiteCache(path, writeBehind=False)
+    assert cache.get("a") == {"value": 1} and len(cache) == 1
+    # Expiration
+    cache.set("short", 1, expires=0.05)
+    time.sleep(0.1)
+    assert cache.get("short") is None and len(cache) == 2
+    cache.cleanup()
+    assert len(cache) == 1
+    # Eviction of the oldest entries once over the maximum size
+    cache.clear()
+    cache.maxSize = 10000
+    for i in range(100):
+        cache.set(str(i), b"x" * 1000)
+    cache.cleanup()
+    assert sorted(cache.keys()) == [str(_) for _ in range(91, 100)]
+    # The total size is maintained through replacements and removals
+    cache.set("91", b"x" * 10)
+    cache.remove("92")
+    db = cache.connection()
+    total = db.execute("SELECT size FROM stats").fetchone()[0]
+    assert total == db.execute("SELECT SUM(size) FROM cache").fetchone()[0]
+    assert total == 7 * len(cache.serializer(b"x" * 1000)) + len(
+        cache.serializer(b"x" * 10)
+    )
+    cache.close()
+    # Writers flush the pending changes themselves once there are too many
+    cache = SQLiteCache(path, interval=60)
+    cache.MAX_PENDING = 10
+    for i in range(25):
+        cache.set(str(i), i)
+    assert len(cache.pending) < 10 and cache.get("0") == 0
+    # ...and clearing removes them all, including the ones being written
+    cache.clear()
+    assert not cache.pending and not cache.flushing and len(cache) == 0
+    cache.close()
+    # Processes share the cache
+    cache = SQLiteCache(path)
+    cache.clear()
+    workers = [multiprocessing.Process(target=writer, args=(path, _)) for _ in range(4)]
+    for _ in workers:
+        _.start()
+    for _ in workers:
+        _.join()
+    assert len(cache) == 4000 and cache.get("3:999") == 3999
+    cache.close()
+    print("OK  write-behind, restarts, expiration, eviction, processes")
+
+
+def writer(path, n):
+    cache = SQLiteCache(path)
+    for i in range(1000):
+        cache.set("{0}:{1}".format(n, i), n * 1000 + i)
+    cache.close()
+
+
+def timed(function, count):
+    started = time.perf_counter()
+    function()
+    return (time.perf_counter() - started) / count
+
+
+def size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.stat(os.path.join(path, _)).st_blocks * 512 for _ in os.listdir(path)
+        )
+    else:
+        return sum(
+            os.stat(_).st_blocks * 512
+            for _ in (path, path + "-wal", path + "-shm")
+            if os.path.exists(_)
+        )
+
+
+def benchmark(directory, count):
+    value = {"title": "Page", "body": "Lorem ipsum " * 20, "tags": [1, 2, 3]}
+    keys = ["/page/{0}".format(i) for i in range(count)]
+    sample = random.sample(keys, min(count, 10000))
+    print("{0:,d} keys".format(count))
+    for name, cache, path in (
+        (
+            "FileCache",
+            FileCache(os.path.join(directory, "files"), expires=0),
+            os.path.join(directory, "files"),
+        ),
+        (
+            "SQLiteCache",
+            SQLiteCache(os.path.join(directory, "cache.sqlite")),
+            os.path.join(directory, "cache.sqlite"),
+        ),
+    ):
+
+        def write():
+            for k in keys:
+                cache.set(k, value)
+            if isinstance(cache, SQLiteCache):
+                cache.flush()
+
+        def read():
+            for k in sample:
+                assert cache.get(k) == value
+
+        def miss():
+            for k in sample:
+                assert cache.get(k + "?") is None
+
+        w = timed(write, len(keys))
+        r = timed(read, len(sample))
+        m = timed(miss, len(sample))
+        print(
+            "  {0:12s} set {1:7.1f}µs  get {2:7.1f}µs  miss {3:7.1f}µs  {4:7.1f}MB".format(
+                name, w * 1e6, r * 1e6, m * 1e6, size(path) / 1024 / 1024
+            )
+        )
+        if isinstance(cache, SQLiteCache):
+            cache.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        test(directory)
+    counts = sys.argv[1] if len(sys.argv) > 1 else "10000"
+    for count in (int(_) for _ in counts.split(",")):
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(__file__) or ".") as d:
+            benchmark(d, count)
+
+# EOF
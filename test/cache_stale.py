@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests stale-while-revalidate in `@cached` (threads and coroutines) and in
+# the `ResponseCache` (WSGI and `retro.aio`), and benchmarks the latency of
+# a slow function cached with a `TimeoutCache` against `staleFor`:
+#
+# >   python cache_stale.py [SECONDS]
+
+import sys
+import time
+import asyncio
+import threading
+from retro import *
+from retro.contrib.cache import (
+    ResponseCache,
+    MemoryCache,
+    TimeoutCache,
+    Revalidator,
+    cached,
+)
+import retro.aio
+
+PORT = 8205
+
+
+def testCached():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @cached(MemoryCache(), maxAge=0.05, staleFor=0.2)
+    def value(n):
+        calls.append(n)
+        if len(calls) > 1:
+            started.set()
+            release.wait(5)
+        return len(calls)
+
+    # Fresh values are returned from the cache
+    assert value(1) == 1 and value(1) == 1 and len(calls) == 1
+    # Stale values are returned right away, while a single refresh runs
+    time.sleep(0.06)
+    t = time.perf_counter()
+    assert [value(1) for _ in range(10)] == [1] * 10
+    assert time.perf_counter() - t < 0.05 and started.wait(1)
+    assert len(calls) == 2 and len(value.revalidator) == 1
+    release.set()
+    while len(value.revalidator):
+        time.sleep(0.01)
+    assert value(1) == 2
+    # Expired values are computed again
+    time.sleep(0.3)
+    assert value(1) == 3 and len(calls) == 3
+    # Failed refreshes keep the stale value
+    fail = [False]
+
+    @cached(MemoryCache(), maxAge=0, staleFor=60)
+    def failing():
+        if fail[0]:
+            raise ValueError("Failed")
+        return "ok"
+
+    assert failing() == "ok"
+    fail[0] = True
+    assert failing() == "ok"
+    while len(failing.revalidator):
+        time.sleep(0.01)
+    assert failing() == "ok"
+    print("OK  @cached: fresh, stale, single refresh, expired, failures")
+
+
+async def testCachedAsync():
+    calls = []
+
+    @cached(MemoryCache(), maxAge=0.05, staleFor=1)
+    async def value():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    assert await value() == 1
+    await asyncio.sleep(0.06)
+    t = time.perf_counter()
+    assert await asyncio.gather(*[value() for _ in range(10)]) == [1] * 10
+    assert time.perf_counter() - t < 0.04 and len(value.revalidator) == 1
+    # The refresh is a task of the running loop
+    task = list(value.revalidator.refreshing.values())[0]
+    assert isinstance(task, asyncio.Task)
+    await task
+    assert await value() == 2 and len(calls) == 2
+    print("OK  @cached: coroutines are refreshed in tasks of the event loop")
+
+
+class Site(Component):
+    def __init__(self):
+        Component.__init__(self)
+        self.calls = 0
+
+    @on(GET="/page")
+    def page(self, request):
+        self.calls += 1
+        return request.respond(
+            "Page {0}".format(self.calls),
+            headers=[("Cache-Control", "max-age=60, stale-while-revalidate=60")],
+        )
+
+    @on(GET="/async")
+    async def asyncPage(self, request):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return request.respond("Async {0}".format(self.calls)).cache(seconds=60)
+
+
+def get(app, path, **headers):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": ""}
+    for k, v in headers.items():
+        environ["HTTP_" + k.upper()] = v
+    return b"".join(app(environ, lambda status, headers: None))
+
+
+def testResponseCache():
+    site = Site()
+    app = Application(components=[site])
+    store = MemoryCache()
+    cache = ResponseCache(store).install(app)
+    assert get(app, "/page") == b"Page 1" and get(app, "/page") == b"Page 1"
+    # The entry expires: the stale page is served while it's dispatched again
+    store.get("GET /page").expires = 0
+    assert get(app, "/page", if_none_match="x") == b"Page 1"
+    while len(cache.revalidator):
+        time.sleep(0.01)
+    assert site.calls == 2 and cache.staleHits == 1
+    assert get(app, "/page") == b"Page 2" and site.calls == 2
+    # Past the stale delay, the request waits for the handler
+    store.get("GET /page").stale = 0
+    assert get(app, "/page") == b"Page 3" and site.calls == 3
+    print("OK  ResponseCache: stale-while-revalidate")
+
+
+async def testResponseCacheAsync():
+    site = Site()
+    app = Application(components=[site])
+    store = MemoryCache()
+    cache = ResponseCache(store, staleFor=60).install(app)
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+
+    async def request():
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+        writer.write(b"GET /async HTTP/1.1\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        return response.rsplit(b"\r\n\r\n", 1)[1]
+
+    try:
+        assert await request() == b"Async 1"
+        store.get("GET /async").expires = 0
+        assert await request() == b"Async 1"
+        while len(cache.revalidator):
+            await asyncio.sleep(0.01)
+        assert await request() == b"Async 2" and site.calls == 2
+    finally:
+        server.close()
+    print("OK  aio: async handlers are revalidated in the event loop")
+
+
+def benchmark(duration):
+    """Calls a function that takes 20ms on 20 (already cached) keys from
+    4 threads, with values that are fresh for 100ms."""
+
+    def measure(store, **options):
+        @cached(store, **options)
+        def slow(key):
+            time.sleep(0.02)
+            return key
+
+        for key in range(20):
+            slow(key)
+        latencies = []
+
+        def run():
+            i = 0
+            end = time.time() + duration
+            while time.time() < end:
+                i += 1
+                t = time.perf_counter()
+                slow(i % 20)
+                latencies.append(time.perf_counter() - t)
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for _ in threads:
+            _.start()
+        for _ in threads:
+            _.join()
+        latencies.sort()
+        return [latencies[int(len(latencies) * _)] for _ in (0.5, 0.99, 0.999)]
+
+    print("{0:42s} {1:>9s} {2:>9s} {3:>9s}".format("", "p50", "p99", "p99.9"))
+    for name, store, options in (
+        ("TimeoutCache(timeout=0.1)", TimeoutCache(timeout=0.1), {}),
+        (
+            "MemoryCache, maxAge=0.1, staleFor=10",
+            MemoryCache(-1),
+            dict(maxAge=0.1, staleFor=10),
+        ),
+    ):
+        p = measure(store, **options)
+        print(
+            "  {0:40s} {1:7.1f}ms {2:7.1f}ms {3:7.1f}ms".format(
+                name, *(_ * 1e3 for _ in p)
+            )
+        )
+
+
+if __name__ == "__main__":
+    testCached()
+    asyncio.run(testCachedAsync())
+    testResponseCache()
+    asyncio.run(testResponseCacheAsync())
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 3)
+
+# EOF
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests tag and generation invalidation with the memory, file and SQLite
+# caches (and the caches that wrap them), and benchmarks invalidating a tag
+# against scanning the keys of the cache, with 10k keys or the given numbers
+# of keys (ie. `10000,100000,1000000`):
+#
+# >   python cache_tags.py [KEYS,...]
+
+import os
+import sys
+import time
+import tempfile
+from retro.web import cache
+from retro.contrib.cache import (
+    LRUCache,
+    MemoryCache,
+    FileCache,
+    SQLiteCache,
+    TimeoutCache,
+    TieredCache,
+    ShardedCache,
+    cached,
+)
+
+
+def testTags(store, reopen=None):
+    name = store.__class__.__name__
+    calls = []
+
+    @cached(store, tags=lambda user, page: ["user:{0}".format(user)])
+    def timeline(user, page):
+        calls.append((user, page))
+        return "{0}/{1}".format(user, page)
+
+    @cached(store, tags=("pages",), generations=True)
+    def page(n):
+        calls.append(n)
+        return n
+
+    for user in range(3):
+        for n in range(4):
+            timeline(user, n)
+    page(1)
+    page(2)
+    assert len(calls) == 14
+    assert sorted(store.tagged("user:1")) == [
+        "timeline(1,{0},)".format(_) for _ in range(4)
+    ]
+    assert len(store.tagged("timeline")) == 12 and not store.tagged("pages")
+    # Invalidating a tag only removes its keys
+    store.invalidate(tag="user:1")
+    assert not store.tagged("user:1") and store.generation("user:1") == 1
+    del calls[:]
+    for user in range(3):
+        timeline(user, 0)
+    assert calls == [(1, 0)], calls
+    # Generations: the keys are not indexed, but their generation changes
+    store.invalidate(tag="pages")
+    page(1)
+    page(1)
+    assert calls == [(1, 0), 1] and store.generation("pages") == 1
+    # The tags persist (or are shared) for the caches that store them
+    if reopen:
+        store = reopen()
+        assert store.generation("pages") == 1
+        assert len(store.tagged("user:2")) == 4
+    # Invalidating a function removes all its keys
+    store.invalidate(timeline)
+    del calls[:]
+    timeline(2, 3)
+    assert calls == [(2, 3)] and store.generation("timeline") == 1
+    # Explicit tags, and removed keys
+    store.set("a", 1)
+    store.tag("a", "letters")
+    store.set("b", 2)
+    store.tag("b", "letters")
+    store.remove("b")
+    store.invalidate(tag="letters")
+    assert not store.has("a") and not store.tagged("letters")
+    # The keys of `memoized` and `wrap` are tagged with the function name
+    @store.memoized
+    def settings():
+        return {"theme": "dark"}
+
+    @store.wrap(lambda n: "square:{0}".format(n))
+    def square(n):
+        return n * n
+
+    assert settings() == {"theme": "dark"} and square(2) == 4
+    store.invalidate(settings)
+    store.invalidate(square)
+    assert not store.has("settings") and not store.has("square:2")
+    # Calls that fail don't leave their key in the index
+    @cached(store)
+    def fails(n):
+        raise ValueError(n)
+
+    for _ in range(2):
+        try:
+            fails(1)
+        except ValueError:
+            pass
+    assert not store.tagged("fails")
+    print("OK  {0}: tags, functions, generations, failures".format(name))
+
+
+def testIndex(directory):
+    # Evicted keys are removed from the index
+    lru = LRUCache(10)
+    for i in range(100):
+        lru.set(i, i)
+        lru.tag(i, "numbers", "n:{0}".format(i))
+    assert len(lru.tagged("numbers")) == 10 and len(lru.tagIndex.keyTags) == 10
+    # Wrappers use the index of the cache they wrap
+    files = FileCache(os.path.join(directory, "wrapped"))
+    timeout = TimeoutCache(files, timeout=60)
+    timeout.set("a", 1)
+    timeout.tag("a", "letters")
+    assert FileCache(files.path).tagged("letters") == ["a"]
+    # File tags are appended once, and compacted once their keys are removed
+    files = FileCache(os.path.join(directory, "compacted"))
+    files.tagIndex.COMPACT_MIN = 4
+    path = files.tagIndex._path(files.tagIndex.TAGS, "numbers")
+    for _ in range(3):
+        for i in range(10):
+            files.set(str(i), i)
+            files.tag(str(i), "numbers")
+    with open(path, "rb") as f:
+        assert len(f.read().split(b"\n")) == 11
+    for i in range(8):
+        files.remove(str(i))
+    assert sorted(files.tagged("numbers")) == ["8", "9"]
+    with open(path, "rb") as f:
+        assert len(f.read().split()) < 10
+    assert {"8", "9"} <= set(FileCache(files.path).tagged("numbers"))
+    # ...and the evicted keys are discarded
+    files = FileCache(os.path.join(directory, "evicted"), maxSize=1000)
+    for i in range(100):
+        files.set(str(i), b"x" * 100)
+        files.tag(str(i), "numbers")
+    assert len(files.tagged("numbers")) < 100
+    assert len(files.tagIndex.keyTags) == len(files.index)
+    # Tiered caches remove the keys from both tiers
+    sqlite = SQLiteCache(os.path.join(directory, "tiered.sqlite"))
+    tiered = TieredCache(LRUCache(10), sqlite)
+    tiered.set("a", 1)
+    tiered.tag("a", "letters")
+    assert tiered.get("a") == 1
+    tiered.invalidate(tag="letters")
+    assert tiered.get("a") is None and not tiered.l1.has("a")
+    assert not sqlite.has("a")
+    sqlite.close()
+    # SQLite entries lose their tags when removed, expired or evicted
+    sqlite = SQLiteCache(os.path.join(directory, "tags.sqlite"), writeBehind=False)
+    sqlite.set("a", 1, tags=("letters",))
+    sqlite.set("b", 2, expires=0.01, tags=("letters",))
+    time.sleep(0.02)
+    sqlite.evict()
+    assert sqlite.tagged("letters") == ["a"]
+    sqlite.set("a", 3)
+    assert sqlite.tagged("letters") == ["a"]
+    sqlite.remove("a")
+    assert sqlite.tagged("letters") == []
+    # Generations survive clearing the cache
+    sqlite.invalidate(tag="letters")
+    sqlite.clear()
+    assert sqlite.generation("letters") == 1
+    sqlite.close()
+    files.invalidate(tag="letters")
+    files.clear()
+    assert files.generation("letters") == 1
+    print("OK  evictions, wrappers, file compaction, SQLite triggers, clear")
+
+
+def scan(store, prefix):
+    """The previous implementation of `invalidate(function)`"""
+    for k in [k for k in store.keys() if k.startswith(prefix)]:
+        store.remove(k)
+
+
+def timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def benchmark(directory, count):
+    print("{0:,d} keys, invalidating 100 of them:".format(count))
+    for name, store in (
+        ("MemoryCache", MemoryCache(-1)),
+        (
+            "SQLiteCache",
+            SQLiteCache(os.path.join(directory, "{0}.sqlite".format(count))),
+        ),
+    ):
+        for i in range(count):
+            key = "user:{0}:{1}".format(i // 100, i)
+            store.set(key, i)
+            store.tag(key, "user:{0}".format(i // 100))
+        if isinstance(store, SQLiteCache):
+            store.flush()
+        s = timed(lambda: scan(store, "user:1:"))
+        t = timed(lambda: store.invalidate(tag="user:2"))
+        g = timed(lambda: store.tagIndex.advance("user:3"))
+        print(
+            "  {0:12s} scan {1:9.2f}ms  tag {2:7.2f}ms  generation {3:6.3f}ms".format(
+                name, s * 1e3, t * 1e3, g * 1e3
+            )
+        )
+        if isinstance(store, SQLiteCache):
+            store.close()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        testTags(LRUCache(1000))
+        testTags(ShardedCache(1000))
+        testTags(TimeoutCache(MemoryCache(-1), timeout=60))
+        path = os.path.join(directory, "files")
+        testTags(FileCache(path), lambda: FileCache(path))
+        path = os.path.join(directory, "cache.sqlite")
+        # NOTE: Changes written behind are only visible to other instances
+        # once written.
+        testTags(
+            SQLiteCache(path, writeBehind=False),
+            lambda: SQLiteCache(path, writeBehind=False),
+        )
+        testIndex(directory)
+        # `retro.web.cache` tags the keys with the function name
+        store = MemoryCache(-1)
+
+        @cache(store)
+        def double(n):
+            return n * 2
+
+        double(1)
+        double(2)
+        store.invalidate(double)
+        assert store.keys() == []
+        # Keys set otherwise are only invalidated with the function once
+        # they are tagged with its name, as they're not found by prefix.
+        store.set("double:3", 6)
+        store.set("double:4", 8)
+        store.tag("double:4", "double")
+        store.invalidate(double)
+        assert store.keys() == ["double:3"]
+
+        @cache(store)
+        def fails(n):
+            raise ValueError(n)
+
+        try:
+            fails(1)
+        except ValueError:
+            pass
+        assert not store.tagged("fails")
+        print("OK  retro.web.cache: functions, failures")
+    counts = sys.argv[1] if len(sys.argv) > 1 else "10000"
+    for count in (int(_) for _ in counts.split(",")):
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(__file__) or ".") as d:
+            benchmark(d, count)
+
+# EOF
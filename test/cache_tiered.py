@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the `TieredCache` (promotion, write-through, write-back, negative
+# caching and metrics), and benchmarks a `FileCache` alone against an
+# `LRUCache` in front of it:
+#
+# >   python cache_tiered.py [KEYS] [LOOKUPS]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+from retro.contrib.cache import TieredCache, LRUCache, MemoryCache, FileCache, cached
+from retro.metrics import REGISTRY
+
+
+class CountingCache(MemoryCache):
+    """A memory cache that counts the lookups that reach it."""
+
+    def __init__(self):
+        MemoryCache.__init__(self, -1)
+        self.lookups = 0
+
+    def get(self, key):
+        self.lookups += 1
+        return MemoryCache.get(self, key)
+
+    def has(self, key):
+        self.lookups += 1
+        return MemoryCache.has(self, key)
+
+
+class SlowCache(MemoryCache):
+    """A memory cache whose writes wait until they're released."""
+
+    def __init__(self):
+        MemoryCache.__init__(self, -1)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def set(self, key, value):
+        self.writing.set()
+        self.release.wait()
+        return MemoryCache.set(self, key, value)
+
+
+def test(directory):
+    # Write-through, and promotion of l2 hits to l1
+    l1, l2 = LRUCache(2), CountingCache()
+    cache = TieredCache(l1, l2, name="test-through")
+    cache.set("a", 1)
+    assert l1.get("a") == 1 and l2.data["a"] == 1
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert not l1.has("a") and cache.get("a") == 1 and l1.get("a") == 1
+    assert cache.has("b") and sorted(cache.keys()) == ["a", "b", "c"]
+    cache.remove("a")
+    assert cache.get("a") is None and not l2.has("a")
+    stats = cache.stats()
+    assert stats["l1"] == {"hits": 0, "misses": 2}, stats
+    assert stats["l2"] == {"hits": 1, "misses": 1}, stats
+    # Caches with the same name have their own stats, and share the metric
+    other = TieredCache(LRUCache(2), CountingCache(), name="test-through")
+    other.get("a")
+    assert cache.stats()["l1"]["misses"] == 2 and other.stats()["l1"]["misses"] == 1
+    metric = REGISTRY.counter("retro_cache_lookups_total")
+    assert metric.labels("test-through", "l1", "miss").value == 3
+    # Write-back
+    l2 = CountingCache()
+    cache = TieredCache(LRUCache(2), l2, writeBack=True, interval=0.05)
+    for i in range(5):
+        cache.set(i, i)
+    assert all(cache.get(i) == i for i in range(5))
+    time.sleep(0.2)
+    assert sorted(l2.data.keys()) == list(range(5))
+    cache.set("d", 4)
+    cache.stop()
+    assert l2.data["d"] == 4 and not cache.dirty
+    # A removal during a flush is not undone by the flush
+    l2 = SlowCache()
+    cache = TieredCache(LRUCache(1), l2, writeBack=True, interval=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    flush = threading.Thread(target=cache.flush)
+    flush.start()
+    l2.writing.wait()
+    # ...and the values being flushed are still found
+    assert cache.get("a") == 1 and cache.has("b")
+    remove = threading.Thread(target=cache.remove, args=("a",))
+    remove.start()
+    time.sleep(0.05)
+    l2.release.set()
+    flush.join()
+    remove.join()
+    assert not cache.has("a") and "a" not in l2.data and cache.get("b") == 2
+    cache.stop()
+    # Negative caching
+    l2 = CountingCache()
+    cache = TieredCache(LRUCache(10), l2, negative=0.1, name="test-negative")
+    assert cache.get("missing") is None
+    lookups = l2.lookups
+    for _ in range(10):
+        assert cache.get("missing") is None and not cache.has("missing")
+    assert l2.lookups == lookups and cache.stats()["negative"]["hits"] == 10
+    time.sleep(0.15)
+    assert cache.get("missing") is None and l2.lookups == lookups + 1
+    cache.set("missing", 1)
+    assert cache.get("missing") == 1
+    # Works with `@cached` and the LibraryServer has/get/set
+    cache = TieredCache(LRUCache(10), FileCache(os.path.join(directory, "test")))
+    calls = []
+
+    @cached(cache)
+    def square(n):
+        calls.append(n)
+        return n * n
+
+    assert [square(2), square(2), square(3)] == [4, 4, 9] and calls == [2, 3]
+    path = "/lib/js/app.js"
+    assert not cache.has(path)
+    cache.set(path, b"console.log()")
+    assert cache.has(path) and cache.get(path) == b"console.log()"
+    assert FileCache(cache.l2.path).get(path) == b"console.log()"
+    print("OK  promotion, write-through, write-back, negatives, metrics, @cached")
+
+
+def benchmark(directory, count, lookups):
+    value = {"title": "Page", "body": "Lorem ipsum " * 20}
+    keys = ["/page/{0}".format(i) for i in range(count)]
+    # A skewed workload, where 10% of the lookups are for missing keys
+    rnd = random.Random(0)
+    picks = [
+        "/page/{0}".format(int(count * rnd.random() ** 3))
+        if rnd.random() > 0.1
+        else "/missing/{0}".format(rnd.randrange(1000))
+        for _ in range(lookups)
+    ]
+    print("{0:,d} keys, {1:,d} lookups".format(count, lookups))
+    for name, factory in (
+        ("FileCache", lambda path: FileCache(path)),
+        (
+            "TieredCache",
+            lambda path: TieredCache(
+                LRUCache(count // 10), FileCache(path), negative=60, name=path
+            ),
+        ),
+        (
+            "TieredCache+writeBack",
+            lambda path: TieredCache(
+                LRUCache(count // 10),
+                FileCache(path),
+                writeBack=True,
+                negative=60,
+                name=path,
+            ),
+        ),
+    ):
+        cache = factory(os.path.join(directory, name))
+        started = time.perf_counter()
+        for k in keys:
+            cache.set(k, value)
+        w = (time.perf_counter() - started) / count
+        if isinstance(cache, TieredCache):
+            cache.stop()
+        started = time.perf_counter()
+        for k in picks:
+            cache.get(k)
+        r = (time.perf_counter() - started) / lookups
+        stats = (
+            "l1 hit ratio {0:5.1%}".format(
+                cache.l1Hits / (cache.l1Hits + cache.l1Misses)
+            )
+            if isinstance(cache, TieredCache)
+            else ""
+        )
+        print(
+            "  {0:22s} set {1:6.1f}µs  get {2:6.1f}µs  {3}".format(
+                name, w * 1e6, r * 1e6, stats
+            )
+        )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        test(directory)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(__file__) or ".") as d:
+        benchmark(
+            d,
+            int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 200000,
+        )
+
+# EOF
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests conditional requests (`@conditional`, the `conditional` setting and
+# `request.ifChanged`), and replays a traffic sample where clients revalidate
+# their cached copies, to measure the bandwidth saved:
+#
+# >   python conditional_requests.py
+
+import random
+import asyncio
+import inspect
+from retro import *
+from retro.web import conditional
+
+
+class Site(Component):
+    def __init__(self):
+        Component.__init__(self)
+        self.revision = 0
+        self.handled = 0
+
+    @on(GET="/page")
+    @conditional()
+    def page(self, request):
+        return request.respond(
+            "<html><body>"
+            + "<p>Paragraph {0}</p>".format(self.revision) * 2000
+            + "</body></html>"
+        )
+
+    @expose(GET="/api/items")
+    @conditional()
+    def items(self):
+        return [{"id": i, "name": "item {0}".format(i)} for i in range(200)]
+
+    @on(GET="/article")
+    def article(self, request):
+        if not request.ifChanged(self.revision):
+            return request.notModified()
+        self.handled += 1
+        return request.respond("<article>" + "Lorem ipsum " * 1000 + "</article>")
+
+    @on(GET="/plain")
+    def plain(self, request):
+        return request.respond("Always sent")
+
+    @on(GET="/async")
+    @conditional()
+    async def asynchronous(self, request):
+        return request.respond("Async content")
+
+
+def get(app, path, etag=None):
+    """Processes a GET request, returning the status, headers and body."""
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": ""}
+    if etag:
+        environ["HTTP_IF_NONE_MATCH"] = etag
+    result = {}
+
+    def start_response(status, headers):
+        result["status"] = int(status.split(" ", 1)[0])
+        result["headers"] = dict(headers)
+
+    res = app(environ, start_response)
+    if inspect.iscoroutine(res):
+        res = asyncio.run(res).asWSGI(start_response)
+    body = b"".join(res)
+    return result["status"], result["headers"], body
+
+
+def test():
+    site = Site()
+    app = Application(components=[site])
+    for path in ("/page", "/api/items", "/article", "/async"):
+        status, headers, body = get(app, path)
+        assert status == 200 and body and "ETag" in headers, (path, status, headers)
+        status, _, body = get(app, path, headers["ETag"])
+        assert status == 304 and not body, (path, status)
+        status, _, _ = get(app, path, 'W/"other", ' + headers["ETag"])
+        assert status == 304, path
+        status, _, _ = get(app, path, '"other"')
+        assert status == 200, path
+    # Changing the content changes the ETag
+    etag = get(app, "/article")[1]["ETag"]
+    handled = site.handled
+    site.revision += 1
+    assert get(app, "/article", etag)[0] == 200
+    assert site.handled == handled + 1
+    # Handlers are not conditional by default, unless configured so
+    assert "ETag" not in get(app, "/plain")[1]
+    app.configure(conditional=True)
+    status, headers, _ = get(app, "/plain")
+    assert get(app, "/plain", headers["ETag"])[0] == 304
+    print("OK  ETags, 304 responses and request.ifChanged")
+
+
+def replay(sample, revalidate):
+    """Replays the given sample of (client, path) requests, where each client
+    keeps the ETags it was sent when `revalidate` is set, returning the
+    number of body bytes sent and of articles produced."""
+    site = Site()
+    app = Application(components=[site])
+    caches = {}
+    sent = 0
+    for i, (client, path) in enumerate(sample):
+        # The content changes from time to time
+        if i % 500 == 0:
+            site.revision += 1
+        cache = caches.setdefault(client, {})
+        status, headers, body = get(app, path, cache.get(path))
+        if revalidate and status == 200 and "ETag" in headers:
+            cache[path] = headers["ETag"]
+        sent += len(body)
+    return sent, site.handled
+
+
+def benchmark():
+    random.seed(0)
+    paths = ("/page", "/api/items", "/article", "/plain")
+    sample = [(random.randint(0, 50), random.choice(paths)) for _ in range(5000)]
+    before, handled_before = replay(sample, False)
+    after, handled_after = replay(sample, True)
+    print(
+        "Replayed {0} requests from {1} clients: {2:.1f}MB sent in full, {3:.1f}MB with revalidation ({4:.0f}% saved)".format(
+            len(sample),
+            len(set(_[0] for _ in sample)),
+            before / 1024 / 1024,
+            after / 1024 / 1024,
+            100 * (before - after) / before,
+        )
+    )
+    print(
+        "/article produced its content {0} times instead of {1}".format(
+            handled_after, handled_before
+        )
+    )
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
+
+# EOF
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the formatting and parsing of HTTP dates (`HTTPDate`) against the
+# standard library, the `If-Modified-Since` handling of `respondFile`, and
+# benchmarks them against the previous `strptime`-based code:
+#
+# >   python http_dates.py
+
+import os
+import time
+import random
+import tempfile
+from email.utils import formatdate
+from retro.core import Request, Response, HTTPDate, DAYS, MONTHS
+
+
+def test():
+    for _ in range(10000):
+        t = random.randint(0, 2**32)
+        imf = formatdate(t, usegmt=True)
+        assert HTTPDate.Format(t) == imf, (t, imf)
+        assert HTTPDate.Parse(imf) == t, imf
+        g = time.gmtime(t)
+        asctime = time.strftime("%a %b %e %H:%M:%S %Y", g)
+        assert HTTPDate.Parse(asctime) == t, asctime
+    assert HTTPDate.Format(time.gmtime(784111777)) == "Sun, 06 Nov 1994 08:49:37 GMT"
+    assert HTTPDate.Parse("Sunday, 06-Nov-94 08:49:37 GMT") == 784111777
+    assert HTTPDate.Parse("Monday, 19-Oct-26 00:00:00 GMT") == 1792368000
+    for invalid in (
+        "",
+        None,
+        "yesterday",
+        "Sun, 06 Nov 1994 25:49:37 GMT",
+        "Sun, 06 Foo 1994 08:49:37 GMT",
+    ):
+        assert HTTPDate.Parse(invalid) is None, invalid
+    assert HTTPDate.Now() == formatdate(usegmt=True)
+    expires = dict(Response("").cache(hours=1).headers)["Expires"]
+    assert abs(HTTPDate.Parse(expires) - time.time() - 3600) <= 1, expires
+    # Conditional file responses
+    with tempfile.NamedTemporaryFile(suffix=".txt") as f:
+        f.write(b"Hello")
+        f.flush()
+        mtime = int(os.path.getmtime(f.name))
+        for since, status in (
+            (None, 200),
+            (HTTPDate.Format(mtime), 304),
+            (HTTPDate.Format(mtime - 1), 200),
+            (time.strftime("%A, %d-%b-%y %H:%M:%S GMT", time.gmtime(mtime)), 304),
+        ):
+            environ = {"REQUEST_METHOD": "GET"}
+            if since:
+                environ["HTTP_IF_MODIFIED_SINCE"] = since
+            r = Request(environ).respondFile(f.name, lastModified=True)
+            assert r.status == status, (since, r.status)
+            if status == 200:
+                assert dict(r.headers)["Last-Modified"] == HTTPDate.Format(mtime)
+    print("OK  dates match the standard library, If-Modified-Since")
+
+
+def legacyFormat(t):
+    t = time.gmtime(t)
+    return "%s, %02d %s %d %d:%d:%d GMT" % (
+        DAYS[t.tm_wday],
+        t.tm_mday,
+        MONTHS[t.tm_mon - 1],
+        t.tm_year,
+        t.tm_hour,
+        t.tm_min,
+        t.tm_sec,
+    )
+
+
+def legacyParse(text):
+    return time.strptime(text, "%a, %d %b %Y %H:%M:%S GMT")
+
+
+def bench(function, duration=0.1, runs=5):
+    """Returns the best time per call out of the given number of runs."""
+    best = None
+    for _ in range(runs):
+        count = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+        best = min(best or elapsed / count, elapsed / count)
+    return best
+
+
+def benchmark():
+    mtime = 1792368000
+    header = HTTPDate.Format(mtime)
+    fresh = iter(range(mtime, mtime + 10**8))
+    rows = (
+        ("format (legacy)", lambda: legacyFormat(mtime)),
+        ("format mtime", lambda: HTTPDate.Format(mtime)),
+        ("format now+1h", lambda: HTTPDate.Now(3600)),
+        ("format uncached", lambda: HTTPDate.Format(next(fresh), False)),
+        ("parse (strptime)", lambda: legacyParse(header)),
+        ("parse", lambda: HTTPDate.Parse(header)),
+        ("parse uncached", lambda: HTTPDate._Parse(header)),
+    )
+    for name, function in rows:
+        t = bench(function)
+        print("{0:18s} {1:7.3f}µs".format(name, t * 1e6))
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
+
+# EOF
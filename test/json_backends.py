@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Makes sure that all the available JSON backends produce the same output
+# as the stdlib backend, that `asJSON` produces the same output as the
+# recursive serializer with all of them, and prints a benchmark table per
+# backend:
+#
+# >   python json_backends.py
+
+import time
+import datetime
+import collections
+import retro.core
+from retro.core import JSON_BACKENDS, asJSON, json, unjson, setJSONBackend
+
+Point = collections.namedtuple("Point", ("x", "y"))
+
+
+class Exported:
+    def export(self, **options):
+        return {"exported": True}
+
+
+class Custom:
+    def asJSON(self, asJSON, **options):
+        return asJSON("custom")
+
+
+class CustomList(list):
+    def asJSON(self, asJSON, **options):
+        return asJSON({"length": len(self)})
+
+
+class ExportedDict(dict):
+    def export(self, **options):
+        return {"exported": len(self)}
+
+
+CORPUS = (
+    None,
+    True,
+    0,
+    -1,
+    2**63 - 1,
+    2**70,
+    0.1,
+    3.14159,
+    -2.5,
+    "",
+    "ascii",
+    "unicode: é ☃ 𝄞",
+    "escapes: \" \\ / \b \f \n \r \t \x00 \x1f  ",
+    [],
+    {},
+    [1, [2, [3, [4]]]],
+    {"nested": {"list": [1, 2, {"a": None}]}, "empty": []},
+    {1: "int key"},
+    {None: "none key", True: "true key", 1.5: "float key"},
+    {"nested": {None: [CustomList((1, 2)), ExportedDict(a=1)]}},
+    (1, 2, 3),
+    {1, 2, 3},
+    Point(1, 2),
+    datetime.datetime(2026, 10, 19, 12, 30, 45),
+    datetime.date(2026, 10, 19),
+    time.gmtime(0),
+    [Exported(), Custom()],
+    collections.OrderedDict((("b", 1), ("a", 2))),
+)
+
+# These floats are formatted differently (`1e16` vs `1e+16`) by native
+# libraries, so we only check that they decode to the same value.
+EXPONENT_FLOATS = (1e16, 1.5e-7, 1e300)
+
+
+def available():
+    res = []
+    for name in JSON_BACKENDS:
+        try:
+            res.append(retro.core.getJSONBackend(name))
+        except ImportError:
+            pass
+    return res
+
+
+def recursive(value, default=None):
+    raise TypeError("Always uses the recursive serializer")
+
+
+# A backend that always fails, so that `asJSON` uses its recursive
+# serializer, which is the reference.
+RECURSIVE = retro.core.JSONBackend("recursive", recursive, unjson)
+
+
+def expected(value):
+    retro.core.JSON_BACKEND = RECURSIVE
+    as_json = asJSON(value)
+    stdlib = retro.core.getJSONBackend("json")
+    return as_json, stdlib.dumps(value) if isJSONable(value) else None
+
+
+def isJSONable(value):
+    try:
+        retro.core.getJSONBackend("json").dumps(value)
+        return True
+    except TypeError:
+        return False
+
+
+def conformance(backends):
+    reference = [expected(_) for _ in CORPUS]
+    for backend in backends:
+        retro.core.JSON_BACKEND = backend
+        for value, (as_json, as_dumps) in zip(CORPUS, reference):
+            assert asJSON(value) == as_json, (backend, value, asJSON(value), as_json)
+            if as_dumps is not None:
+                dumps = backend.dumps(value)
+                assert dumps == as_dumps, (backend, value, dumps, as_dumps)
+                encoded = as_dumps.encode("utf8")
+                for data in (as_dumps, encoded, memoryview(encoded)):
+                    assert unjson(data) == unjson(as_dumps), (backend, value, data)
+        for value in EXPONENT_FLOATS:
+            assert unjson(backend.dumps(value)) == value, (backend, value)
+        print("OK  {0:12s} conforms".format(backend.name))
+    # `json` keeps the format of the stdlib
+    assert json({"a": ["é", None]}) == '{"a": ["\\u00e9", null]}', json({"a": ["é"]})
+
+
+def payloads():
+    record = {
+        "id": 12345,
+        "name": "Record name",
+        "email": "someone@example.com",
+        "tags": ["a", "b", "c"],
+        "score": 0.75,
+        "active": True,
+        "parent": None,
+        "created": datetime.datetime(2026, 10, 19, 12, 0, 0),
+    }
+    return (
+        ("record", record),
+        ("1k records", [dict(record, id=i) for i in range(1000)]),
+    )
+
+
+def bench(function, value, duration=0.25):
+    count = 0
+    started = time.perf_counter()
+    while True:
+        function(value)
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return elapsed / count
+
+
+def benchmark(backends):
+    print(
+        "{0:12s} {1:12s} {2:>14s} {3:>14s}".format(
+            "backend", "payload", "asJSON", "unjson"
+        )
+    )
+    for name, value in payloads():
+        reference = None
+        for backend in backends:
+            retro.core.JSON_BACKEND = backend
+            encoded = asJSON(value).encode("utf8")
+            t_dumps = bench(asJSON, value)
+            t_loads = bench(unjson, encoded)
+            if reference is None:
+                reference = (t_dumps, t_loads)
+            print(
+                "{0:12s} {1:12s} {2:9.1f}µs {3:3.1f}x {4:9.1f}µs {5:3.1f}x".format(
+                    backend.name,
+                    name,
+                    t_dumps * 1e6,
+                    reference[0] / t_dumps,
+                    t_loads * 1e6,
+                    reference[1] / t_loads,
+                )
+            )
+
+
+if __name__ == "__main__":
+    # We put the stdlib first, as it's the reference
+    backends = sorted(available(), key=lambda _: _.name != "json")
+    conformance(backends)
+    benchmark(backends)
+    setJSONBackend()
+
+# EOF
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the incremental decoding of JSON bodies (`JSONStream` and
+# `request.streamJSON()`), making sure that large bulk payloads are
+# decoded in constant memory with both the sync and async requests:
+#
+# >   python json_stream.py [MEGABYTES]
+
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import tracemalloc
+from retro import *
+from retro.core import JSONStream
+import retro.aio
+
+PORT = 8203
+
+DOCUMENTS = (
+    [],
+    {},
+    [1, 2.5, -3e10, True, False, None, "a", [], {}],
+    [{"id": i, "name": "élément ☃ \"quoted\" {0}".format(i)} for i in range(200)],
+    {"a": [1, 2, {"b": None}], "c": "d", "e": 1234567890123},
+    12345,
+    "a string",
+)
+
+
+def chunks(data, sizes):
+    o = 0
+    while o < len(data):
+        n = random.choice(sizes)
+        yield data[o : o + n]
+        o += n
+
+
+def decode(data, sizes):
+    parser = JSONStream()
+    items = []
+    for chunk in chunks(data, sizes):
+        items.extend(parser.feed(chunk))
+    items.extend(parser.feed(b"", True))
+    return items
+
+
+def testParser():
+    for document in DOCUMENTS:
+        data = json.dumps(document, indent=random.choice((None, 2))).encode("utf8")
+        expected = list(JSONStream.Items(document))
+        for sizes in ((1,), (1, 2, 3, 7), (64,), (len(data) or 1,)):
+            assert decode(data, sizes) == expected, (document, sizes)
+    for invalid in (b"[1,2", b"[1,,2]", b'{"a" 1}', b"[1] 2", b"{1: 2}"):
+        try:
+            decode(invalid, (1, 3))
+            assert False, "Should have failed: {0}".format(invalid)
+        except ValueError:
+            pass
+    print("OK  parser: documents split in arbitrary chunks, invalid documents")
+
+
+def bulk(megabytes):
+    record = b'{"id": 0, "name": "record", "tags": ["a", "b", "c"], "value": 3.14159},'
+    count = megabytes * 1024 * 1024 // len(record)
+    return b"[" + record * (count - 1) + record[:-1] + b"]", count
+
+
+def testRequest(megabytes):
+    data, count = bulk(megabytes)
+    request = Request(
+        {
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(data)),
+            "wsgi.input": io.BufferedReader(io.BytesIO(data)),
+        }
+    )
+    tracemalloc.start()
+    started = time.perf_counter()
+    n = sum(1 for _ in request.streamJSON())
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert n == count, (n, count)
+    assert peak < 4 * 1024 * 1024, "Streaming should use constant memory"
+    print(
+        "OK  sync:  {0:,} records ({1}MB) in {2:.2f}s, peak Python heap {3:.1f}MB".format(
+            n, megabytes, elapsed, peak / 1024 / 1024
+        )
+    )
+    # Small bodies are decoded at once
+    small = Request(
+        {
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": "13",
+            "wsgi.input": io.BufferedReader(io.BytesIO(b'{"a":1,"b":2}')),
+        }
+    )
+    assert list(small.streamJSON()) == [("a", 1), ("b", 2)]
+
+
+class Bulk(Component):
+    @on(POST="/bulk")
+    async def bulk(self, request):
+        count = 0
+        async for record in request.streamJSON():
+            count += 1
+        return request.returns(count)
+
+
+async def testAsync(megabytes):
+    data, count = bulk(megabytes)
+    app = Application(components=[Bulk()])
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+        tracemalloc.start()
+        started = time.perf_counter()
+        writer.write(
+            "POST /bulk HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: {0}\r\n\r\n".format(
+                len(data)
+            ).encode("ascii")
+        )
+        view = memoryview(data)
+        for i in range(0, len(data), 256 * 1024):
+            writer.write(view[i : i + 256 * 1024])
+            await writer.drain()
+        response = await reader.read()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        writer.close()
+    finally:
+        server.close()
+    n = int(response.rsplit(b"\r\n", 1)[-1])
+    assert n == count, (n, count)
+    print(
+        "OK  async: {0:,} records ({1}MB) in {2:.2f}s, peak Python heap {3:.1f}MB".format(
+            n, megabytes, elapsed, peak / 1024 / 1024
+        )
+    )
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    testParser()
+    testRequest(megabytes)
+    asyncio.run(testAsync(megabytes))
+
+# EOF
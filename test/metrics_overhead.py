@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Measures the per-request overhead of the metrics instrumentation by
+# dispatching the same requests with `retro.metrics.ENABLED` on and off
+# (see `metrics_registry.py` for the tests of the metrics themselves).
+
+import time
+from retro import *
+from retro import metrics
+
+N = 50000
+
+
+class Main(Component):
+
+    @on(GET="/hello/{name}")
+    def hello(self, request, name):
+        return request.respond("Hello " + name)
+
+    @expose(GET="/api")
+    def api(self):
+        return {"status": "ok"}
+
+
+def environ(path):
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "CONTENT_TYPE": None,
+        "CONTENT_LENGTH": None,
+    }
+
+
+def start_response(status, headers):
+    pass
+
+
+def bench(app, enabled):
+    metrics.ENABLED = enabled
+    dispatcher = app.dispatcher()
+    started = time.perf_counter()
+    for i in range(N):
+        for path in ("/hello/world", "/api"):
+            for _ in dispatcher(environ(path), start_response):
+                pass
+    return (time.perf_counter() - started) / (N * 2)
+
+
+if __name__ == "__main__":
+    app = Application(components=[Main()])
+    app.start()
+    bench(app, True)
+    without = min(bench(app, False) for _ in range(3))
+    with_metrics = min(bench(app, True) for _ in range(3))
+    print("Request without metrics: {0:6.2f}µs".format(without * 1e6))
+    print("Request with metrics   : {0:6.2f}µs".format(with_metrics * 1e6))
+    print("Overhead               : {0:6.2f}µs".format((with_metrics - without) * 1e6))
+
+# EOF
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the metrics registry (`retro.metrics`): totals of counters, gauges
+# and histograms updated from many threads, the merging of the shards of
+# the threads that ended, and the Prometheus text output:
+#
+# >   python metrics_registry.py
+
+import threading
+from retro.metrics import Registry
+
+THREADS = 8
+COUNT = 10000
+
+
+def inThreads(function, count=THREADS):
+    threads = [threading.Thread(target=function) for _ in range(count)]
+    for _ in threads:
+        _.start()
+    for _ in threads:
+        _.join()
+
+
+def testThreads():
+    registry = Registry()
+    counter = registry.counter("hits_total", labels=("route",)).labels("/")
+    gauge = registry.gauge("active")
+    histogram = registry.histogram("latency_seconds", buckets=(0.1, 1.0))
+
+    def work():
+        for i in range(COUNT):
+            counter.inc()
+            gauge.inc()
+            histogram.observe(0.5 if i % 2 else 2.0)
+        gauge.dec(COUNT)
+
+    inThreads(work)
+    assert counter.value == THREADS * COUNT, counter.value
+    assert gauge.value == 0, gauge.value
+    half = THREADS * COUNT // 2
+    assert histogram.merged() == [0, half, half, half * 2.5], histogram.merged()
+    assert histogram.count == THREADS * COUNT and histogram.sum == half * 2.5
+    # The shards of the threads that ended are merged into the base
+    assert not counter._shards and not histogram._shards, counter._shards
+    # Many short-lived threads don't leak shards
+    for _ in range(10):
+        inThreads(counter.inc, 50)
+    assert counter.value == THREADS * COUNT + 500 and not counter._shards
+    print("OK  totals across threads, shards of ended threads")
+
+
+def testGaugeSet():
+    registry = Registry()
+    gauge = registry.gauge("queue")
+    started = threading.Event()
+    stop = threading.Event()
+    counts = []
+
+    def work():
+        n = 0
+        started.set()
+        while not stop.is_set():
+            gauge.inc()
+            n += 1
+        counts.append(n)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+    # Setting the gauge keeps the shard that's being incremented, so the
+    # increments done after the set are all counted.
+    before = gauge.value
+    gauge.set(-1000000)
+    stop.set()
+    thread.join()
+    assert -1000000 <= gauge.value <= -1000000 + counts[0] - before, gauge.value
+    gauge.set(3)
+    assert gauge.value == 3
+    gauge.inc()
+    assert gauge.value == 4
+    print("OK  gauge set with concurrent increments")
+
+
+def testPrometheus():
+    registry = Registry()
+    registry.counter("hits_total", "Number of hits", ("route",)).labels('/"a"').inc(3)
+    registry.gauge("active").set(2)
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    inThreads(lambda: histogram.observe(0.5), 2)
+    histogram.observe(5)
+    assert registry.asPrometheus() == "\n".join(
+        (
+            "# TYPE active gauge",
+            "active 2",
+            "# HELP hits_total Number of hits",
+            "# TYPE hits_total counter",
+            'hits_total{route="/\\"a\\""} 3',
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 0',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 6.0",
+            "latency_seconds_count 3",
+            "",
+        )
+    ), registry.asPrometheus()
+    print("OK  Prometheus text output")
+
+
+if __name__ == "__main__":
+    testThreads()
+    testGaugeSet()
+    testPrometheus()
+
+# EOF
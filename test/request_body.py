@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the buffering of request bodies (in memory or spilled to a file),
+# and benchmarks the loading of 1KB, 200KB and 5MB JSON bodies against the
+# previous `SpooledTemporaryFile` strategy:
+#
+# >   python request_body.py
+
+import io
+import json
+import time
+import tempfile
+from retro.core import Request, RequestBody
+
+SIZES = (("1KB", 1024), ("200KB", 200 * 1024), ("5MB", 5 * 1024 * 1024))
+
+
+def payload(size):
+    items = []
+    length = 2
+    while length < size:
+        item = {"id": len(items), "name": "item-{0}".format(len(items))}
+        items.append(item)
+        length += len(json.dumps(item)) + 2
+    return json.dumps(items).encode("utf8")
+
+
+def request(body, requestClass=Request):
+    return requestClass(
+        {
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BufferedReader(io.BytesIO(body)),
+        }
+    )
+
+
+class SpooledBody(tempfile.SpooledTemporaryFile):
+    """The previous strategy: the input is read and copied into a spooled
+    file, which is then read back."""
+
+    def fill(self, stream, size):
+        return self.write(stream.read(size))
+
+    def view(self):
+        self.seek(0)
+        return memoryview(self.read())
+
+
+class SpooledRequest(Request):
+    def createRequestBody(self, size):
+        return SpooledBody(max_size=64 * 1024)
+
+
+def legacy(body):
+    r = request(body, SpooledRequest)
+    r.load(decode=False)
+    return r.data(asView=True)
+
+
+def current(body):
+    r = request(body)
+    r.load(decode=False)
+    return r.data(asView=True)
+
+
+def bench(function, body, duration=0.5):
+    count = 0
+    started = time.perf_counter()
+    while True:
+        function(body)
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return elapsed / count
+
+
+def test():
+    body = payload(200 * 1024)
+    # In memory
+    r = request(body)
+    assert r.data() == body
+    assert r._data.isInMemory
+    assert bytes(r.data(asView=True)) == body
+    assert len(r.params()[""]) == len(json.loads(body))
+    # Spilled to a file
+    class SpillingRequest(Request):
+        BODY_MEMORY_LIMIT = 64 * 1024
+        BODY_DIRECTORY = tempfile.gettempdir()
+
+    r = request(body, SpillingRequest)
+    assert r.data() == body
+    assert not r._data.isInMemory
+    assert len(r.params()[""]) == len(json.loads(body))
+    # Setting the data
+    r = request(b"")
+    r.data(b'{"a":1}')
+    assert r.data() == b'{"a":1}'
+    # File-like access
+    b = RequestBody(4, 1024)
+    b.write(b"abcd")
+    b.seek(1)
+    assert b.read(2) == b"bc" and b.tell() == 3
+    print("OK  in-memory, spilled and file-like bodies")
+
+
+def benchmark():
+    for name, size in SIZES:
+        body = payload(size)
+        t_legacy = bench(legacy, body)
+        t_current = bench(current, body)
+        print(
+            "{0:>6s} spooled file {1:8.1f}µs   preallocated {2:8.1f}µs   {3:.1f}x".format(
+                name, t_legacy * 1e6, t_current * 1e6, t_legacy / t_current
+            )
+        )
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
+
+# EOF
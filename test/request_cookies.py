@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the parsing of the `Cookie` header and the setting of cookies
+# (`request.cookie` and `response.setCookie`), and benchmarks a realistic
+# 4KB header against `SimpleCookie`:
+#
+# >   python request_cookies.py
+
+import time
+from http.cookies import SimpleCookie
+from retro.core import Request, Response, parseCookies
+
+# A typical header, with analytics, consent and session cookies
+COOKIES = [
+    ("_ga", "GA1.2.1234567890.1697712345"),
+    ("_gid", "GA1.2.987654321.1697712345"),
+    ("sessionid", "s%3Aab12cd34ef56.Zm9vYmFyYmF6cXV4"),
+    ("consent", '"{%22necessary%22:true%2C%22analytics%22:false}"'),
+    ("lang", "fr"),
+] + [("pref_{0}".format(i), "v{0}-".format(i) * 12) for i in range(72)]
+HEADER = "; ".join("{0}={1}".format(k, v) for k, v in COOKIES)
+
+
+def request(header):
+    return Request({"REQUEST_METHOD": "GET", "HTTP_COOKIE": header})
+
+
+def test():
+    cookies = request(HEADER).cookies()
+    reference = SimpleCookie()
+    reference.load(HEADER)
+    assert sorted(cookies) == sorted(reference), set(reference) ^ set(cookies)
+    for k in reference:
+        assert cookies[k] == reference[k].value.strip('"'), k
+    assert request(HEADER).cookie("sessionid") == "s:ab12cd34ef56.Zm9vYmFyYmF6cXV4"
+    assert request(HEADER).cookie("missing") is None
+    # SimpleCookie stops at the first invalid pair, we skip it
+    assert parseCookies("a=1; broken; b=2; a=3") == {"a": "1", "b": "2"}
+    assert parseCookies("") == parseCookies(None) == {}
+    # Setting cookies replaces the ones with the same name and path
+    r = request("")
+    r.cookie("lang", "en")
+    r.cookie("user", "Jane Doe", path="/app")
+    r.cookie("lang", "de")
+    assert r._responseHeaders == [
+        ("Set-Cookie", "lang=de; path=/"),
+        ("Set-Cookie", "user=Jane%20Doe; path=/app"),
+    ], r._responseHeaders
+    assert r.cookie("user") == "Jane Doe"
+    response = Response("", headers=[("Cache-Control", "no-cache")])
+    response.setCookie("a", "1").setCookie("b", "2").setCookie("a", "3", path="/x")
+    response.cache(seconds=10)
+    response.setCookie("a", "4")
+    assert [_ for _ in response.headers if _[0] == "Set-Cookie"] == [
+        ("Set-Cookie", "a=4; path=/"),
+        ("Set-Cookie", "b=2; path=/"),
+        ("Set-Cookie", "a=3; path=/x"),
+    ], response.headers
+    print("OK  cookies match SimpleCookie, setting cookies")
+
+
+def bench(function, duration=0.1, runs=5):
+    """Returns the best time per call out of the given number of runs."""
+    best = None
+    for _ in range(runs):
+        count = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+        best = min(best or elapsed / count, elapsed / count)
+    return best
+
+
+def legacy():
+    cookies = SimpleCookie()
+    cookies.load(HEADER)
+    return cookies.get("lang").value
+
+
+def benchmark():
+    rows = (
+        ("SimpleCookie", legacy),
+        ("parseCookies", lambda: parseCookies(HEADER)["lang"]),
+        ("request.cookie", lambda: request(HEADER).cookie("lang")),
+    )
+    reference = None
+    print("Cookie header of {0} bytes, {1} cookies".format(len(HEADER), len(COOKIES)))
+    for name, function in rows:
+        t = bench(function)
+        reference = reference or t
+        print("{0:16s} {1:8.2f}µs {2:5.1f}x".format(name, t * 1e6, reference / t))
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
+
+# EOF
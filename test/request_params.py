@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the lazy parsing of request parameters (`Params`) against
+# `parse_qs`, and benchmarks a long tracking-style query string:
+#
+# >   python request_params.py
+
+import io
+import time
+import json
+from urllib.parse import parse_qs, quote
+import retro.core
+from retro.core import Request, Params, asJSON, unjson
+
+QUERY = "&".join(
+    ["utm_source=newsletter", "utm_medium=email", "utm_campaign=autumn%202026"]
+    + ["p{0}={1}".format(i, quote("value {0} é/&=".format(i))) for i in range(50)]
+    + ["tag=a", "tag=b", "tag=c", "q=search+terms+here"]
+)
+
+
+def legacy(query):
+    """The previous parsing: `parse_qs` and `_addParam`."""
+    params = {}
+    for k, v in parse_qs(query).items():
+        if v and type(v) is list and len(v) == 1:
+            v = v[0]
+        if k not in params:
+            params[k] = v
+        elif type(params[k]) is list:
+            params[k].append(v)
+        else:
+            params[k] = [params[k], v]
+    return params
+
+
+def request(query, body=None, contentType=None):
+    return Request(
+        {
+            "REQUEST_METHOD": "POST" if body else "GET",
+            "QUERY_STRING": query,
+            "CONTENT_TYPE": contentType,
+            "CONTENT_LENGTH": str(len(body)) if body else "",
+            "wsgi.input": io.BufferedReader(io.BytesIO(body or b"")),
+        }
+    )
+
+
+def test():
+    assert request(QUERY).params() == legacy(QUERY)
+    assert request(QUERY).params().getlist("tag") == ["a", "b", "c"]
+    assert request(QUERY).params().getlist("p1") == ["value 1 é/&="]
+    for query in ("page", "a=&b=1", "a=1;b=2", "%zz=%zz", ""):
+        assert request(query).params() == (legacy(query) or {}) or query == "page"
+    assert request("page").params() == {"page": "", "": "page"}
+    # URL-encoded forms are decoded with their charset, and keep the
+    # parameters from the query string.
+    r = request(
+        "a=1",
+        "b=%E9t%E9&a=2".encode("ascii"),
+        "application/x-www-form-urlencoded; charset=latin-1",
+    )
+    assert r.params(load=True) == {"a": ["1", "2"], "b": "été"}, r.params()
+    print("OK  params match parse_qs, repeated keys and charsets")
+
+
+def testJSON(backend):
+    # The stdlib encoder reads the dictionary storage, which is only filled
+    # once the parameters are parsed.
+    retro.core.setJSONBackend(backend)
+    try:
+        params = request(QUERY).params()
+        assert json.loads(json.dumps(params)) == legacy(QUERY)
+        assert unjson(asJSON(params)) == legacy(QUERY)
+        assert asJSON(Params().feed("a=1&b=%202")) == '{"a":"1","b":" 2"}'
+        assert asJSON({"x": Params().feed("a=1")}) == '{"x":{"a":"1"}}'
+        r = request("a=1", b"b=2", "application/x-www-form-urlencoded")
+        assert json.loads(json.dumps(r.params(load=True))) == {"a": "1", "b": "2"}
+    finally:
+        retro.core.setJSONBackend()
+    print("OK  params serialize with the {0} backend".format(backend))
+
+
+def bench(function, duration=0.1, runs=5):
+    """Returns the best time per call out of the given number of runs."""
+    best = None
+    for _ in range(runs):
+        count = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+        best = min(best or elapsed / count, elapsed / count)
+    return best
+
+
+def benchmark():
+    encoded = QUERY.encode("ascii")
+    rows = (
+        ("parse_qs + _addParam", lambda: legacy(QUERY)["utm_source"]),
+        ("Params, one key", lambda: Params().feed(QUERY)["utm_source"]),
+        ("Params, all keys", lambda: list(Params().feed(QUERY).items())),
+        ("Params (bytes), one key", lambda: Params().feed(encoded)["utm_source"]),
+        ("Params, no access", lambda: Params().feed(QUERY)),
+    )
+    reference = None
+    print("Query string with {0} parameters".format(QUERY.count("&") + 1))
+    for name, function in rows:
+        t = bench(function)
+        reference = reference or t
+        print("{0:26s} {1:7.2f}µs {2:5.1f}x".format(name, t * 1e6, reference / t))
+
+
+if __name__ == "__main__":
+    test()
+    for backend in retro.core.JSON_BACKENDS:
+        try:
+            retro.core.getJSONBackend(backend)
+        except ImportError:
+            continue
+        testJSON(backend)
+    benchmark()
+
+# EOF
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Project   : Retro Test Suite
+# -----------------------------------------------------------------------------
+# Author    : Sebastien Pierre                            <sebastien@ffctn.com>
+# -----------------------------------------------------------------------------
+# Creation  : 19-Oct-2026
+# Last mod  : 19-Oct-2026
+# -----------------------------------------------------------------------------
+
+# Tests the full-page response cache (`ResponseCache`) with the memory and
+# file backends, and benchmarks the latency of cached hits against the
+# handlers themselves:
+#
+# >   python response_cache.py
+
+import gzip
+import time
+import asyncio
+import inspect
+import tempfile
+from retro import *
+from retro.web import conditional
+from retro.contrib.cache import ResponseCache, MemoryCache, FileCache
+import retro.aio
+
+PORT = 8204
+
+
+class Site(Component):
+    def __init__(self):
+        Component.__init__(self)
+        self.calls = 0
+
+    @on(GET="/page")
+    def page(self, request):
+        self.calls += 1
+        rows = "".join(
+            "<tr><td>{0}</td><td>{1}</td></tr>".format(i, request.param("q"))
+            for i in range(500)
+        )
+        return request.respond("<table>" + rows + "</table>").cache(minutes=5)
+
+    @on(GET="/localized")
+    def localized(self, request):
+        self.calls += 1
+        language = request.header("Accept-Language") or "en"
+        return request.respond(
+            language, headers=[("Vary", "Accept-Language")]
+        ).cache(minutes=5)
+
+    @on(GET="/private")
+    def private(self, request):
+        self.calls += 1
+        return request.respond("Private", headers=[("Cache-Control", "private, max-age=60")])
+
+    @on(GET="/session")
+    def session(self, request):
+        self.calls += 1
+        request.cookie("session", "1234")
+        return request.respond("Session").cache(minutes=5)
+
+    @on(GET="/uncached")
+    def uncached(self, request):
+        self.calls += 1
+        return request.respond("Uncached")
+
+    @on(GET="/tagged")
+    @conditional()
+    def tagged(self, request):
+        self.calls += 1
+        return request.respond("Tagged").cache(minutes=5)
+
+    @expose(GET="/api/items")
+    def items(self):
+        self.calls += 1
+        return [{"id": i, "name": "item {0}".format(i)} for i in range(200)]
+
+    @on(GET="/api/public")
+    def publicItems(self, request):
+        self.calls += 1
+        return request.returns(
+            [{"id": i, "name": "item {0}".format(i)} for i in range(200)],
+            headers=[("Cache-Control", "public")],
+        )
+
+    @on(GET="/hello")
+    def hello(self, request):
+        self.calls += 1
+        return request.respond("hello " + (request.cookie("user") or "nobody"))
+
+
+def get(app, path, **headers):
+    """Processes a GET request, returning the status, headers and body."""
+    path, _, query = path.partition("?")
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query}
+    for k, v in headers.items():
+        environ["HTTP_" + k.upper()] = v
+    result = {}
+
+    def start_response(status, headers):
+        result["status"] = int(status.split(" ", 1)[0])
+        result["headers"] = dict(headers)
+
+    res = app(environ, start_response)
+    if inspect.iscoroutine(res):
+        res = asyncio.run(res).asWSGI(start_response)
+    body = b"".join(res)
+    return result["status"], result["headers"], body
+
+
+def testCache(store):
+    site = Site()
+    app = Application(components=[site])
+    cache = ResponseCache(store).install(app)
+    # Hits don't invoke the handler, and the query is normalized
+    _, _, body = get(app, "/page?q=1&r=2")
+    status, headers, cached = get(app, "/page?r=2&q=1")
+    assert site.calls == 1 and status == 200 and cached == body
+    assert "Age" in headers and "max-age=300" in headers["Cache-Control"]
+    get(app, "/page?q=2")
+    assert site.calls == 2
+    # Precompressed variant
+    status, headers, compressed = get(app, "/page?q=1&r=2", accept_encoding="gzip")
+    assert headers.get("Content-Encoding") == "gzip", headers
+    assert gzip.decompress(compressed) == body and site.calls == 2
+    assert "Accept-Encoding" in headers["Vary"]
+    # Vary
+    assert get(app, "/localized", accept_language="fr")[2] == b"fr"
+    assert get(app, "/localized", accept_language="de")[2] == b"de"
+    assert get(app, "/localized", accept_language="fr")[2] == b"fr"
+    assert site.calls == 4, site.calls
+    # Not cacheable
+    calls = site.calls
+    for path in ("/private", "/session", "/uncached", "/private", "/session", "/uncached"):
+        get(app, path)
+    assert site.calls == calls + 6
+    # Bypassed
+    calls = site.calls
+    get(app, "/page?q=1&r=2", authorization="Basic Zm9vOmJhcg==")
+    get(app, "/page?q=1&r=2", cache_control="no-cache")
+    assert site.calls == calls + 2
+    # Conditional requests are answered from the cache
+    etag = get(app, "/tagged")[1]["ETag"]
+    calls = site.calls
+    status, _, body = get(app, "/tagged", if_none_match=etag)
+    assert status == 304 and not body and site.calls == calls
+    # The default max age only applies to public responses
+    cache.maxAge = 60
+    a = get(app, "/api/public")[2]
+    calls = site.calls
+    assert get(app, "/api/public")[2] == a and site.calls == calls
+    get(app, "/api/items")
+    get(app, "/api/items")
+    assert site.calls == calls + 2
+    # Responses to requests with cookies are never shared
+    assert get(app, "/hello", cookie="user=alice")[2] == b"hello alice"
+    assert get(app, "/hello", cookie="user=bob")[2] == b"hello bob"
+    assert get(app, "/hello")[2] == b"hello nobody"
+    assert get(app, "/hello", cookie="user=alice")[2] == b"hello alice"
+    get(app, "/page?q=1&r=2", cookie="user=bob")
+    assert site.calls == calls + 7, site.calls
+    # Responses are keyed by host
+    calls = site.calls
+    assert get(app, "/page?q=3", host="a.example.com")[2] != b""
+    get(app, "/page?q=3", host="b.example.com")
+    get(app, "/page?q=3", host="a.example.com")
+    assert site.calls == calls + 2
+    cache.invalidate("/page", "q=3", host="a.example.com")
+    get(app, "/page?q=3", host="a.example.com")
+    get(app, "/page?q=3", host="b.example.com")
+    assert site.calls == calls + 3
+    calls = site.calls
+    # Invalidation
+    cache.invalidate("/localized")
+    get(app, "/localized", accept_language="fr")
+    assert site.calls == calls + 1
+    print("OK  {0}: hits, Vary, Cache-Control, cookies, hosts, gzip variants, 304".format(
+        store.__class__.__name__))
+
+
+async def testAsync():
+    site = Site()
+    app = Application(components=[site])
+    ResponseCache().install(app)
+    server = await asyncio.start_server(
+        retro.aio.Server(app, "127.0.0.1", PORT).request, "127.0.0.1", PORT
+    )
+    try:
+        for language in ("fr", "de", "fr", "de"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+            writer.write(
+                "GET /localized HTTP/1.1\r\nAccept-Language: {0}\r\n\r\n".format(
+                    language
+                ).encode("ascii")
+            )
+            response = await reader.read()
+            writer.close()
+            assert response.endswith(language.encode("ascii")), response
+    finally:
+        server.close()
+    assert site.calls == 2, site.calls
+    print("OK  aio: Vary on request headers")
+
+
+def bench(function, duration=0.1, runs=5):
+    """Returns the best time per call out of the given number of runs."""
+    best = None
+    for _ in range(runs):
+        count = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+        best = min(best or elapsed / count, elapsed / count)
+    return best
+
+
+def benchmark(directory):
+    stores = (
+        ("no cache", None),
+        ("MemoryCache", MemoryCache()),
+        ("FileCache", FileCache(directory)),
+    )
+    for path in ("/page?q=1", "/api/public"):
+        print(path)
+        reference = None
+        for name, store in stores:
+            app = Application(components=[Site()])
+            if store is not None:
+                ResponseCache(store, maxAge=60).install(app)
+            t = bench(lambda: get(app, path, accept_encoding="gzip"))
+            reference = reference or t
+            print("  {0:12s} {1:8.1f}µs {2:6.1f}x".format(name, t * 1e6, reference / t))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        testCache(MemoryCache())
+        testCache(FileCache(directory))
+        asyncio.run(testAsync())
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark(directory)
+
+# EOF